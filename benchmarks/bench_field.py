@@ -0,0 +1,204 @@
+""" Benchmarks for :class:`deform.Field` and :class:`deform.Form`
+construction.
+
+Run from a checkout with deform importable::
+
+  $ python benchmarks/bench_field.py
+"""
+import gc
+import sys
+import time
+
+import colander
+
+from deform import Form
+
+def wide_schema(width=400):
+    schema = colander.SchemaNode(colander.Mapping())
+    for num in range(width):
+        schema.add(colander.SchemaNode(colander.String(),
+                                       name='field%s' % num))
+    return schema
+
+def deep_schema(depth=50, width=8):
+    schema = colander.SchemaNode(colander.Mapping())
+    node = schema
+    for level in range(depth):
+        for num in range(width):
+            node.add(colander.SchemaNode(colander.String(),
+                                         name='field%s' % num))
+        child = colander.SchemaNode(colander.Mapping(),
+                                    name='level%s' % level)
+        node.add(child)
+        node = child
+    return schema
+
+def branchy_schema(sections=50, subsections=9, leaves=10):
+    # 1 + 50 + 50 * 9 + 50 * 9 * 10 = 5001 nodes
+    schema = colander.SchemaNode(colander.Mapping())
+    for snum in range(sections):
+        section = colander.SchemaNode(colander.Mapping(),
+                                      name='section%s' % snum)
+        for ssnum in range(subsections):
+            subsection = colander.SchemaNode(colander.Mapping(),
+                                             name='sub%s' % ssnum)
+            for num in range(leaves):
+                subsection.add(colander.SchemaNode(colander.String(),
+                                                   name='field%s' % num))
+            section.add(subsection)
+        schema.add(section)
+    return schema
+
+def materialized(field):
+    # fields of a tree which exist, without materializing lazy children
+    yield field
+    for child in field._children or ():
+        for subfield in materialized(child):
+            yield subfield
+
+def field_bytes(field):
+    # the field, its instance dictionary (if one was ever allocated:
+    # reading ``field.__dict__`` would allocate one) and its children
+    # list; shared objects (schema, widget, renderer...) are not counted
+    size = sys.getsizeof(field)
+    for referent in gc.get_referents(field):
+        if referent.__class__ is dict and referent is not field._kw:
+            size += sys.getsizeof(referent)
+    if field._children is not None:
+        size += sys.getsizeof(field._children)
+    return size
+
+class LegacyField(object):
+    # the per-field layout of deform 0.9: every attribute, the schema
+    # aliases and the constructor keywords in an instance dictionary
+    def __init__(self, field):
+        self.__dict__.update(field._kw)
+        self.counter = field.counter
+        self.order = field.order
+        self.oid = field.oid
+        self.schema = field.schema
+        self.typ = field.typ
+        self.renderer = field.renderer
+        self.resource_registry = field.resource_registry
+        self.name = field.name
+        self.title = field.title
+        self.description = field.description
+        self.required = field.required
+        self.children = list(field.children)
+        self.widget = field.widget
+
+def legacy_field_bytes(field):
+    legacy = LegacyField(field)
+    return (sys.getsizeof(legacy) + sys.getsizeof(legacy.__dict__) +
+            sys.getsizeof(legacy.children))
+
+def walk(field):
+    yield field
+    for child in field.children:
+        for subfield in walk(child):
+            yield subfield
+
+def timed(func, number=1):
+    # ``timeit.timeit(func, number=number)``, which needs Python 2.6
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        return time.time() - start
+    finally:
+        if enabled:
+            gc.enable()
+
+def best(func, number):
+    return min([ timed(func, number) for i in range(3) ]) / number
+
+def report(label, seconds):
+    print '%-50s %10.1f usec' % (label, seconds * 1000000)
+
+def bench_blueprint(number=200):
+    print 'Form(schema) versus Form.compile(schema)()'
+    for label, schema in (('wide (400 fields)', wide_schema()),
+                          ('deep (50 levels x 9 fields)', deep_schema())):
+        def construct():
+            # a render resolves every field's widget
+            for field in walk(Form(schema, buttons=('submit',))):
+                field.widget
+        blueprint = Form.compile(schema, buttons=('submit',))
+        constructed = best(construct, number)
+        stamped = best(blueprint, number)
+        report('  %s: Form(schema)' % label, constructed)
+        report('  %s: blueprint()' % label, stamped)
+        print '  %s: speedup %.1fx' % (label, constructed / stamped)
+
+def bench_lazy(number=20):
+    print 'Eager versus lazy construction, touching a single branch'
+    schema = branchy_schema()
+    def touch(lazy):
+        form = Form(schema, lazy=lazy)
+        form['section7']['sub3'].render()
+        return form
+    for label, lazy in (('eager', False), ('lazy', True)):
+        form = touch(lazy)
+        fields = list(materialized(form))
+        nbytes = sum([field_bytes(field) for field in fields])
+        report('  %s: construct and render one branch' % label,
+               best(lambda: touch(lazy), number))
+        print '  %s: %s fields, ~%s KB' % (label, len(fields), nbytes / 1024)
+
+def bench_memory():
+    print 'Bytes per field (excluding shared schema, widget and renderer)'
+    if not hasattr(sys, 'getsizeof'):
+        print '  (needs Python 2.6)'
+        return
+    for label, kw in (('no extra keywords', {}),
+                      ('two extra keywords', {'foo':1, 'bar':2})):
+        form = Form(branchy_schema(), **kw)
+        fields = list(walk(form))[1:] # the root is a Form
+        for field in fields:
+            field.widget
+        before = sum([legacy_field_bytes(field) for field in fields])
+        after = sum([field_bytes(field) for field in fields])
+        print '  %s: %s fields' % (label, len(fields))
+        print '    before (instance dict): %6.0f bytes/field' % (
+            float(before) / len(fields))
+        print '    after (slots):          %6.0f bytes/field' % (
+            float(after) / len(fields))
+
+def bench_set_widgets(widths=(500, 2000, 8000), keys=500, number=20):
+    from deform.widget import TextAreaWidget
+    print 'set_widgets with %s keys, cost per key' % keys
+    for width in widths:
+        form = Form(wide_schema(width))
+        step = width / keys
+        values = dict([('field%s' % (num * step), TextAreaWidget())
+                       for num in range(keys)])
+        report('  %s fields' % width,
+               best(lambda: form.set_widgets(values), number) / keys)
+
+def bench_shared_widgets(number=50):
+    from deform import Field
+    print 'Default widget resolution for 400 fields, per request'
+    schema = wide_schema()
+    def resolve():
+        return [field.widget for field in walk(Form(schema))]
+    for label, share in (('not shared', False), ('shared', True)):
+        Field.share_default_widgets = share
+        try:
+            widgets = resolve()
+            report('  %s' % label, best(resolve, number))
+            print '  %s: %s distinct widgets' % (
+                label, len(set(map(id, resolve() + widgets))))
+        finally:
+            Field.share_default_widgets = False
+
+def main():
+    bench_memory()
+    bench_shared_widgets()
+    bench_set_widgets()
+    bench_blueprint()
+    bench_lazy()
+
+if __name__ == '__main__':
+    main()
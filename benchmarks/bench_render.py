@@ -0,0 +1,419 @@
+""" Benchmarks for rendering forms with :class:`deform.Form`.
+
+Run from a checkout with deform importable::
+
+  $ python benchmarks/bench_render.py
+"""
+import gc
+import itertools
+import os
+import resource
+import time
+
+import colander
+
+from deform import Form
+
+class Row(colander.MappingSchema):
+    name = colander.SchemaNode(colander.String())
+    email = colander.SchemaNode(colander.String())
+    age = colander.SchemaNode(colander.Integer())
+
+class Rows(colander.SequenceSchema):
+    row = Row()
+
+class Table(colander.MappingSchema):
+    rows = Rows()
+
+def timed(func, number=1):
+    # ``timeit.timeit(func, number=number)``, which needs Python 2.6
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        return time.time() - start
+    finally:
+        if enabled:
+            gc.enable()
+
+def best(func, number):
+    return min([ timed(func, number) for i in range(3) ]) / number
+
+def report(label, seconds):
+    print '%-50s %10.1f usec' % (label, seconds * 1000000)
+
+def bench_sequence(sizes=(10, 100, 1000)):
+    print 'Sequence rendering cost per item'
+    schema = Table()
+    for size in sizes:
+        appstruct = {'rows':[{'name':'name', 'email':'email', 'age':1}] * size}
+        form = Form(schema)
+        def render():
+            form.render(appstruct)
+        number = max(1, 1000 / size)
+        report('  %s items' % size, best(render, number) / size)
+
+class Address(colander.MappingSchema):
+    street = colander.SchemaNode(colander.String())
+    city = colander.SchemaNode(colander.String())
+    zip = colander.SchemaNode(colander.String())
+    since = colander.SchemaNode(colander.Date())
+    rows = Rows()
+
+def sections_schema(count):
+    # ``count`` sequences, each with its own item schema
+    schema = colander.SchemaNode(colander.Mapping())
+    for i in range(count):
+        schema.add(colander.SchemaNode(colander.Sequence(),
+                                       Address(name='address'),
+                                       name='addresses%d' % i))
+    return schema
+
+def bench_prototypes(count=20):
+    from deform.widget import PrototypeCache
+    from deform.widget import SequenceWidget
+    print 'Rendering %s empty repeatable sections' % count
+    schema = sections_schema(count)
+    def render():
+        Form(schema).render()
+    report('  no prototype cache', best(render, 20))
+    SequenceWidget.prototype_cache = cache = PrototypeCache()
+    try:
+        report('  prototype cache', best(render, 20))
+    finally:
+        SequenceWidget.prototype_cache = None
+    print '  (hits %s, misses %s)' % (cache.hits, cache.misses)
+
+def bench_profiles(count=200):
+    from deform.template import ZPTRendererFactory
+    from deform.template import default_dir
+    print 'Rendering %s fields, development vs production profile' % count
+    schema = colander.SchemaNode(colander.Mapping())
+    for i in range(count):
+        schema.add(colander.SchemaNode(colander.String(), name='field%d' % i))
+    forms = {}
+    timings = {}
+    for production in (False, True):
+        renderer = ZPTRendererFactory((default_dir,), production=production)
+        forms[production] = form = Form(schema, renderer=renderer)
+        form.render() # compile the templates
+        timings[production] = []
+    # interleave the runs, so that both profiles see the same noise
+    for i in range(10):
+        for production, form in forms.items():
+            timings[production].append(
+                timed(form.render, number=10) / 10)
+    report('  development', min(timings[False]))
+    report('  production', min(timings[True]))
+
+def bench_handles(count=1000):
+    from deform.template import ZPTRendererFactory
+    from deform.template import default_dir
+    print 'Rendering %s fields, template handles vs lookup by name' % count
+    schema = colander.SchemaNode(colander.Mapping())
+    for i in range(count):
+        schema.add(colander.SchemaNode(colander.String(), name='field%d' % i))
+    renderer = ZPTRendererFactory((default_dir,), production=True)
+    def by_name(template_name, **kw):
+        # what ZPTRendererFactory.__call__ used to do
+        return renderer.loader.load(template_name + '.pt')(**kw)
+    forms = {'handles': Form(schema, renderer=renderer),
+             'by name': Form(schema, renderer=by_name)}
+    timings = dict((label, []) for label in forms)
+    for i in range(10):
+        for label, form in forms.items():
+            timings[label].append(timed(form.render, number=3) / 3)
+    report('  by name', min(timings['by name']))
+    report('  handles', min(timings['handles']))
+
+def bench_inline(count=1000):
+    from deform.template import ZPTRendererFactory
+    from deform.template import default_dir
+    print 'Rendering %s fields, items inlined vs item templates' % count
+    schema = colander.SchemaNode(colander.Mapping())
+    for i in range(count):
+        schema.add(colander.SchemaNode(colander.String(), name='field%d' % i))
+    renderer = ZPTRendererFactory((default_dir,), production=True)
+    class Separate(object):
+        # handles without a filename: items use their own template
+        def handle(self, template_name):
+            template = renderer.handle(template_name)
+            return lambda **kw: template(**kw)
+        def __call__(self, template_name, **kw):
+            return renderer(template_name, **kw)
+    forms = {'inline': Form(schema, renderer=renderer),
+             'separate': Form(schema, renderer=Separate())}
+    timings = dict((label, []) for label in forms)
+    for i in range(10):
+        for label, form in forms.items():
+            timings[label].append(timed(form.render, number=3) / 3)
+    report('  separate', min(timings['separate']))
+    report('  inline', min(timings['inline']))
+
+def bench_readonly(count=1000):
+    from deform.template import ZPTRendererFactory
+    from deform.template import default_dir
+    print 'Rendering %s fields read-only, Chameleon vs fast_readonly' % count
+    schema = colander.SchemaNode(colander.Mapping())
+    for i in range(count):
+        schema.add(colander.SchemaNode(colander.String(), name='field%d' % i))
+    appstruct = dict(('field%d' % i, 'value %d' % i) for i in range(count))
+    forms = {}
+    for label, fast in (('chameleon', False), ('fast_readonly', True)):
+        renderer = ZPTRendererFactory((default_dir,), production=True,
+                                      fast_readonly=fast)
+        form = Form(schema, renderer=renderer)
+        forms[label] = lambda form=form: form.render(appstruct, readonly=True)
+    timings = dict((label, []) for label in forms)
+    for i in range(10):
+        for label, render in forms.items():
+            timings[label].append(timed(render, number=3) / 3)
+    report('  chameleon', min(timings['chameleon']))
+    report('  fast_readonly', min(timings['fast_readonly']))
+
+def bench_render_many(count=200, fields=10, owners=5):
+    from deform.template import ZPTRendererFactory
+    from deform.template import default_dir
+    print ('Rendering %s appstructs of %s fields and an owner mapping of '
+           '%s fields read-only, render loop vs render_many' %
+           (count, fields, fields))
+    schema = colander.SchemaNode(colander.Mapping())
+    owner = colander.SchemaNode(colander.Mapping(), name='owner')
+    for i in range(fields):
+        schema.add(colander.SchemaNode(colander.String(), name='field%d' % i))
+        owner.add(colander.SchemaNode(colander.String(), name='field%d' % i))
+    schema.add(owner)
+    def appstruct(n, owner):
+        result = dict(('field%d' % i, 'value %d %d' % (n, i))
+                      for i in range(fields))
+        result['owner'] = dict(('field%d' % i, 'owner %d %d' % (owner, i))
+                               for i in range(fields))
+        return result
+    batches = {
+        '%s owners' % owners:[ appstruct(n, n % owners)
+                               for n in range(count) ],
+        'distinct owners':[ appstruct(n, n) for n in range(count) ],
+        }
+    for fast_readonly in (False, True):
+        renderer = ZPTRendererFactory((default_dir,), production=True,
+                                      fast_readonly=fast_readonly)
+        name = fast_readonly and 'fast_readonly' or 'chameleon'
+        form = Form(schema, renderer=renderer)
+        for label, appstructs in sorted(batches.items()):
+            def loop():
+                return [ form.render(appstruct, readonly=True)
+                         for appstruct in appstructs ]
+            def many():
+                return list(form.render_many(appstructs, readonly=True))
+            assert loop() == many()
+            timings = {'loop':[], 'render_many':[]}
+            for i in range(10):
+                timings['loop'].append(timed(loop, number=1))
+                timings['render_many'].append(timed(many, number=1))
+            label = '%s, %s' % (name, label)
+            report('  render loop, %s' % label, min(timings['loop']))
+            report('  render_many, %s' % label, min(timings['render_many']))
+
+def bench_fragments(sections=20, fields=10):
+    from deform.field import FragmentCache
+    print ('Rendering %s sections of %s fields, one field changing '
+           'per rendering, fragment cache' % (sections, fields))
+    schema = colander.SchemaNode(colander.Mapping())
+    for i in range(sections):
+        section = colander.SchemaNode(colander.Mapping(),
+                                      name='section%d' % i,
+                                      description='Section %d' % i)
+        for j in range(fields):
+            section.add(colander.SchemaNode(colander.String(),
+                                            name='field%d' % j))
+        schema.add(section)
+    appstruct = dict(('section%d' % i, {}) for i in range(sections))
+    counter = itertools.count()
+    def render(value=None, **kw):
+        # a new form and a new value of the first field for each request
+        if value is None:
+            value = str(counter.next())
+        appstruct['section0']['field0'] = value
+        return Form(schema, path_oids=True, **kw).render(appstruct)
+    cache = FragmentCache()
+    assert render('a') == render('a', fragment_cache=cache)
+    timings = {'uncached':[], 'cached':[]}
+    for i in range(10):
+        timings['uncached'].append(timed(render, number=3) / 3)
+        timings['cached'].append(
+            timed(lambda: render(fragment_cache=cache), number=3) / 3)
+    report('  uncached', min(timings['uncached']))
+    report('  cached', min(timings['cached']))
+    print '  hit rate: %.2f' % cache.stats()['hit_rate']
+
+def bench_options(count=10000):
+    from deform.widget import RadioChoiceWidget
+    from deform.widget import SelectWidget
+    print 'Rendering a %s-option select and radio choice' % count
+    values = [ ('value%d' % i, 'Option %d' % i) for i in range(count) ]
+    class LoopSelectWidget(SelectWidget):
+        # the template renders the options
+        def options(self, field, cstruct):
+            return None
+    class LoopRadioChoiceWidget(RadioChoiceWidget):
+        def options(self, field, cstruct):
+            return None
+    fields = {}
+    for label, widget in (('select loop', LoopSelectWidget),
+                          ('select precomputed', SelectWidget),
+                          ('radio loop', LoopRadioChoiceWidget),
+                          ('radio precomputed', RadioChoiceWidget)):
+        schema = colander.SchemaNode(colander.Mapping())
+        schema.add(colander.SchemaNode(colander.String(), name='choice',
+                                       widget=widget(values=values)))
+        fields[label] = Form(schema)['choice']
+    timings = dict((label, []) for label in fields)
+    for i in range(5):
+        for label, field in fields.items():
+            serialize = lambda: field.serialize('value%d' % (count // 2))
+            timings[label].append(timed(serialize, number=3) / 3)
+    for label in sorted(timings):
+        report('  %s' % label, min(timings[label]))
+
+def bench_checkboxes(count=2000, checked=500):
+    from deform.widget import CheckboxChoiceWidget
+    print ('Rendering %s checkboxes, %s checked, list membership vs set '
+           'membership' % (count, checked))
+    values = [ ('perm%d' % i, 'Permission %d' % i) for i in range(count) ]
+    cstruct = [ 'perm%d' % i for i in range(0, count, count // checked) ]
+    class ListCheckboxChoiceWidget(CheckboxChoiceWidget):
+        # the templates test the membership of each value in the list
+        def render_template(self, renderer, template, **kw):
+            kw['selected'] = kw['cstruct']
+            return CheckboxChoiceWidget.render_template(self, renderer,
+                                                        template, **kw)
+    fields = {}
+    for label, widget in (('list', ListCheckboxChoiceWidget),
+                          ('set', CheckboxChoiceWidget)):
+        schema = colander.SchemaNode(colander.Mapping())
+        schema.add(colander.SchemaNode(colander.String(), name='perms',
+                                       widget=widget(values=values)))
+        fields[label] = Form(schema)['perms']
+    for readonly in (False, True):
+        timings = dict((label, []) for label in fields)
+        for i in range(5):
+            for label, field in fields.items():
+                serialize = lambda: field.serialize(cstruct,
+                                                    readonly=readonly)
+                timings[label].append(timed(serialize, number=3) / 3)
+        mode = readonly and 'read-only' or 'editable'
+        for label in sorted(timings):
+            report('  %s, %s' % (mode, label), min(timings[label]))
+
+def bench_autocomplete(count=20000):
+    from deform.widget import AutocompleteInputWidget
+    print 'Rendering an autocomplete input with %s values' % count
+    values = [ 'Suggestion %d' % i for i in range(count) ]
+    class EncodingAutocompleteInputWidget(AutocompleteInputWidget):
+        # the values are encoded for each rendering
+        def _encoded(self, values):
+            _encoded_values.pop(self, None)
+            return AutocompleteInputWidget._encoded(self, values)
+    from deform.widget import _encoded_values
+    fields = {}
+    for label, widget in (
+        ('encoded each time', EncodingAutocompleteInputWidget(values=values)),
+        ('memoized', AutocompleteInputWidget(values=values)),
+        ('values_url', AutocompleteInputWidget(values=values,
+                                               values_url='/values.json'))):
+        schema = colander.SchemaNode(colander.Mapping())
+        schema.add(colander.SchemaNode(colander.String(), name='search',
+                                       widget=widget))
+        fields[label] = Form(schema)['search']
+    timings = dict((label, []) for label in fields)
+    for i in range(5):
+        for label, field in fields.items():
+            serialize = lambda: field.serialize('Sugg')
+            timings[label].append(timed(serialize, number=3) / 3)
+    for label in sorted(timings):
+        report('  %s (%d bytes)' % (label, len(fields[label].serialize(''))),
+               min(timings[label]))
+
+def bench_cold_start(runs=3):
+    import shutil
+    import tempfile
+    from deform.template import ZPTRendererFactory
+    from deform.template import default_dir
+    print 'Preloading the default templates, empty vs warm cache_dir'
+    tmpdir = tempfile.mkdtemp()
+    try:
+        def preload():
+            renderer = ZPTRendererFactory((default_dir,), cache_dir=tmpdir,
+                                          production=False, debug=False)
+            return timed(renderer.preload, number=1)
+        cold = []
+        warm = []
+        for i in range(runs):
+            shutil.rmtree(tmpdir)
+            cold.append(preload())
+            warm.append(preload())
+        report('  empty cache', min(cold))
+        report('  warm cache', min(warm))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def peak_memory(func):
+    # run ``func`` in a child process and return the growth of its peak
+    # resident set size, in kilobytes
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(rfd)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        func()
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(wfd, str(after - before))
+        os._exit(0)
+    os.close(wfd)
+    result = os.read(rfd, 64)
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    return int(result)
+
+def bench_stream(sizes=(1000, 10000)):
+    print 'render() vs render_iter(): time to first byte, peak memory'
+    schema = Table()
+    for size in sizes:
+        appstruct = {'rows':[{'name':'name', 'email':'email', 'age':1}] * size}
+        form = Form(schema)
+        def render():
+            form.render(appstruct).encode('utf-8')
+        def render_iter():
+            for chunk in form.render_iter(appstruct):
+                pass
+        def first_chunk():
+            form.render_iter(appstruct).next()
+        report('  %s items: render() first byte' % size, best(render, 1))
+        report('  %s items: render_iter() first byte' % size,
+               best(first_chunk, 1))
+        report('  %s items: render_iter() last byte' % size,
+               best(render_iter, 1))
+        print '%-50s %10d kB' % ('  %s items: render() peak memory' % size,
+                                 peak_memory(render))
+        print '%-50s %10d kB' % ('  %s items: render_iter() peak memory' % size,
+                                 peak_memory(render_iter))
+
+def main():
+    bench_sequence()
+    bench_prototypes()
+    bench_profiles()
+    bench_handles()
+    bench_inline()
+    bench_readonly()
+    bench_render_many()
+    bench_fragments()
+    bench_options()
+    bench_checkboxes()
+    bench_autocomplete()
+    bench_cold_start()
+    bench_stream()
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ from deform.form import Button # API
 
 from deform.exception import ValidationFailure # API
 from deform.exception import TemplateError # API
+from deform.exception import WidgetMutationError # API
 
 from deform.schema import Set # API
 from deform.schema import FileData # API
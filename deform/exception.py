@@ -19,12 +19,18 @@ class ValidationFailure(Exception):
        The original :class:`deform.exception.Invalid` exception raised
        by :meth:`deform.schema.SchemaNode.deserialize` which caused
        this exception to need to be raised.
+
+    ``state``
+       ``None`` or, when ``field`` is shared between threads (see
+       :meth:`deform.Field.share`), the request state holding the
+       validation errors.
     """
-    def __init__(self, field, cstruct, error):
+    def __init__(self, field, cstruct, error, state=None):
         Exception.__init__(self)
         self.field = field
         self.cstruct = cstruct
         self.error = error
+        self.state = state
 
     def render(self):
         """
@@ -33,8 +39,29 @@ class ValidationFailure(Exception):
         arguments and returns text representing the HTML of a form
         rendering.
         """
+        if self.state is not None:
+            self.field._resume(self.state)
         return self.field.widget.serialize(self.field, self.cstruct)
 
+    def render_iter(self, encoding='utf-8'):
+        """
+        Like :meth:`deform.exception.ValidationFailure.render`, but
+        return an iterator over the rendering in chunks; see
+        :meth:`deform.Field.render_iter`.
+        """
+        if self.state is not None:
+            self.field._resume(self.state)
+        return self.field._serialize_iter(self.cstruct, False, encoding,
+                                          self.state)
+
 class TemplateError(Exception):
     pass
 
+class WidgetMutationError(Exception):
+    """
+    The exception raised when an attribute of a widget which is shared
+    between fields (see :attr:`deform.Field.share_default_widgets`) is
+    assigned.  Widgets which are meant to be shared must not use
+    themselves as a scratchpad; they should store per-rendering state
+    on the field they are passed instead.
+    """
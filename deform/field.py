@@ -1,13 +1,199 @@
 import itertools
+import os
+import re
+import threading
+import weakref
+
 import colander
 import peppercorn
 
-from deform import decorator
 from deform import exception
 from deform import template
 from deform import widget
 from deform import schema
 
+# schema node -> {type class: widget}; see Field.share_default_widgets
+_shared_widgets = weakref.WeakKeyDictionary()
+
+_oid_unsafe = re.compile(r'[^A-Za-z0-9]')
+
+def _oid_segment(name):
+    # Escape a path segment of a path-based oid: every character which
+    # is not an ASCII letter or digit (including ``_``) is replaced by
+    # ``_`` and its hex code, so that segments can be joined with
+    # ``__`` unambiguously and the result only contains characters
+    # matched by ``\w``.
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    else:
+        name = str(name)
+    return _oid_unsafe.sub(lambda m: '_%02x' % ord(m.group(0)), name)
+
+class _SchemaAlias(object):
+    # Non-data descriptor reading an attribute of the field's schema
+    # node; assigning the attribute on a field overrides it for that
+    # field only.
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, inst, cls=None):
+        if inst is None:
+            return self
+        return getattr(inst.schema, self.name)
+
+class _Scratch(object):
+    # Data descriptor for an attribute which widgets use as per-request
+    # scratch space on a field (``error``, ``sequence_fields`` ...).
+    # Values live in the field's private state dictionary or, if the
+    # field is shared (see ``Field.share``), in the state of the
+    # request being processed by the current thread.
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+
+    def __get__(self, inst, cls=None):
+        if inst is None:
+            return self.default
+        scratch = inst._scratch(False)
+        if scratch is None:
+            return self.default
+        return scratch.get(self.name, self.default)
+
+    def __set__(self, inst, value):
+        inst._scratch(True)[self.name] = value
+
+    def __delete__(self, inst):
+        scratch = inst._scratch(False)
+        if scratch is not None:
+            scratch.pop(self.name, None)
+
+class _SharedState(threading.local):
+    # Per-thread holder of the state of the request being processed by
+    # a shared field tree.  A state maps each field to its scratch
+    # dictionary.
+    current = None
+
+    def begin(self):
+        self.current = state = {}
+        return state
+
+    def get(self, field, create):
+        state = self.current
+        if state is None:
+            if not create:
+                return None
+            state = self.begin()
+        scratch = state.get(field)
+        if scratch is None and create:
+            scratch = state[field] = {}
+        return scratch
+
+class _StreamProxy(object):
+    # Stands in for a field while its template is rendered by
+    # ``Field.render_iter``; attributes not set on the proxy are read
+    # from the field.
+    def __init__(self, field, **kw):
+        self.__dict__.update(kw)
+        self._field = field
+
+    def __getattr__(self, name):
+        return getattr(self._field, name)
+
+class _Stream(object):
+    # Renders a field in chunks.  The template of a field which has
+    # subfields is rendered with a proxy whose ``renderer`` returns a
+    # marker instead of rendering the items of the field; the template
+    # of each item is in turn rendered with a proxy whose
+    # ``serialize`` returns a marker.  The output is then split on the
+    # markers, and the items and subfields are rendered (recursively)
+    # only when the iteration reaches them.  Only the fields which
+    # contain a sequence, whose rendering is unbounded, are split that
+    # way: the others are rendered whole by ``Field.serialize``, which
+    # is about twice as fast.
+    def __init__(self):
+        self.nonce = os.urandom(6).encode('hex')
+        self.pattern = re.compile(u'\x00%s:(\d+)\x00' % self.nonce)
+        self.streamed = {}
+
+    def _streams(self, field):
+        # the items of a sequence share their schema node
+        node = field.schema
+        streams = self.streamed.get(node)
+        if streams is None:
+            streams = isinstance(field.typ, colander.Sequence)
+            if not streams:
+                for child in field.children:
+                    if self._streams(child):
+                        streams = True
+            self.streamed[node] = streams
+        return streams
+
+    def _markers(self, calls):
+        def defer(*arg, **kw):
+            # the per-thread state of the form being rendered is
+            # restored when the deferred call is made
+            page = getattr(widget._page, 'prototypes', None)
+            calls.append((page, arg, kw))
+            return u'\x00%s:%d\x00' % (self.nonce, len(calls) - 1)
+        return defer
+
+    def _expand(self, text, calls, handler):
+        parts = self.pattern.split(text)
+        for i, part in enumerate(parts):
+            if i % 2:
+                page, arg, kw = calls[int(part)]
+                chunks = handler(*arg, **kw)
+                while True:
+                    previous = getattr(widget._page, 'prototypes', None)
+                    widget._page.prototypes = page
+                    try:
+                        try:
+                            chunk = chunks.next()
+                        except StopIteration:
+                            break
+                    finally:
+                        widget._page.prototypes = previous
+                    yield chunk
+            elif part:
+                yield part
+
+    def serialize(self, field, cstruct, readonly=False):
+        if not field.children or not self._streams(field):
+            yield field.serialize(cstruct, readonly=readonly)
+            return
+        renderer = field.renderer
+        calls = []
+        defer = self._markers(calls)
+        depth = [0]
+        def render(template, **kw):
+            if depth[0]:
+                # an item rendered by the template of the field
+                return defer(renderer, template, **kw)
+            depth[0] += 1
+            try:
+                return renderer(template, **kw)
+            finally:
+                depth[0] -= 1
+        proxy = _StreamProxy(field, renderer=render)
+        text = field.widget.serialize(proxy, cstruct, readonly=readonly)
+        for chunk in self._expand(text, calls, self.render_item):
+            yield chunk
+
+    def render_item(self, renderer, template, field=None, **kw):
+        if not field.children or not self._streams(field):
+            yield renderer(template, field=field, **kw)
+            return
+        calls = []
+        proxy = _StreamProxy(field, serialize=self._markers(calls))
+        text = renderer(template, field=proxy, **kw)
+        for chunk in self._expand(text, calls, self._serialize_item(field)):
+            yield chunk
+
+    def _serialize_item(self, field):
+        def serialize(cstruct, readonly=False):
+            return self.serialize(field, cstruct, readonly=readonly)
+        return serialize
+
 class Field(object):
     """ Represents an individual form field (a visible object in a
     form rendering).
@@ -18,7 +204,10 @@ class Field(object):
     field.  Using a field as a scratchpad makes it possible to build
     implementations of state-retaining widgets while instances of
     those widget still only need to be constructed once instead of on
-    each request.
+    each request.  Alternately, a field (or form) tree can be shared
+    by concurrent requests once :meth:`deform.Field.share` has been
+    called for it: the attributes used as a scratchpad by the built-in
+    widgets are then kept in per-request state.
     
     *Attributes*
 
@@ -36,7 +225,13 @@ class Field(object):
             A string incorporating the ``order`` attribute that can be
             used as a unique identifier in HTML code (often for ``id``
             attributes of field-related elements).  An example oid is
-            ``deformField0``.
+            ``deformField0``.  If the field uses path-based oids (see
+            ``oid_prefix``), the oid is derived from the path of the
+            field instead, e.g. ``deformField_myform__address__city``.
+
+        oid_prefix
+            ``None`` if the field uses sequential oids, otherwise the
+            prefix of its path-based oid.
 
         name
             An alias for self.schema.name
@@ -56,6 +251,10 @@ class Field(object):
         children
             Child fields of this field.
 
+        shared
+            ``True`` if the field is shared between threads (see
+            :meth:`deform.Field.share`).
+
         error
             The exception raised by the last attempted validation of the
             schema element associated with this field.  By default, this
@@ -73,6 +272,27 @@ class Field(object):
             renderer is not passed to the constructor, the default deform
             renderer will be used (the :term:`default renderer`).
 
+        share_default_widgets
+            A class attribute.  If it is true, default widgets (those
+            made by the ``widget_maker`` of a schema node's type or
+            from ``deform.schema.default_widget_makers``) are created
+            only once per schema node and type class, and shared by
+            every field created for that schema node, across forms and
+            requests, instead of being created for each field.
+            Assigning an attribute of a shared widget which derives
+            from :class:`deform.widget.Widget` raises a
+            :exc:`deform.WidgetMutationError`.  Set it on
+            :class:`deform.Field` (e.g. at application startup) to
+            affect all fields.  Default: ``False``.
+
+        fragment_cache
+            ``None`` or a :class:`deform.field.FragmentCache` in which
+            the renderings of the field and of its subfields are
+            cached.  Pass it as a keyword argument to the constructor
+            (it is then used by the whole tree) or set it on
+            :class:`deform.Field` to affect all fields.  Default:
+            ``None`` (no caching).
+
         counter
             ``None`` or an instance of ``itertools.counter`` which is used
             to generate sequential order-related attributes such as
@@ -83,7 +303,8 @@ class Field(object):
 
     *Constructor Arguments*
 
-      ``renderer``, ``counter`` and ``resource_registry`` are accepted
+      ``renderer``, ``counter``, ``resource_registry``, ``lazy`` and
+      ``oid_prefix`` are accepted
       as explicit keyword arguments to the :class:`deform.Field`.
       These are also available as attribute values.  ``renderer``, if
       passed, is a template renderer as described in
@@ -98,6 +319,27 @@ class Field(object):
       If any of these values is ``None`` (their default), suitable
       default values are used in their place.
 
+      If ``lazy`` is true, the child fields of the field are not
+      constructed by the constructor; instead they are constructed
+      the first time the ``children`` attribute is used (by iteration,
+      ``__getitem__``, rendering, validation and so on), and their own
+      children are lazy in turn.  Constructing a form which only ever
+      uses a small part of a very large schema is then proportionally
+      cheap.  Note that when ``lazy`` is true, the ``order`` (and
+      therefore the ``oid``) of each field reflects the order in which
+      the fields were materialized rather than the schema order.
+      Default: ``False``.
+
+      By default the ``oid`` of each field is made of the value of a
+      counter shared by the whole tree, so it depends on how many
+      fields were created (or cloned) before it.  If ``oid_prefix`` is
+      a string, oids are instead derived from ``oid_prefix`` and the
+      path of each field: the names of its parents and its own name,
+      sequence items being named by their index.  Path-based oids are
+      stable across requests and processes, which allows rendered
+      HTML to be cached or compared, and unique as long as each form
+      on a page uses a different ``oid_prefix``.  Default: ``None``.
+
       The :class:`deform.Field` constructor also accepts *arbitrary*
       keyword arguments.  When an 'unknown' keyword argument is
       passed, it is attached unmolested to the form field as an
@@ -108,35 +350,165 @@ class Field(object):
 
     """
 
-    error = None
+    __slots__ = ('schema', 'counter', 'order', 'oid', 'oid_prefix',
+                 'renderer',
+                 'resource_registry', '_children', '_index', '_widget', '_kw',
+                 '_state', '__dict__', '__weakref__')
+
+    error = _Scratch('error')
+    sequence_fields = _Scratch('sequence_fields', ())
+    unparseable = _Scratch('unparseable')
+    confirm = _Scratch('confirm', '')
+    share_default_widgets = False
+    fragment_cache = None
     default_renderer = template.default_renderer
     default_resource_registry = widget.default_resource_registry
 
+    name = _SchemaAlias('name')
+    title = _SchemaAlias('title')
+    description = _SchemaAlias('description')
+    required = _SchemaAlias('required')
+    typ = _SchemaAlias('typ') # required by Invalid exception
+
     def __init__(self, schema, renderer=None, counter=None,
-                 resource_registry=None, **kw):
-        self.counter = counter or itertools.count()
-        self.order = self.counter.next()
-        self.oid = 'deformField%s' % self.order
-        self.schema = schema
-        self.typ = self.schema.typ # required by Invalid exception
+                 resource_registry=None, lazy=False, oid_prefix=None, **kw):
         if renderer is None:
             renderer = self.default_renderer
         if resource_registry is None:
             resource_registry = self.default_resource_registry
+        oid = None
+        if oid_prefix is not None:
+            oid = 'deformField_%s' % _oid_segment(oid_prefix)
+        self._setup(schema, renderer, counter or itertools.count(),
+                    resource_registry, kw, lazy, oid_prefix, oid)
+
+    def _setup(self, schema, renderer, counter, resource_registry, kw,
+               lazy, oid_prefix, oid):
+        self.counter = counter
+        self.order = counter.next()
+        self.oid_prefix = oid_prefix
+        if oid is None:
+            oid = 'deformField%s' % self.order
+        self.oid = oid
+        self.schema = schema
         self.renderer = renderer
         self.resource_registry = resource_registry
-        self.name = schema.name
-        self.title = schema.title
-        self.description = schema.description
-        self.required = schema.required
-        self.children = []
-        self.__dict__.update(kw)
-        for child in schema.children:
-            self.children.append(Field(child,
-                                       renderer=renderer,
-                                       counter=self.counter,
-                                       resource_registry=resource_registry,
-                                       **kw))
+        self._widget = None
+        self._index = None
+        self._state = None
+        # Unknown keyword arguments are kept in a single dictionary
+        # shared by the whole tree and looked up by ``__getattr__``,
+        # except those which would be shadowed by a class attribute.
+        self._kw = kw
+        if kw:
+            cls = self.__class__
+            for k, v in kw.items():
+                if k.startswith('_') or hasattr(cls, k):
+                    setattr(self, k, v)
+        if lazy:
+            # ``children`` is materialized on first access
+            self._children = None
+        else:
+            self._children = [ self._make_child(node, False)
+                               for node in schema.children ]
+
+    def _make_child(self, node, lazy):
+        child = Field.__new__(Field)
+        oid = None
+        if self.oid_prefix is not None:
+            oid = '%s__%s' % (self.oid, _oid_segment(node.name))
+        child._setup(node, self.renderer, self.counter,
+                     self.resource_registry, self._kw, lazy,
+                     self.oid_prefix, oid)
+        # the children of a shared field are shared too; otherwise the
+        # state of the parent is its own scratch dict
+        if isinstance(self._state, _SharedState):
+            child._state = self._state
+        return child
+
+    def _scratch(self, create):
+        state = self._state
+        if state is None:
+            if create:
+                state = self._state = {}
+            return state
+        if state.__class__ is dict:
+            return state
+        return state.get(self, create)
+
+    def share(self):
+        """ Make this field and its subfields safe to share between
+        threads, so that a form can be constructed once (e.g. at
+        application startup) and used to render and validate
+        submissions in many concurrent requests.  Return this field.
+
+        All the subfields of this field are materialized and their
+        widgets resolved.  Afterwards, the attributes which built-in
+        widgets use as a scratchpad (``error``, ``sequence_fields``,
+        ``unparseable`` and ``confirm``) are no longer stored on the
+        fields themselves but in a per-request state, private to the
+        thread which created it.  A new state is created each time
+        :meth:`deform.Field.validate` or :meth:`deform.Field.render` is
+        called; a :exc:`deform.ValidationFailure` raised by ``validate``
+        retains the state, and its ``render`` method uses it to show
+        the errors.
+
+        Widgets used by a shared form must not mutate themselves, and
+        custom widgets which use other field attributes as a
+        scratchpad are not safe to use in a shared form.  Do not
+        change a shared form (e.g. with
+        :meth:`deform.Field.set_widgets`) once it is in use."""
+        holder = _SharedState()
+        stack = [self]
+        while stack:
+            field = stack.pop()
+            field.widget
+            field._state = holder
+            stack.extend(field.children)
+        return self
+
+    @property
+    def shared(self):
+        """ ``True`` if :meth:`deform.Field.share` was called for this
+        field or one of its parents."""
+        return isinstance(self._state, _SharedState)
+
+    def _begin(self):
+        # start a new request state if this field is shared
+        state = self._state
+        if isinstance(state, _SharedState):
+            return state.begin()
+
+    def _resume(self, state):
+        # make ``state`` (returned by ``_begin``) current for this thread
+        self._state.current = state
+
+    def __getattr__(self, name):
+        # Only called when normal attribute lookup fails.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._kw[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def _get_children(self):
+        children = self._children
+        if children is None:
+            children = self._children = [
+                self._make_child(node, True) for node in self.schema.children
+                ]
+        return children
+
+    def _set_children(self, children):
+        self._children = children
+        self._index = None
+
+    children = property(_get_children, _set_children, doc="""\
+        Child fields of this field.  When the field was constructed
+        with ``lazy=True``, the children are constructed (once) when
+        this attribute is first used; otherwise they are constructed
+        eagerly by the constructor.""")
 
     def __iter__(self):
         """ Iterate over the children fields of this field. """
@@ -145,7 +517,8 @@ class Field(object):
     @classmethod
     def set_zpt_renderer(cls, search_path, auto_reload=True,
                          debug=True, encoding='utf-8',
-                         translator=None):
+                         translator=None, production=None, cache_dir=None,
+                         maxsize=None, fast_readonly=False):
         """ Create a :term:`Chameleon` ZPT renderer that will act as a
         :term:`default renderer` for instances of the associated class
         when no ``renderer`` argument is provided to the class'
@@ -163,6 +536,10 @@ class Field(object):
             debug=debug,
             encoding=encoding,
             translator=translator,
+            production=production,
+            cache_dir=cache_dir,
+            maxsize=maxsize,
+            fast_readonly=fast_readonly,
             )
 
     @classmethod
@@ -190,45 +567,185 @@ class Field(object):
         """
         cls.default_resource_registry = registry
 
+    @classmethod
+    def compile(cls, schema, **kw):
+        """ Walk ``schema`` once and return a
+        :class:`deform.field.Blueprint` which can be called to stamp
+        out instances of the associated class cheaply.  ``kw`` is
+        passed to the class' constructor as-is, so e.g.
+        ``Form.compile(schema, buttons=('submit',))`` is the blueprint
+        equivalent of ``Form(schema, buttons=('submit',))``.
+
+        Blueprints are usually created once at application startup and
+        called once per request in place of the class constructor."""
+        return Blueprint(cls, schema, **kw)
+
     def __getitem__(self, name):
         """ Return the subfield of this field named ``name`` or raise
         a :exc:`KeyError` if a subfield does not exist named ``name``."""
-        for child in self.children:
-            if child.name == name:
-                return child
-        raise KeyError(name)
+        children = self.children
+        index = self._index
+        if index is not None:
+            pos = index.get(name)
+            if pos is not None and pos < len(children):
+                child = children[pos]
+                if child.name == name:
+                    return child
+        # The name index doesn't exist yet, or ``children`` was changed
+        # in place since it was built: (re)build it.
+        index = {}
+        for pos in range(len(children)-1, -1, -1):
+            index[children[pos].name] = pos
+        self._index = index
+        pos = index.get(name)
+        if pos is None:
+            raise KeyError(name)
+        return children[pos]
+
+    def find(self, path, separator='.'):
+        """ Return a list of all the fields beneath this field which
+        match the dotted name ``path``, in document order.
+
+        ``path`` is split on ``separator`` and each element is matched
+        against the names of the children of the fields matched so
+        far, one level at a time.  An element which is an asterisk
+        (``*``) matches *all* children; for example, if ``people`` is
+        a sequence of ``person`` mappings,
+        ``form.find('people.*.first_name')`` returns the
+        ``first_name`` field of the ``person`` prototype field.
+        Elements which match nothing are skipped, so the result may be
+        the empty list.  If ``path`` is the empty string, the result
+        is a list containing only this field."""
+        fields = [self]
+        if path:
+            for element in path.split(separator):
+                found = []
+                if element == '*':
+                    for field in fields:
+                        found.extend(field.children)
+                else:
+                    for field in fields:
+                        try:
+                            found.append(field[element])
+                        except KeyError:
+                            pass
+                fields = found
+        return fields
 
     def clone(self):
         """ Clone the field and its subfields, retaining attribute
         information.  Return the cloned field.  The ``order``
         attribute of the node is not cloned; instead the field
         receives a new order attribute; it will be a number larger
-        than the last renderered field of this set."""
-        cloned = self.__class__(self.schema)
-        cloned.__dict__.update(self.__dict__)
+        than the last renderered field of this set.  If the field uses
+        path-based oids, the oids of the clone are the same as those of
+        the original.
+
+        Cloning is a structural copy: the schema, widget, renderer and
+        other attributes are shared with the original field, while the
+        clone receives a new ``children`` list made of clones of the
+        original's subfields.  The constructor is not called."""
+        cloned = self._shallow_copy()
         cloned.order = cloned.counter.next()
-        cloned.oid = 'deformField%s' % cloned.order
-        cloned.children = [ field.clone() for field in self.children ]
+        if cloned.oid_prefix is None:
+            cloned.oid = 'deformField%s' % cloned.order
+        if self._children is not None:
+            cloned._children = [ field.clone() for field in self.children ]
+        # else: the original's children were never materialized, the
+        # clone will materialize its own lazily
         return cloned
 
-    @decorator.reify
-    def widget(self):
-        """ If a widget is not assigned directly to a field, this
-        function will be called to generate a default widget (only
-        once). The result of this function will then be assigned as
-        the ``widget`` attribute of the field for the rest of the
-        lifetime of this field. If a widget is assigned to a field
-        before form processing, this function will not be called."""
+    def _rebase_oid(self, oid):
+        # Give this field the path-based oid ``oid`` and rederive the
+        # oids of its (materialized) subfields from it; used to name
+        # sequence items by their index.
+        self.oid = oid
+        if self._children is not None:
+            for child in self._children:
+                child._rebase_oid('%s__%s' % (oid, _oid_segment(child.name)))
+
+    def _shallow_copy(self):
+        copied = self.__class__.__new__(self.__class__)
+        copied.schema = self.schema
+        copied.counter = self.counter
+        copied.order = self.order
+        copied.oid = self.oid
+        copied.oid_prefix = self.oid_prefix
+        copied.renderer = self.renderer
+        copied.resource_registry = self.resource_registry
+        copied._children = self._children
+        copied._index = self._index
+        copied._widget = self._widget
+        copied._kw = self._kw
+        state = self._state
+        if state.__class__ is dict:
+            state = dict(state)
+        copied._state = state
+        extra = self.__dict__
+        if extra:
+            copied.__dict__.update(extra)
+        return copied
+
+    def _copy(self, counter, renumber):
+        # Structural copy of this field and its subfields.  Attributes
+        # (widget, renderer, extra keywords) are shared shallowly;
+        # ``children`` is a fresh list of copies.  When ``renumber``
+        # is true, each copy receives a new order (and oid) from
+        # ``counter``.
+        copied = self._shallow_copy()
+        copied.counter = counter
+        if renumber:
+            copied.order = counter.next()
+            if copied.oid_prefix is None:
+                copied.oid = 'deformField%s' % copied.order
+        copied._children = [
+            field._copy(counter, renumber) for field in self.children ]
+        return copied
+
+    def _get_widget(self):
+        wdg = self._widget
+        if wdg is None:
+            wdg = self._widget = self._default_widget()
+        return wdg
+
+    def _set_widget(self, widget):
+        self._widget = widget
+
+    widget = property(_get_widget, _set_widget, doc="""\
+        The widget associated with this field.  If a widget is not
+        assigned directly to a field, a default widget is generated
+        (only once) the first time this attribute is used, from the
+        ``widget`` attribute of the schema node, the ``widget_maker``
+        of its type or ``deform.schema.default_widget_makers``.""")
+
+    def _default_widget(self):
         wdg = getattr(self.schema, 'widget', None)
         if wdg is not None:
             return wdg
-        widget_maker = getattr(self.schema.typ, 'widget_maker', None)
+        typ = self.schema.typ
+        share = self.share_default_widgets
+        if share:
+            try:
+                return _shared_widgets[self.schema][typ.__class__]
+            except (KeyError, TypeError):
+                pass
+        widget_maker = getattr(typ, 'widget_maker', None)
         if widget_maker is None:
-            widget_maker = schema.default_widget_makers.get(
-                self.schema.typ.__class__)
+            widget_maker = schema.default_widget_makers.get(typ.__class__)
         if widget_maker is None:
             widget_maker = widget.TextInputWidget
-        return widget_maker()
+        wdg = widget_maker()
+        if share:
+            if isinstance(wdg, widget.Widget):
+                # guard against the widget using itself as a scratchpad
+                object.__setattr__(wdg, '_shared', True)
+            try:
+                shared = _shared_widgets.setdefault(self.schema, {})
+            except TypeError: # schema node is not weakly referenceable
+                pass
+            else:
+                wdg = shared.setdefault(typ.__class__, wdg)
+        return wdg
 
     def get_widget_requirements(self):
         """ Return a sequence of two tuples in the form
@@ -366,21 +883,23 @@ class Field(object):
 
           Set *form* node's widget to a ``MyMappingWidget``.
 
+        Child lookup by name uses an index, so the cost of this method
+        is linear in the number of keys in ``values`` (times the depth
+        of each dotted name), regardless of how many fields the form
+        has.  See also :meth:`deform.Field.find`.
         """
         for k, v in values.items():
             if not k:
                 self.widget = v
             else:
-                path = k.split(separator)
                 field = self
-                while path:
-                    element = path.pop(0)
+                for element in k.split(separator):
                     if element == '*':
                         field = field.children[0]
                     else:
                         field = field[element]
                 field.widget = v
-                
+
     @property
     def errormsg(self):
         """ Return the ``msg`` attribute of the ``error`` attached to
@@ -390,9 +909,28 @@ class Field(object):
 
     def serialize(self, cstruct, readonly=False):
         """ Serialize the cstruct into HTML.  If ``readonly`` is
-        ``True``, render a read-only rendering (no input fields)."""
+        ``True``, render a read-only rendering (no input fields).  If
+        the field has a ``fragment_cache``, the rendering is looked up
+        in it first."""
+        cache = self.fragment_cache
+        if cache is None:
+            cache = _batch_cache.cache
+        if cache is not None:
+            return cache.serialize(self, cstruct, readonly)
         return self.widget.serialize(self, cstruct=cstruct, readonly=readonly)
 
+    def _fragment_key(self):
+        # what the rendering of this field depends on besides its
+        # widget, its subfields and the cstruct (see FragmentCache)
+        extra = [ (k, widget._hashable(v))
+                  for k, v in self._kw.items() if k != 'fragment_cache' ]
+        if self.__dict__:
+            extra.extend([ (k, widget._hashable(v))
+                           for k, v in self.__dict__.items()
+                           if k != 'fragment_cache' ])
+        extra.sort()
+        return self.schema, self.oid, tuple(extra)
+
     def deserialize(self, pstruct):
         """ Deserialize the pstruct into a cstruct."""
         return self.widget.deserialize(self, pstruct)
@@ -415,9 +953,98 @@ class Field(object):
         :meth:`colander.SchemaNode.serialize` and
         :meth:`deform.widget.Widget.serialize` .
         """
+        self._begin()
         cstruct = self.schema.serialize(appstruct)
         return self.serialize(cstruct, readonly=readonly)
 
+    def render_iter(self, appstruct=colander.null, readonly=False,
+                    encoding='utf-8'):
+        """ Like :meth:`deform.Field.render`, but return an iterator
+        over the rendering in chunks instead of a single string.  The
+        chunks joined together are the same as the result of
+        ``render``.
+
+        The iterator is lazy: the item of each mapping or sequence
+        field is rendered only when the iteration reaches it, so that
+        the first chunk is available early and the whole rendering is
+        never held in memory.  If ``encoding`` is not ``None`` (the
+        default is ``utf-8``), the chunks are encoded to byte strings;
+        the iterator can then be used as the ``app_iter`` of a
+        :term:`WSGI` response, e.g.::
+
+           response = webob.Response(app_iter=form.render_iter(appstruct))
+
+        Chunks are produced at the boundaries of the items inserted by
+        the templates of fields which contain a sequence field (``form``,
+        ``mapping``, ``sequence`` and the corresponding ``*_item``
+        templates); the rendering of a field which does not contain a
+        sequence is always a single chunk.
+
+        Iterating over all the chunks is slower than ``render``: about
+        10% to 40% for a sequence of 1000 mappings (e.g. 360 versus 300
+        msec, see ``bench_stream`` in ``benchmarks/bench_render.py``),
+        because the templates of the fields which are split into chunks
+        are rendered once per item instead of including the items.  Use
+        it when the time to the first byte or the memory used by large
+        renderings matters more than throughput.
+        """
+        state = self._begin()
+        cstruct = self.schema.serialize(appstruct)
+        return self._serialize_iter(cstruct, readonly, encoding, state)
+
+    def _serialize_iter(self, cstruct, readonly, encoding, state):
+        # ``state`` is the request state of a shared field, made current
+        # again before each chunk in case several iterators are
+        # interleaved in the same thread
+        chunks = _Stream().serialize(self, cstruct, readonly=readonly)
+        while True:
+            if state is not None:
+                self._resume(state)
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                return
+            if encoding is not None:
+                chunk = chunk.encode(encoding)
+            yield chunk
+
+    def render_many(self, appstructs, readonly=False):
+        """ Render the field (or form) once for each appstruct of the
+        iterable ``appstructs``, e.g. to display a list of objects with
+        the same read-only form.  Return an iterator over the
+        renderings, in the order of ``appstructs``; each is the same as
+        the result of ``render(appstruct, readonly=readonly)``.
+
+        The renderings of the subfields are shared between the items
+        of the batch: a subfield (or a whole mapping) with the same
+        value in several appstructs is only rendered once.  The
+        subfields which have a ``fragment_cache`` use their own; the
+        others use a cache which only lasts for the batch, looked up
+        like a :class:`deform.field.FragmentCache` (a subfield whose
+        ten first renderings all differ is no longer looked up).  The
+        field itself is rendered for each appstruct, and none of the
+        subfields is shared if the field or one of its subfields holds
+        data of the request (e.g. the ``error`` set by a failed
+        validation).
+        """
+        cache = _BatchFragmentCache()
+        for appstruct in appstructs:
+            self._begin()
+            cstruct = self.schema.serialize(appstruct)
+            if self.fragment_cache is not None or _has_scratch(self):
+                yield self.serialize(cstruct, readonly=readonly)
+                continue
+            # the field itself is rendered for each appstruct, only its
+            # subfields are looked up in the batch cache
+            previous = _batch_cache.cache
+            _batch_cache.cache = cache
+            try:
+                html = self.widget.serialize(self, cstruct=cstruct,
+                                             readonly=readonly)
+            finally:
+                _batch_cache.cache = previous
+            yield html
+
     def validate(self, controls):
         """
         Validate the set of controls returned by a form submission
@@ -485,6 +1112,7 @@ class Field(object):
           else:
               return {'form':form.render()} # the form just needs rendering
         """
+        state = self._begin()
         pstruct = peppercorn.parse(controls)
         e = None
 
@@ -502,7 +1130,7 @@ class Field(object):
             self.widget.handle_error(self, e)
 
         if e:
-            raise exception.ValidationFailure(self, cstruct, e)
+            raise exception.ValidationFailure(self, cstruct, e, state=state)
 
         return appstruct
 
@@ -513,3 +1141,359 @@ class Field(object):
             id(self),
             self.schema.name,
             )
+
+
+class Blueprint(object):
+    """ A precompiled field tree.  Most often created via
+    :meth:`deform.Field.compile` (or :meth:`deform.Form.compile`).
+
+    Creating a blueprint walks the schema once, constructing a
+    prototype field tree and resolving the widget, title, required
+    flag, renderer, resource registry and oid of each of its fields.
+    Calling the blueprint returns a new field (or form) whose tree is
+    a structural copy of the prototype, which is much cheaper than
+    walking the schema again.
+
+    Because widgets are resolved once, the fields of every instance
+    stamped out of the same blueprint share the same widget objects.
+    Widgets are meant to be stateless, so this is normally harmless,
+    but it means that changing an attribute of a widget (as opposed
+    to assigning a new widget to a field) affects all instances.
+
+    *Attributes*
+
+        prototype
+            The field tree that instances are copied from.  It should
+            not be used for rendering or validation directly.
+
+        size
+            The number of fields in the prototype tree.
+    """
+    def __init__(self, factory, schema, **kw):
+        prototype = factory(schema, **kw)
+        size = 0
+        stack = [prototype]
+        while stack:
+            field = stack.pop()
+            field.widget # resolve (and keep) the default widget
+            size += 1
+            stack.extend(field.children)
+        self.prototype = prototype
+        self.size = size
+
+    def __call__(self, counter=None, **kw):
+        """ Return a new field (or form) instance copied from the
+        prototype.
+
+        If ``counter`` is ``None``, the instance's fields have the
+        same ``order`` and ``oid`` values that a freshly constructed
+        instance would have.  Otherwise ``counter`` should be an
+        :attr:`itertools.counter` object, and fields are renumbered
+        using it, as if ``counter`` had been passed to the constructor
+        (useful when rendering multiple forms on the same page).
+
+        Any other keyword arguments are attached as attributes to the
+        *root* of the returned tree only (e.g. ``action`` when the
+        blueprint was compiled from a :class:`deform.Form`)."""
+        if counter is None:
+            field = self.prototype._copy(itertools.count(self.size), False)
+        else:
+            field = self.prototype._copy(counter, True)
+        field.__dict__.update(kw)
+        return field
+
+def _freeze(cstruct):
+    # a hashable equivalent of ``cstruct``; raises TypeError if it
+    # contains an unhashable value of another type
+    if isinstance(cstruct, basestring):
+        return cstruct
+    if isinstance(cstruct, dict):
+        return dict, tuple(sorted([ (k, _freeze(v))
+                                    for k, v in cstruct.items() ]))
+    if isinstance(cstruct, (list, tuple)):
+        return tuple([ _freeze(v) for v in cstruct ])
+    if isinstance(cstruct, (set, frozenset)):
+        return frozenset(cstruct)
+    hash(cstruct)
+    return cstruct
+
+def _has_scratch(field):
+    # whether the field or one of its (materialized) subfields holds
+    # data of the request being processed (``error``, ``confirm``...),
+    # which its rendering then depends on
+    if field._scratch(False):
+        return True
+    for child in field._children or ():
+        if _has_scratch(child):
+            return True
+    return False
+
+class _Description(tuple):
+    # the description of a field tree (see FragmentCache._describe),
+    # whose hash is computed once rather than for each lookup
+    def __new__(cls, items):
+        self = tuple.__new__(cls, items)
+        self._hash = tuple.__hash__(self)
+        return self
+
+    def __hash__(self):
+        return self._hash
+
+class FragmentCache(object):
+    """ A bounded cache of the renderings of fields, shared by all the
+    forms (and requests, and threads) which use it.  See the
+    ``fragment_cache`` attribute of :class:`deform.Field`.
+
+    When a field which uses the cache is serialized (by
+    :meth:`deform.Field.render`, or by the template of its parent
+    field), its rendering is looked up by the schema node, oid, extra
+    attributes, widget class and widget attributes of the field and
+    of its subfields, the renderer, the cstruct, the ``readonly``
+    flag and the current locale; if it is not found, the field is
+    rendered and the result cached.  Mappings and sequences are
+    cached as a whole, as well as each of their subfields, so that the
+    unchanged parts of a form are served from the cache when another
+    part changes.
+
+    A field is rendered without the cache when it or one of its
+    subfields holds data of the request being processed (the
+    ``error``, ``sequence_fields``, ``unparseable`` and ``confirm``
+    attributes set when a submission is validated), when its widget
+    or the widget of one of its subfields has a false ``cacheable``
+    attribute (see :class:`deform.widget.Widget`), and when its
+    cstruct contains a value which cannot be hashed.  Sequences are
+    only cached when they are rendered read-only and use path-based
+    oids (see the ``oid_prefix`` argument of :class:`deform.Field`):
+    the rendering of an editable sequence depends on the other
+    sequences of the form, and sequence items get new sequential oids
+    each time they are rendered.  :meth:`deform.Field.render_iter`
+    does not use the cache.
+
+    The description of the widgets of a field and of its subfields is
+    computed once per field object: do not replace or change the
+    widgets of a field once it has been rendered with a cache.
+
+    When the cached renderings are longer than ``size`` characters in
+    total, the least recently used ones are discarded.
+
+    ``locale``, if passed, is a callable which returns the name of
+    the current locale; pass it if the renderer translates into the
+    language of each request.  If the renderer has a ``generation``
+    attribute (as :class:`deform.ZPTRendererFactory` renderers do), a
+    change of its value (e.g. because a template was reloaded)
+    invalidates the renderings made with it.
+
+    *Attributes*
+
+        hits
+            The number of renderings found in the cache.
+
+        misses
+            The number of renderings not found in the cache (and
+            therefore rendered).
+
+        evictions
+            The number of renderings discarded to keep the cache
+            within its size.
+
+        length
+            The total length of the cached renderings.
+    """
+    def __init__(self, size=1024*1024, locale=None):
+        self.size = size
+        self.locale = locale
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.length = 0
+        self._entries = template._OrderedDict()
+        self._subtrees = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _describe(self, field):
+        # a hashable description of the fields and widgets of the tree
+        # of ``field``, and whether its rendering can be cached when it
+        # is editable and when it is read-only
+        memo = self._subtrees.get(field)
+        if memo is not None:
+            return memo
+        wdg = field.widget
+        children = [ self._describe(child) for child in field.children ]
+        cacheable = getattr(wdg, 'cacheable', True)
+        editable = readonly = cacheable
+        if isinstance(wdg, widget.SequenceWidget):
+            editable = False
+            readonly = cacheable and field.oid_prefix is not None
+        for description, child_editable, child_readonly in children:
+            editable = editable and child_editable
+            readonly = readonly and child_readonly
+        config = widget._config(wdg)
+        description = _Description(
+            (field._fragment_key(), wdg.__class__, config,
+             tuple([ child[0] for child in children ])))
+        memo = self._subtrees[field] = (description, editable, readonly)
+        return memo
+
+    def key(self, field, cstruct, readonly):
+        """ Return the key of the rendering of ``field`` with
+        ``cstruct``, or ``None`` if it must not be cached."""
+        if _has_scratch(field):
+            return None
+        subtree, editable, cacheable = self._describe(field)
+        if not readonly:
+            cacheable = editable
+        if not cacheable:
+            return None
+        try:
+            cstruct = _freeze(cstruct)
+        except TypeError:
+            return None
+        locale = self.locale
+        if locale is not None:
+            locale = locale()
+        return subtree, field.renderer, cstruct, bool(readonly), locale
+
+    def get(self, key):
+        generation = getattr(key[1], 'generation', None)
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] != generation:
+                if entry is not None:
+                    self.length -= len(entry[1])
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        # the generation after rendering: loading the templates for the
+        # first time also changes it
+        generation = getattr(key[1], 'generation', None)
+        if len(value) > self.size:
+            return
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.length -= len(entry[1])
+            self._entries[key] = (generation, value)
+            self.length += len(value)
+            while self.length > self.size:
+                key, entry = self._entries.popitem(last=False)
+                self.length -= len(entry[1])
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def serialize(self, field, cstruct, readonly=False):
+        """ Return the rendering of ``field`` with ``cstruct``, from
+        the cache if possible.  This is called by
+        :meth:`deform.Field.serialize`."""
+        key = self.key(field, cstruct, readonly)
+        if key is not None:
+            html = self.get(key)
+            if html is not None:
+                return html
+        html = field.widget.serialize(field, cstruct=cstruct,
+                                      readonly=readonly)
+        if key is not None:
+            self.set(key, html)
+        return html
+
+    def stats(self):
+        """ Return a dictionary of the number of cached renderings
+        (``fragments``), their total ``length``, the ``hits``,
+        ``misses`` and ``evictions`` counters and the ``hit_rate`` (the
+        proportion of hits among lookups, ``0.0`` before the first
+        lookup)."""
+        self._lock.acquire()
+        try:
+            lookups = self.hits + self.misses
+            return {
+                'fragments':len(self._entries),
+                'length':self.length,
+                'hits':self.hits,
+                'misses':self.misses,
+                'evictions':self.evictions,
+                'hit_rate':lookups and float(self.hits) / lookups or 0.0,
+                }
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Discard all the cached renderings and reset the counters."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._subtrees.clear()
+            self.hits = self.misses = self.evictions = self.length = 0
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+class _BatchFragmentCache(FragmentCache):
+    # The fragment cache of a batch rendered by Field.render_many: it
+    # is only used by the thread rendering the batch, for the duration
+    # of the batch, so that it needs neither a lock nor to track the
+    # least recently used renderings; it is emptied when it is full.
+    # The fields of the batch hold no data of a request (render_many
+    # does not use it otherwise), and are all rendered read-only or
+    # all editable.  A subfield whose renderings are not found in the
+    # cache ``patience`` times in a row, and never were, is no longer
+    # looked up: its values do not repeat within the batch.
+    patience = 10
+
+    def __init__(self, size=1024*1024):
+        FragmentCache.__init__(self, size)
+        self._entries = {}
+        # subtree -> the number of misses, or None after a hit
+        self._misses = {}
+
+    def key(self, field, cstruct, readonly):
+        subtree, editable, cacheable = self._describe(field)
+        if not readonly:
+            cacheable = editable
+        if not cacheable:
+            return None
+        misses = self._misses.get(subtree, 0)
+        if misses is not None and misses >= self.patience:
+            return None
+        try:
+            cstruct = _freeze(cstruct)
+        except TypeError:
+            return None
+        return subtree, field.renderer, cstruct
+
+    def get(self, key):
+        html = self._entries.get(key)
+        if html is None:
+            self.misses += 1
+            misses = self._misses.get(key[0], 0)
+            if misses is not None:
+                self._misses[key[0]] = misses + 1
+        else:
+            self.hits += 1
+            self._misses[key[0]] = None
+        return html
+
+    def set(self, key, value):
+        self.length += len(value)
+        if self.length > self.size:
+            self.evictions += len(self._entries)
+            self._entries.clear()
+            self.length = len(value)
+        self._entries[key] = value
+
+class _BatchCache(threading.local):
+    # Per-thread fragment cache of the batch being rendered by
+    # Field.render_many, used by the fields which have no cache of
+    # their own
+    cache = None
+
+_batch_cache = _BatchCache()
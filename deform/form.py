@@ -71,6 +71,12 @@ class Form(field.Field):
        The default value of ``ajax_options`` is a string
        representation of the empty object.
 
+    path_oids
+       If this option is ``True``, the fields of the form use
+       path-based oids prefixed with ``formid`` (see the
+       ``oid_prefix`` argument of :class:`deform.Field`), which are the
+       same each time the form is rendered.  Default: ``False``.
+
     The :class:`deform.Form` constructor also accepts all the keyword
     arguments accepted by the :class:`deform.Field` class.  These
     keywords mean the same thing in the context of a Form as they do
@@ -78,7 +84,10 @@ class Form(field.Field):
     """
     css_class = 'deform'
     def __init__(self, schema, action='', method='POST', buttons=(),
-                 formid='deform', use_ajax=False, ajax_options='{}', **kw):
+                 formid='deform', use_ajax=False, ajax_options='{}',
+                 path_oids=False, **kw):
+        if path_oids:
+            kw.setdefault('oid_prefix', formid)
         field.Field.__init__(self, schema, **kw)
         _buttons = []
         for button in buttons:
@@ -93,6 +102,13 @@ class Form(field.Field):
         self.ajax_options = Raw(ajax_options.strip())
         self.widget = widget.FormWidget()
 
+    def _fragment_key(self):
+        # buttons are compared by their attributes, see
+        # deform.field.FragmentCache
+        buttons = tuple([ tuple(sorted(button.__dict__.items()))
+                          for button in self.buttons ])
+        return field.Field._fragment_key(self) + (buttons,)
+
 class Raw(unicode):
     def __html__(self):
         return self
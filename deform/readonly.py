@@ -0,0 +1,268 @@
+""" Pure-Python versions of the read-only templates of the built-in
+widgets (the ``readonly/*.pt`` files of the ``deform/templates``
+directory).
+
+Each function of :data:`templates` produces exactly the same markup as
+Chameleon produces from the template file of the same name, including
+its whitespace, escaping and translation of values; it is used instead
+of the template by :class:`deform.ZPTRendererFactory` renderers created
+with ``fast_readonly=True`` (see
+:meth:`deform.ZPTRendererFactory.handle`).  A change to one of these
+template files must be made to the corresponding function too."""
+import re
+
+from colander import null
+
+_re_amp = re.compile(r'&(?!([A-Za-z]+|#[0-9]+);)')
+
+_plain = (str, unicode, int, float)
+
+def _escape(text):
+    if '&' in text:
+        if ';' in text:
+            text = _re_amp.sub('&amp;', text)
+        else:
+            text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+class _Translate(object):
+    # The first argument of the functions of ``templates``: the
+    # ``translate`` function of the template loader, and its
+    # ``encoding``, with which Chameleon decodes byte strings.
+    def __init__(self, translate, encoding):
+        self.translate = translate
+        self.encoding = encoding
+
+    def __call__(self, value):
+        return self.translate(value)
+
+def _unicode(translate, value):
+    # see ``ensure_unicode`` in the code Chameleon generates
+    encoding = getattr(translate, 'encoding', None)
+    if encoding:
+        return unicode(str(value), encoding)
+    return str(value)
+
+def _text(translate, value):
+    # see the code Chameleon generates for ``${value}`` in element text
+    if value.__class__ is unicode:
+        return _escape(value)
+    if value.__class__ not in _plain:
+        html = getattr(value, '__html__', None)
+        if html is not None:
+            return html()
+        value = translate(value)
+        if value is None:
+            return ''
+    if not isinstance(value, unicode):
+        value = _unicode(translate, value)
+    return _escape(value)
+
+def _attr(translate, name, value):
+    # see the code Chameleon generates for ``name="${value}"``
+    if value.__class__ is unicode:
+        pass
+    elif value is None or value is False:
+        return ''
+    elif value.__class__ not in _plain:
+        value = unicode(translate(value))
+    elif not isinstance(value, unicode):
+        value = _unicode(translate, value)
+    value = _escape(value)
+    if '"' in value:
+        value = value.replace('"', '&quot;')
+    return ' %s="%s"' % (name, value)
+
+def textinput(translate, field, cstruct, **kw):
+    return u'<p%s>%s</p>' % (_attr(translate, 'id', field.oid),
+                             _text(translate, cstruct))
+
+textarea = textinput
+
+def password(translate, **kw):
+    return u'<div>\n  <em> Password not displayed. </em>\n</div>'
+
+checked_password = password
+
+def checkbox(translate, field, cstruct, **kw):
+    oid = _attr(translate, 'id', field.oid)
+    if cstruct == field.widget.true_val:
+        return u'<span%s>Yes</span>' % oid
+    return u'<em%s>No</em>' % oid
+
+def checkbox_choice(translate, field, cstruct, **kw):
+    selected = kw.get('selected', cstruct)
+    values = kw.get('values')
+    if values is None:
+        values = field.widget.values
+    oid = field.oid
+    choices = []
+    for index, (value, description) in enumerate(values):
+        id = _attr(translate, 'id', '%s-%s' % (oid, index))
+        if value in selected:
+            yes, no = u'<em%s>Yes</em>' % id, u''
+        else:
+            yes, no = u'', u'<em%s>No</em>' % id
+        choices.append(u'<span>%s</span>\n        %s\n        %s\n     ' % (
+            _text(translate, description), yes, no))
+    return u'<div>\n    %s\n</div>' % u' '.join(choices)
+
+def _choices(translate, field, cstruct, values, tag):
+    if values is None:
+        values = field.widget.values
+    choices = []
+    for value, description in values:
+        if value == cstruct:
+            selected, not_selected = u'<em>Selected</em>', u''
+        else:
+            selected, not_selected = u'', u'<em>Not Selected</em>'
+        choices.append(u'<%s>\n  <span>%s</span>\n  %s\n  %s\n</%s>' % (
+            tag, _text(translate, description), selected, not_selected, tag))
+    return u' '.join(choices)
+
+def radio_choice(translate, field, cstruct, **kw):
+    return u'<ul>\n%s\n</ul>' % _choices(translate, field, cstruct,
+                                         kw.get('values'), 'li')
+
+def select(translate, field, cstruct, **kw):
+    return _choices(translate, field, cstruct, kw.get('values'), 'p')
+
+def checked_input(translate, field, cstruct, subject, **kw):
+    return (u'<div>\n  <div>\n    <span>%s</span>\n'
+            u'    <span%s>"%s"</span>\n  </div>\n</div>') % (
+        _text(translate, subject), _attr(translate, 'id', field.oid),
+        _text(translate, cstruct))
+
+def dateparts(translate, field, year, month, day, **kw):
+    oid = field.oid
+    return (u'<div>\n'
+            u'  <span>Year</span>\n  <span%s>%s</span>\n'
+            u'  <span>Month</span>\n  <span%s>%s</span>\n'
+            u'  <span>Day</span>\n  <span%s>%s</span>\n'
+            u'</div>') % (
+        _attr(translate, 'id', oid + '-year'), _text(translate, year),
+        _attr(translate, 'id', oid + '-month'), _text(translate, month),
+        _attr(translate, 'id', oid + '-day'), _text(translate, day))
+
+def file_upload(translate, field, cstruct, **kw):
+    replaces = u''
+    if cstruct.get('uid'):
+        filename = cstruct.get('filename')
+        if filename is None:
+            filename = u''
+        replaces = (u'<div class="replaces">\n    <span>%s</span>\n  </div>' %
+                    _text(translate, filename))
+    return (u'<div class="fileupload">\n\n  %s\n\n'
+            u'  <p><em> Read-only. </em></p>\n\n</div>') % replaces
+
+def mapping_item(translate, field, cstruct, **kw):
+    widget = field.widget
+    title = _attr(translate, 'title', field.description)
+    body = field.serialize(cstruct, readonly=True)
+    if widget.hidden or widget.category == 'structural':
+        return (u'\n  <!-- mapping_item -->\n  \n  %s\n'
+                u'  <!-- /mapping_item -->\n') % body
+    return (u'<li%s>\n  <!-- mapping_item -->\n  <p class="desc"%s>%s</p>\n'
+            u'  %s\n  <!-- /mapping_item -->\n</li>') % (
+        title, title, _text(translate, field.title), body)
+
+def sequence_item(translate, field, cstruct, **kw):
+    body = (u'\n  <!-- sequence_item -->\n  %s\n  <!-- /sequence_item -->\n'
+            % field.serialize(cstruct, readonly=True))
+    if field.widget.hidden:
+        return body
+    return u'<li%s>%s</li>' % (_attr(translate, 'title', field.description),
+                               body)
+
+def _mapping_items(translate, field, cstruct, inline):
+    if inline:
+        return u' '.join([
+            mapping_item(translate, f, cstruct.get(f.name, null))
+            for f in field.children ])
+    rndr = field.renderer
+    tmpl = field.widget.readonly_item_template
+    return u' '.join([ rndr(tmpl, field=f, cstruct=cstruct.get(f.name, null))
+                       for f in field.children ])
+
+def mapping(translate, field, cstruct, inline=False, **kw):
+    title = u''
+    if field.title:
+        title = u'<p>%s</p>' % _text(translate, field.title)
+    description = u''
+    if field.description:
+        description = (u'<li class="section">\n      <div>%s</div>\n    </li>'
+                       % _text(translate, field.description))
+    return (u'<div class="deformMappingFieldset">\n  <!-- mapping -->\n'
+            u'  %s\n  <ul class="readonly">\n    %s\n    %s\n  </ul>\n'
+            u'  <!-- /mapping -->\n</div>') % (
+        title, description,
+        _mapping_items(translate, field, cstruct, inline))
+
+def form(translate, field, cstruct, inline=False, **kw):
+    section = u''
+    if field.title:
+        description = u''
+        if field.description:
+            description = u'<div>%s</div>' % _text(translate,
+                                                   field.description)
+        section = (u'<li class="section first">\n        <h3>%s</h3>\n'
+                   u'        %s\n      </li>') % (
+            _text(translate, field.title), description)
+    return (u'<div class="deform"%s>\n\n  <div class="deformFormFieldset">'
+            u'\n\n      %s\n\n  </div>\n      \n  %s\n  \n</div>') % (
+        _attr(translate, 'id', field.name or None), section,
+        _mapping_items(translate, field, cstruct, inline))
+
+def sequence(translate, field, subfields, inline=False, **kw):
+    if inline:
+        items = [ sequence_item(translate, f, cstruct)
+                  for cstruct, f in subfields ]
+    else:
+        rndr = field.renderer
+        tmpl = field.widget.readonly_item_template
+        items = [ rndr(tmpl, field=f, cstruct=cstruct)
+                  for cstruct, f in subfields ]
+    return (u'<div class="deformSeq readonly">\n  <!-- sequence -->\n\n'
+            u'  %s\n\n  <!-- /sequence -->\n</div>') % u' '.join(
+        [ u'<div>%s</div>' % item for item in items ])
+
+templates = {
+    'readonly/checkbox': checkbox,
+    'readonly/checkbox_choice': checkbox_choice,
+    'readonly/checked_input': checked_input,
+    'readonly/checked_password': checked_password,
+    'readonly/dateparts': dateparts,
+    'readonly/file_upload': file_upload,
+    'readonly/form': form,
+    'readonly/mapping': mapping,
+    'readonly/mapping_item': mapping_item,
+    'readonly/password': password,
+    'readonly/radio_choice': radio_choice,
+    'readonly/select': select,
+    'readonly/sequence': sequence,
+    'readonly/sequence_item': sequence_item,
+    'readonly/textarea': textarea,
+    'readonly/textinput': textinput,
+    }
+
+class _PythonTemplate(object):
+    # a function of ``templates`` called like a Chameleon template
+    def __init__(self, func, translate, filename):
+        self.func = func
+        self.translate = translate
+        self.filename = filename
+
+    def __call__(self, **kw):
+        return self.func(self.translate, **kw)
+
+def python_template(func, translate, filename, encoding=None):
+    """ Return a callable which renders ``func`` (one of the functions
+    of :data:`templates`) with the keyword arguments it is called with,
+    like a Chameleon template.  Its ``filename`` attribute is the file
+    of the template it replaces.  Byte strings are decoded with
+    ``encoding``, the encoding of the loader of the template."""
+    return _PythonTemplate(func, _Translate(translate, encoding), filename)
@@ -144,7 +144,8 @@ class Set(object):
                 node,
                 _('${value} is not iterable', mapping={'value':value})
                 )
-        value =  set(value)
+        if value.__class__ is not set:
+            value = set(value)
         if not value and not self.allow_empty:
             raise colander.Invalid(node, _('Required'))
         return value
@@ -46,15 +46,23 @@ var deform  = {
         // In order to avoid breaking accessibility:
         //
         // - Find each tag within the prototype node with an id
-        //   that has the string ``deformField(\d+)`` within it, and modify 
+        //   that has the string ``deformField(\w+)`` within it, and modify 
         //   its id to have a random component.
         // - For each label referencing an change id, change the label's
         //   htmlFor attribute to the new id.
 
-        var fieldmatch = /deformField(\d+)/;
+        var fieldmatch = /deformField(\w+)/;
         var namematch = /(.+)?-[#]{3}/;
         var code = protonode.attr('prototype');
-        var html = decodeURIComponent(code);
+        var html;
+        if (code) {
+            html = decodeURIComponent(code);
+        } else {
+            // the prototype is emitted once per form as a
+            // <script type="text/template"> block
+            code = $('#' + protonode.attr('prototype-id')).html();
+            html = code.replace(/<\\\/script/gi, '</script');
+        }
         var $htmlnode = $(html);
         var $idnodes = $htmlnode.find('[id]');
         var $namednodes = $htmlnode.find('[name]');
@@ -1,27 +1,427 @@
+import errno
+import imp
+import logging
+import marshal
 import os
+import re
+import tempfile
+import threading
+import time
+import weakref
+try:
+    from hashlib import sha1
+except ImportError: # PRAGMA: no cover
+    from sha import new as sha1
+from pkg_resources import get_distribution
 from pkg_resources import resource_filename
 
+from chameleon.core.filecache import TemplateRegistry
 from chameleon.zpt import language
 from chameleon.zpt.template import PageTemplateFile
 
 from translationstring import ChameleonTranslate
 
+from deform import readonly
 from deform.exception import TemplateError
 
+logger = logging.getLogger(__name__)
+
+_marker = object()
+
+_include = re.compile(r'<\?deform-include\s+([\w/]+)\s*\?>')
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+PRODUCTION_KEY = 'DEFORM_PRODUCTION'
+TRUEVALS = ('t', 'true', 'yes', 'y', 'on', '1')
+
+def production_default():
+    """ Return ``True`` if the ``DEFORM_PRODUCTION`` environment
+    variable is set to a true value (``true``, ``yes``, ``on``,
+    ``1``...)."""
+    return os.environ.get(PRODUCTION_KEY, 'false').lower() in TRUEVALS
+
+class _OrderedDict(object):
+    # The part of ``collections.OrderedDict`` (which needs Python 2.7)
+    # used by the caches of deform to find their least recently used
+    # entries: a dictionary whose keys are kept in a doubly linked list
+    # of ``[previous, next, key, value]`` links, in insertion order.
+    def __init__(self):
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def __setitem__(self, key, value):
+        link = self._map.get(key)
+        if link is not None:
+            link[3] = value
+            return
+        root = self._root
+        last = root[0]
+        link = [last, root, key, value]
+        last[1] = root[0] = self._map[key] = link
+
+    def pop(self, key, *default):
+        link = self._map.pop(key, None)
+        if link is None:
+            if not default:
+                raise KeyError(key)
+            return default[0]
+        previous, following = link[0], link[1]
+        previous[1] = following
+        following[0] = previous
+        return link[3]
+
+    def popitem(self, last=True):
+        if not self._map:
+            raise KeyError('dictionary is empty')
+        if last:
+            key = self._root[0][2]
+        else:
+            key = self._root[1][2]
+        return key, self.pop(key)
+
+    def items(self):
+        result = []
+        root = self._root
+        link = root[1]
+        while link is not root:
+            result.append((link[2], link[3]))
+            link = link[1]
+        return result
+
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[:] = [root, root, None, None]
+
+def _walk(path, reldir, seen):
+    # Like ``os.walk(path, followlinks=True)`` (which needs Python
+    # 2.6), but yields ``(dirpath, reldir, filenames)`` where
+    # ``reldir`` is the tuple of the names of the directories between
+    # the search path directory and ``dirpath``, and visits each
+    # directory once (a link may point to a directory containing it).
+    realpath = os.path.realpath(path)
+    if realpath in seen:
+        return
+    seen.add(realpath)
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return
+    dirnames = []
+    filenames = []
+    for name in names:
+        if os.path.isdir(os.path.join(path, name)):
+            dirnames.append(name)
+        else:
+            filenames.append(name)
+    yield path, reldir, filenames
+    for name in dirnames:
+        for item in _walk(os.path.join(path, name), reldir + (name,), seen):
+            yield item
+
 def cache(func):
     def load(self, *args):
-        template = self.registry.get(args)
-        if template is None:
-            self.registry[args] = template = func(self, *args)
-        return template
+        return self.registry.load(args, func, self, *args)
     return load
 
+class LoaderRegistry(object):
+    """ A thread-safe mapping, used by
+    :class:`deform.template.ZPTTemplateLoader` to keep the templates it
+    loaded.
+
+    If ``maxsize`` is not ``None``, the registry holds at most
+    ``maxsize`` entries: when it is full, adding an entry discards the
+    least recently used one.
+
+    *Attributes*
+
+        hits
+            The number of values found by :meth:`load`.
+
+        misses
+            The number of values not found (and therefore computed) by
+            :meth:`load`.
+
+        evictions
+            The number of entries discarded because the registry was
+            full.
+    """
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = _OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            value = self._entries.pop(key, _marker)
+            if value is _marker:
+                return default
+            self._entries[key] = value
+            return value
+        finally:
+            self._lock.release()
+
+    def __setitem__(self, key, value):
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def items(self):
+        self._lock.acquire()
+        try:
+            return self._entries.items()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Discard all the entries and reset the counters."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+        finally:
+            self._lock.release()
+
+    def load(self, key, func, *args):
+        """ Return the value of ``key``.  If it is missing, call
+        ``func(*args)`` and store its result as the value of ``key``
+        before returning it.  Threads which ask for the same missing key
+        concurrently wait for the first one to compute it instead of
+        each calling ``func``."""
+        value = self.get(key, _marker)
+        if value is _marker:
+            self._lock.acquire()
+            try:
+                lock = self._loading.setdefault(key, threading.Lock())
+            finally:
+                self._lock.release()
+            lock.acquire()
+            try:
+                value = self.get(key, _marker)
+                if value is _marker:
+                    try:
+                        value = func(*args)
+                        self[key] = value
+                    finally:
+                        self._lock.acquire()
+                        try:
+                            self._loading.pop(key, None)
+                            self.misses += 1
+                        finally:
+                            self._lock.release()
+                    return value
+            finally:
+                lock.release()
+        self._lock.acquire()
+        try:
+            self.hits += 1
+        finally:
+            self._lock.release()
+        return value
+
+class CompiledTemplateCache(TemplateRegistry):
+    """ A Chameleon template registry which stores the compiled code of
+    a template in files of the directory ``path``, so that other
+    processes (and later runs) using the same directory do not need to
+    compile the template again.
+
+    Each file is named after a hash of the template source, of the
+    render function it holds, of the Chameleon version and of the
+    Python bytecode version, so a file is never used for a template
+    which changed, nor by an incompatible Chameleon or Python.  Files
+    are written to a temporary file first and then renamed, so that
+    concurrent processes never read a partially written file (the
+    temporary file is removed if writing it fails).  Errors reading or
+    writing the files are logged and otherwise ignored."""
+    chameleon_version = get_distribution('Chameleon').version
+
+    def __init__(self, path, template):
+        TemplateRegistry.__init__(self)
+        self.path = path
+        self.template = template
+
+    def filename(self, key):
+        digest = sha1(repr((self.chameleon_version, imp.get_magic(),
+                            self.template.body, key)))
+        return os.path.join(self.path, digest.hexdigest() + '.chameleon')
+
+    def __contains__(self, key):
+        if key in self.registry:
+            return True
+        filename = self.filename(key)
+        try:
+            f = open(filename, 'rb')
+            try:
+                code = marshal.loads(f.read())
+            finally:
+                f.close()
+        except IOError:
+            return False
+        except (EOFError, ValueError, TypeError), e:
+            logger.warning('Ignoring invalid compiled template %s (%s)',
+                           filename, e)
+            return False
+        self.registry[key] = self.bind(code, self.template.filename)
+        return True
+
+    def add(self, key, source, filename):
+        code = compile(source, filename, 'exec')
+        self.registry[key] = self.bind(code, filename)
+        target = self.filename(key)
+        tmpname = None
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+            try:
+                os.write(fd, marshal.dumps(code))
+            finally:
+                os.close(fd)
+            os.rename(tmpname, target)
+        except (IOError, OSError), e:
+            if tmpname is not None:
+                try:
+                    os.unlink(tmpname)
+                except OSError:
+                    pass
+            logger.warning('Can not write compiled template %s (%s)',
+                           target, e)
+
+    def bind(self, code, filename):
+        # see chameleon.core.filecache.TemplateRegistry.add
+        _locals = {'__filename__': filename}
+        exec code in _locals
+        return _locals['bind']()
+
+class ZPTTemplateFile(PageTemplateFile):
+    """ A Chameleon page template file which increments the
+    ``generation`` of its loader each time its source is read (when it
+    is loaded, and when it is reloaded because it changed).  If the
+    loader has a ``cache_dir``, compiled code is stored in it (see
+    :class:`deform.template.CompiledTemplateCache`).  The time spent
+    compiling the template is added to the ``compile_time`` of its
+    loader.
+
+    A ``<?deform-include name?>`` processing instruction in the source
+    is replaced by the source of the Deform template ``name`` (e.g.
+    ``readonly/mapping_item``) when the template is read, so that a
+    template can render the markup of another one without calling it;
+    it is read again when the included template changes, if
+    ``auto_reload`` is true."""
+    # Chameleon keeps the first template loaded from each file here, for
+    # XIncludes; a weak mapping lets the loader registry discard them
+    global_registry = weakref.WeakValueDictionary()
+
+    # the files included in the source
+    includes = ()
+
+    def __init__(self, filename, parser, loader=None, **kw):
+        self.loader = loader
+        if loader is not None and loader.cache_dir is not None:
+            self.registry = CompiledTemplateCache(loader.cache_dir, self)
+        PageTemplateFile.__init__(self, filename, parser, **kw)
+
+    def read(self):
+        result = PageTemplateFile.read(self)
+        body = self.__dict__.get('body')
+        if body and '<?deform-include' in body:
+            self.includes = []
+            self.body = _include.sub(self._include, body)
+            self._v_last_read = self.mtime()
+        if self.loader is not None:
+            self.loader.generation += 1
+        return result
+
+    def _include(self, match):
+        filename = os.path.join(default_dir, match.group(1) + '.pt')
+        f = open(filename, 'rb')
+        try:
+            body = f.read()
+        finally:
+            f.close()
+        self.includes.append(filename)
+        return body.strip()
+
+    def mtime(self):
+        mtime = PageTemplateFile.mtime(self)
+        for filename in self.includes:
+            mtime = max(mtime, _mtime(filename) or 0)
+        return mtime
+
+    def parse(self):
+        start = time.time()
+        PageTemplateFile.parse(self)
+        self.loader_compiled(time.time() - start)
+        compiler = self.__dict__.get('compiler')
+        if compiler is not None:
+            def timed_compiler(*args):
+                start = time.time()
+                try:
+                    return compiler(*args)
+                finally:
+                    self.loader_compiled(time.time() - start)
+            self.__dict__['compiler'] = timed_compiler
+
+    def loader_compiled(self, seconds):
+        if self.loader is not None:
+            self.loader.compiled(seconds)
+
+    def cook(self):
+        """ Compile the template, as its first rendering would."""
+        # see chameleon.core.template.Template.cook_and_render: this is
+        # the key of the render function used by ``render``
+        key = None, True, self.signature
+        if key not in self.registry:
+            self.acquire()
+            try:
+                source = self.compiler(None, True)
+            finally:
+                self.release()
+            self.registry.add(key, source, self.filename)
+
 class ZPTTemplateLoader(object):
-    """ A Chameleon ZPT template loader """
+    """ A Chameleon ZPT template loader.  Loaded templates are kept in
+    a :class:`deform.template.LoaderRegistry` of size ``maxsize``
+    (unbounded if ``None``).
+
+    Template names are looked up in an index of the ``.pt`` files of
+    the directories of the search path and their subdirectories (see
+    :meth:`index`), built the first time a template is loaded.  If
+    ``auto_reload`` is true, the index is built again when a file is
+    added to or removed from one of these directories."""
     parser = language.Parser()
 
     def __init__(self, search_path=None, auto_reload=True, debug=True,
-                 encoding='utf-8', translate=None):
+                 encoding='utf-8', translate=None, cache_dir=None,
+                 maxsize=None):
         if search_path is None:
             search_path = []
         if isinstance(search_path, basestring):
@@ -31,25 +431,92 @@ class ZPTTemplateLoader(object):
         self.debug = debug
         self.encoding = encoding
         self.translate = translate
-        self.registry = {}
-        self.notexists = {}
+        self.registry = LoaderRegistry(maxsize)
+        self._index = None
+        self._mtimes = None
+        self.generation = 0
+        self.compile_time = 0.0
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            try:
+                os.makedirs(cache_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.cache_dir = cache_dir
+
+    def compiled(self, seconds):
+        self._lock.acquire()
+        try:
+            self.compile_time += seconds
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """ Return a dictionary of statistics about the templates of
+        this loader: ``templates``, the number of templates currently
+        loaded; ``hits`` and ``misses``, the number of requests for a
+        template which was loaded already, or not; ``evictions``, the
+        number of templates discarded because the registry was full;
+        and ``compile_time``, the total time (in seconds) spent
+        compiling templates."""
+        registry = self.registry
+        return dict(templates=len(registry),
+                    hits=registry.hits,
+                    misses=registry.misses,
+                    evictions=registry.evictions,
+                    compile_time=self.compile_time)
+
+    def index(self):
+        """ Return a dictionary mapping the name of each template found
+        in the search path (relative to its search path directory,
+        with ``/`` separators and the ``.pt`` extension, e.g.
+        ``readonly/form.pt``) to its file.  When a name exists in
+        several directories, the file of the first directory of the
+        search path is used.  Symbolic links to directories are
+        followed."""
+        if self._index is None or (self.auto_reload and self._changed()):
+            self._build_index()
+        return self._index
+
+    def _changed(self):
+        for dirpath, mtime in self._mtimes.items():
+            if _mtime(dirpath) != mtime:
+                return True
+        return False
+
+    def _build_index(self):
+        index = {}
+        mtimes = {}
+        for path in self.search_path:
+            mtimes[path] = _mtime(path)
+            for dirpath, reldir, filenames in _walk(path, (), set()):
+                mtimes[dirpath] = _mtime(dirpath)
+                for filename in filenames:
+                    if filename.endswith('.pt'):
+                        name = '/'.join(reldir + (filename,))
+                        index.setdefault(name,
+                                         os.path.join(dirpath, filename))
+        self._index, self._mtimes = index, mtimes
 
     @cache
     def load(self, filename):
-        for path in self.search_path:
-            path = os.path.join(path, filename)
-            if (path in self.notexists) and (not self.auto_reload):
-                raise TemplateError("Can not find template %s" % filename)
+        path = self.index().get(filename.replace(os.sep, '/'))
+        if path is None and os.path.isabs(filename):
+            path = filename
+        if path is not None:
             try:
-                return PageTemplateFile(path, parser=self.parser,
-                                        auto_reload=self.auto_reload,
-                                        debug = self.debug,
-                                        encoding=self.encoding,
-                                        translate=self.translate)
+                return ZPTTemplateFile(path, parser=self.parser,
+                                       loader=self,
+                                       auto_reload=self.auto_reload,
+                                       debug = self.debug,
+                                       encoding=self.encoding,
+                                       translate=self.translate)
             except OSError:
-                self.notexists[path] = True
-
-        raise TemplateError("Can not find template %s" % filename)
+                # removed since the index was built
+                self._index = None
+        raise TemplateError("Can not find template %s in %s" % (
+            filename, ', '.join(self.search_path) or 'an empty search path'))
 
 class ZPTRendererFactory(object):
     """
@@ -88,19 +555,164 @@ class ZPTRendererFactory(object):
        during output.  It must accept a translation string and return
        an interpolated translation.  Default: ``None`` (no translation
        performed).
+
+    production
+       If true, use the production profile: ``auto_reload`` and
+       ``debug`` are both turned off whatever their value, so template
+       files are never checked for changes once compiled, and all the
+       templates found in ``search_path`` are compiled by the
+       constructor; the name and file of each compiled template are
+       logged (at the ``INFO`` level, by the ``deform.template``
+       logger) and available from
+       :meth:`deform.ZPTRendererFactory.loaded_templates`.  Default:
+       ``None``, meaning true if the ``DEFORM_PRODUCTION`` environment
+       variable is set to a true value (e.g. ``DEFORM_PRODUCTION=1``),
+       false otherwise.  See also
+       :meth:`deform.ZPTRendererFactory.preload`.
+
+    cache_dir
+       The path of a directory (created if needed) where the compiled
+       code of templates is stored, and reused by other processes and
+       later runs instead of compiling the templates again; this
+       shortens the start of new processes.  Several processes may
+       share the directory.  Files are never removed, even when the
+       template they were compiled from changes.  Default: ``None``
+       (compiled code is kept in memory only).
+
+    maxsize
+       The maximum number of templates kept loaded; when it is reached,
+       the least recently used template is discarded (and compiled
+       again if it is used later).  Useful when an application renders
+       templates whose names are computed at runtime.  Default:
+       ``None`` (no limit).  See
+       :meth:`deform.ZPTRendererFactory.stats`.
+
+    fast_readonly
+       If true, the read-only templates of the built-in widgets (the
+       ``readonly/*.pt`` templates of the ``deform/templates``
+       directory) are rendered by the Python functions of
+       :mod:`deform.readonly`, which produce the same markup several
+       times faster, unless they are overridden by a template of the
+       same name in another directory of ``search_path``.  Default:
+       ``False``.
+
+    The ``generation`` attribute of the renderer is a number which
+    changes each time a template is loaded or reloaded.
+
+    Calling the renderer resolves the template name with
+    :meth:`deform.ZPTRendererFactory.handle`.
     """
     def __init__(self, search_path, auto_reload=True, debug=True,
-                 encoding='utf-8', translator=None):
+                 encoding='utf-8', translator=None, production=None,
+                 cache_dir=None, maxsize=None, fast_readonly=False):
+        if production is None:
+            production = production_default()
+        if production:
+            auto_reload = debug = False
+        self.production = production
         translate = ChameleonTranslate(translator)
         loader = ZPTTemplateLoader(search_path=search_path,
                                    auto_reload=auto_reload,
                                    debug=debug,
                                    encoding=encoding,
-                                   translate=translate)
+                                   translate=translate,
+                                   cache_dir=cache_dir,
+                                   maxsize=maxsize)
         self.loader = loader
+        self.fast_readonly = fast_readonly
+        self._handles = {}
+        if production:
+            self.preload()
+
+    def preload(self):
+        """ Load and compile all the templates found in the directories
+        of the search path (and their subdirectories, such as
+        ``readonly``), instead of compiling each template the first
+        time it is used.  When a template name exists in several
+        directories, the one that the renderer would use is compiled.
+
+        Calling this method when an application starts avoids slow
+        first renderings; in a pre-forking server, calling it in the
+        master process before the workers are forked also lets the
+        workers share the compiled templates (copy-on-write) instead of
+        compiling them each.
+
+        Return a list of ``(name, filename, seconds)`` tuples, sorted
+        by name: the name and file of each template and the time spent
+        loading and compiling it (zero if it was compiled already).
+        Each template is also logged at the ``INFO`` level by the
+        ``deform.template`` logger."""
+        result = []
+        for name in sorted(self.loader.index()):
+            start = time.time()
+            template = self.loader.load(name)
+            template.cook()
+            seconds = time.time() - start
+            logger.info('Compiled template %s from %s in %.1f ms', name[:-3],
+                        template.filename, seconds * 1000)
+            result.append((name[:-3], template.filename, seconds))
+        return result
+
+    def loaded_templates(self):
+        """ Return a sorted list of ``(name, filename)`` pairs, one for
+        each template compiled so far: ``name`` is the name of the
+        template (as passed to the renderer) and ``filename`` the file
+        it was loaded from."""
+        result = []
+        for args, template in self.loader.registry.items():
+            result.append((args[0][:-3], template.filename))
+        return sorted(result)
+
+    def stats(self):
+        """ Return a dictionary of statistics about the templates
+        loaded by this renderer (see
+        :meth:`deform.template.ZPTTemplateLoader.stats`)."""
+        return self.loader.stats()
+
+    @property
+    def generation(self):
+        return self.loader.generation
+
+    def handle(self, template_name):
+        """ Return a callable which renders the template named
+        ``template_name`` (without the ``.pt`` extension): calling it
+        with keyword arguments is equivalent to calling the renderer
+        with ``template_name`` and the same arguments, without looking
+        the template up again.  The callable remains valid when the
+        template file changes (it is reloaded if ``auto_reload`` is
+        true).
+
+        Handles are resolved once per template name and kept by the
+        renderer, unless the renderer has a ``maxsize``, in which case
+        the template is looked up in the loader registry each time
+        (so that the size of the registry remains bounded)."""
+        template = self._handles.get(template_name)
+        if template is None:
+            template = self._python_template(template_name)
+            if template is None:
+                template = self.loader.load(template_name + '.pt')
+            if self.loader.registry.maxsize is None:
+                self._handles[template_name] = template
+        return template
+
+    def _python_template(self, template_name):
+        func = None
+        if self.fast_readonly:
+            func = readonly.templates.get(template_name)
+        if func is None:
+            return None
+        filename = self.loader.index().get(template_name + '.pt')
+        default = os.path.join(default_dir, template_name + '.pt')
+        if filename is None or (os.path.abspath(filename) !=
+                                os.path.abspath(default)):
+            # overridden
+            return None
+        return readonly.python_template(func, self.loader.translate,
+                                        os.path.abspath(filename),
+                                        self.loader.encoding)
 
     def __call__(self, template_name, **kw):
-        return self.loader.load(template_name + '.pt')(**kw)
+        return self.handle(template_name)(**kw)
 
 
 default_dir = resource_filename('deform', 'templates/')
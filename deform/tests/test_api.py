@@ -12,6 +12,7 @@ class TestAPI(unittest.TestCase):
 
         from deform import ValidationFailure
         from deform import TemplateError
+        from deform import WidgetMutationError
 
         from deform import ZPTRendererFactory
         from deform import default_renderer
@@ -1,9 +1,9 @@
 import unittest
 
 class TestValidationFailure(unittest.TestCase):
-    def _makeOne(self, field, cstruct, error):
+    def _makeOne(self, field, cstruct, error, state=None):
         from deform.exception import ValidationFailure
-        return ValidationFailure(field, cstruct, error)
+        return ValidationFailure(field, cstruct, error, state=state)
 
     def test_render(self):
         widget = DummyWidget()
@@ -12,10 +12,35 @@ class TestValidationFailure(unittest.TestCase):
         e = self._makeOne(form, cstruct, None)
         result = e.render()
         self.assertEqual(result, cstruct)
+        self.assertEqual(form.resumed, None)
+
+    def test_render_resumes_state(self):
+        widget = DummyWidget()
+        form = DummyForm(widget)
+        state = {}
+        e = self._makeOne(form, {}, None, state=state)
+        e.render()
+        self.failUnless(form.resumed is state)
+
+    def test_render_iter(self):
+        widget = DummyWidget()
+        form = DummyForm(widget)
+        state = {}
+        e = self._makeOne(form, {}, None, state=state)
+        result = e.render_iter(encoding=None)
+        self.assertEqual(result, ({}, False, None, state))
+        self.failUnless(form.resumed is state)
 
 class DummyForm(object):
+    resumed = None
     def __init__(self, widget):
         self.widget = widget
+
+    def _resume(self, state):
+        self.resumed = state
+
+    def _serialize_iter(self, cstruct, readonly, encoding, state):
+        return cstruct, readonly, encoding, state
     
 class DummyWidget(object):
     def serialize(self, field, cstruct):
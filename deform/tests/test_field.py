@@ -29,6 +29,7 @@ class TestField(unittest.TestCase):
         self.assertEqual(field.required, True)
         self.assertEqual(field.order, 0)
         self.assertEqual(field.oid, 'deformField0')
+        self.assertEqual(field.oid_prefix, None)
         self.assertEqual(field.children, [])
         self.assertEqual(field.typ, schema.typ)
 
@@ -71,6 +72,122 @@ class TestField(unittest.TestCase):
         self.assertEqual(child_field.foo, 'foo')
         self.assertEqual(child_field.bar, 'bar')
 
+    def test_ctor_aliases_read_through(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        schema.title = 'new title'
+        self.assertEqual(field.title, 'new title')
+        field.title = 'override'
+        self.assertEqual(field.title, 'override')
+        self.assertEqual(schema.title, 'new title')
+
+    def test_ctor_unknown_kwargs_stored_once(self):
+        schema = DummySchema()
+        node = DummySchema()
+        schema.children = [node]
+        field = self._makeOne(schema, foo='foo')
+        child_field = field.children[0]
+        self.failUnless(child_field._kw is field._kw)
+        self.assertEqual(field.__dict__, {})
+        self.assertEqual(child_field.__dict__, {})
+        child_field.foo = 'bar'
+        self.assertEqual(child_field.foo, 'bar')
+        self.assertEqual(field.foo, 'foo')
+        self.assertRaises(AttributeError, getattr, field, 'bar')
+
+    def test_ctor_kwargs_shadowing_class_attributes(self):
+        schema = DummySchema()
+        node = DummySchema()
+        schema.children = [node]
+        field = self._makeOne(schema, title='title2', _private=1)
+        self.assertEqual(field.title, 'title2')
+        self.assertEqual(field.children[0].title, 'title2')
+        self.assertEqual(field.children[0]._private, 1)
+
+    def test_ctor_lazy(self):
+        from deform.field import Field
+        schema = DummySchema()
+        node = DummySchema()
+        node.name = 'node'
+        subnode = DummySchema()
+        node.children = [subnode]
+        schema.children = [node]
+        field = self._makeOne(schema, renderer='abc', lazy=True, foo='foo')
+        self.assertEqual(field._children, None)
+        self.assertEqual(field.counter.next(), 1)
+        child_field = field['node']
+        self.assertEqual(len(field.children), 1)
+        self.assertEqual(child_field.__class__, Field)
+        self.assertEqual(child_field.schema, node)
+        self.assertEqual(child_field.renderer, 'abc')
+        self.assertEqual(child_field.foo, 'foo')
+        self.assertEqual(child_field.order, 2)
+        self.assertEqual(child_field._children, None)
+        self.assertEqual(child_field.children[0].schema, subnode)
+        self.failUnless(field.children is field.children)
+
+    def test_ctor_lazy_state(self):
+        schema = DummySchema()
+        a = DummySchema()
+        a.name = 'a'
+        b = DummySchema()
+        b.name = 'b'
+        schema.children = [a, b]
+        field = self._makeOne(schema, lazy=True)
+        field.error = 'parent'
+        self.assertEqual(field['a'].error, None)
+        self.assertEqual(field['b'].error, None)
+        field['a'].error = 'a'
+        self.assertEqual(field.error, 'parent')
+        self.assertEqual(field['b'].error, None)
+
+    def test_ctor_oid_prefix(self):
+        schema = DummySchema()
+        node = DummySchema()
+        node.name = 'first_name'
+        subnode = DummySchema()
+        subnode.name = u'caf\xe9-1'
+        node.children = [subnode]
+        schema.children = [node]
+        field = self._makeOne(schema, oid_prefix='myform')
+        self.assertEqual(field.oid_prefix, 'myform')
+        self.assertEqual(field.oid, 'deformField_myform')
+        child = field.children[0]
+        self.assertEqual(child.oid_prefix, 'myform')
+        self.assertEqual(child.oid, 'deformField_myform__first_5fname')
+        self.assertEqual(child.children[0].oid,
+                         'deformField_myform__first_5fname__caf_c3_a9_2d1')
+        self.assertEqual(child.order, 1)
+
+    def test_ctor_oid_prefix_lazy(self):
+        schema = DummySchema()
+        node = DummySchema()
+        node.name = 'node'
+        schema.children = [DummySchema(), node]
+        field = self._makeOne(schema, lazy=True, oid_prefix='f')
+        self.assertEqual(field['node'].oid, 'deformField_f__node')
+        eager = self._makeOne(schema, oid_prefix='f')
+        self.assertEqual([ f.oid for f in field.children ],
+                         [ f.oid for f in eager.children ])
+
+    def test_clone_oid_prefix(self):
+        schema = DummySchema()
+        schema.children = [DummySchema()]
+        field = self._makeOne(schema, oid_prefix='f')
+        cloned = field.clone()
+        self.assertEqual(cloned.oid, 'deformField_f')
+        self.assertEqual(cloned.oid_prefix, 'f')
+        self.assertEqual(cloned.children[0].oid, 'deformField_f__name')
+        self.assertEqual(cloned.order, 2)
+
+    def test__rebase_oid(self):
+        schema = DummySchema()
+        schema.children = [DummySchema()]
+        field = self._makeOne(schema, oid_prefix='f')
+        field._rebase_oid('deformField_f__3')
+        self.assertEqual(field.oid, 'deformField_f__3')
+        self.assertEqual(field.children[0].oid, 'deformField_f__3__name')
+
     def test_set_default_renderer(self):
         cls = self._getTargetClass()
         old = cls.default_renderer
@@ -107,6 +224,18 @@ class TestField(unittest.TestCase):
         finally:
             cls.set_default_renderer(old)
 
+    def test_set_zpt_renderer_production(self):
+        cls = self._getTargetClass()
+        old = cls.default_renderer
+        from pkg_resources import resource_filename
+        template_dir = resource_filename('deform', 'tests/fixtures/')
+        try:
+            cls.set_zpt_renderer(template_dir, production=True)
+            self.assertEqual(cls.default_renderer.production, True)
+            self.assertEqual(cls.default_renderer.loader.auto_reload, False)
+        finally:
+            cls.set_default_renderer(old)
+
     def test_widget_uses_schema_widget(self):
         widget = DummyWidget()
         schema = DummySchema()
@@ -142,6 +271,52 @@ class TestField(unittest.TestCase):
         widget = field.widget
         self.assertEqual(widget.__class__, TextInputWidget)
 
+    def test_widget_share_default_widgets(self):
+        from colander import Mapping
+        from deform.widget import MappingWidget
+        from deform.exception import WidgetMutationError
+        cls = self._getTargetClass()
+        schema = DummySchema()
+        schema.typ = Mapping()
+        cls.share_default_widgets = True
+        try:
+            widget1 = self._makeOne(schema).widget
+            widget2 = self._makeOne(schema).widget
+            other = self._makeOne(DummySchema()).widget
+        finally:
+            cls.share_default_widgets = False
+        self.assertEqual(widget1.__class__, MappingWidget)
+        self.failUnless(widget1 is widget2)
+        self.failIf(other is widget1)
+        self.assertRaises(WidgetMutationError, setattr, widget1, 'foo', 1)
+        self.failIf(self._makeOne(schema).widget is widget1)
+
+    def test_widget_share_default_widgets_not_widget(self):
+        cls = self._getTargetClass()
+        schema = DummySchema()
+        def maker():
+            return 'a widget'
+        schema.typ = DummyType(maker=maker)
+        cls.share_default_widgets = True
+        try:
+            widget = self._makeOne(schema).widget
+        finally:
+            cls.share_default_widgets = False
+        self.assertEqual(widget, 'a widget')
+
+    def test_widget_share_default_widgets_schema_widget(self):
+        cls = self._getTargetClass()
+        widget = DummyWidget()
+        schema = DummySchema()
+        schema.widget = widget
+        cls.share_default_widgets = True
+        try:
+            result = self._makeOne(schema).widget
+        finally:
+            cls.share_default_widgets = False
+        self.failUnless(result is widget)
+        widget.foo = 1 # not guarded
+
     def test_set_widgets_emptystring(self):
         schema = DummySchema()
         field = self._makeOne(schema, renderer='abc')
@@ -268,6 +443,36 @@ class TestField(unittest.TestCase):
         self.assertEqual(result.children, [child])
         self.assertEqual(result.children[0].cloned, True)
 
+    def test_clone_structural(self):
+        from deform.field import Field
+        inits = []
+        class MyField(Field):
+            def __init__(self, schema, **kw):
+                inits.append(schema)
+                Field.__init__(self, schema, **kw)
+        schema = DummySchema()
+        schema.children = [DummySchema()]
+        field = MyField(schema)
+        self.assertEqual(len(inits), 1)
+        result = field.clone()
+        self.assertEqual(len(inits), 1)
+        self.assertEqual(result.__class__, MyField)
+        self.assertEqual(result.oid, 'deformField2')
+        self.assertEqual(result.children[0].oid, 'deformField3')
+        self.failIf(result.children is field.children)
+        self.failIf(result.children[0] is field.children[0])
+        self.assertEqual(result.children[0].schema, field.children[0].schema)
+
+    def test_clone_lazy_not_materialized(self):
+        schema = DummySchema()
+        schema.children = [DummySchema()]
+        field = self._makeOne(schema, lazy=True)
+        result = field.clone()
+        self.assertEqual(field._children, None)
+        self.assertEqual(result._children, None)
+        self.assertEqual(result.children[0].schema, schema.children[0])
+        self.assertEqual(field._children, None)
+
     def test___iter__(self):
         schema = DummySchema()
         field = self._makeOne(schema)
@@ -291,6 +496,69 @@ class TestField(unittest.TestCase):
         field.children = [child]
         self.assertRaises(KeyError, field.__getitem__, 'nope')
 
+    def test___getitem__uses_index(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        child1 = DummyField(name='child1')
+        child2 = DummyField(name='child2')
+        field.children = [child1, child2]
+        self.assertEqual(field['child2'], child2)
+        self.assertEqual(field._index, {'child1':0, 'child2':1})
+        self.assertEqual(field['child1'], child1)
+
+    def test___getitem__duplicate_names_first_wins(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        child1 = DummyField(name='child')
+        child2 = DummyField(name='child')
+        field.children = [child1, child2]
+        self.assertEqual(field['child'], child1)
+
+    def test___getitem__children_assigned(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        child1 = DummyField(name='child1')
+        field.children = [child1]
+        self.assertEqual(field['child1'], child1)
+        child2 = DummyField(name='child1')
+        field.children = [child2]
+        self.assertEqual(field._index, None)
+        self.assertEqual(field['child1'], child2)
+
+    def test___getitem__children_mutated_in_place(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        child1 = DummyField(name='child1')
+        child2 = DummyField(name='child2')
+        field.children = [child1, child2]
+        self.assertEqual(field['child2'], child2)
+        del field.children[0]
+        self.assertEqual(field['child2'], child2)
+        self.assertRaises(KeyError, field.__getitem__, 'child1')
+        child3 = DummyField(name='child3')
+        field.children.insert(0, child3)
+        self.assertEqual(field['child3'], child3)
+        self.assertEqual(field['child2'], child2)
+
+    def test_find(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        child1 = self._makeOne(DummySchema())
+        child1.children = [DummyField(name='a'), DummyField(name='b')]
+        child2 = self._makeOne(DummySchema())
+        b = DummyField(name='b')
+        child2.children = [b]
+        field.children = [child1, child2]
+        self.assertEqual(field.find(''), [field])
+        self.assertEqual(field.find('name'), [child1])
+        self.assertEqual(field.find('*'), [child1, child2])
+        self.assertEqual(field.find('*.b'), [child1.children[1], b])
+        self.assertEqual(field.find('*/b', separator='/'),
+                         [child1.children[1], b])
+        self.assertEqual(field.find('*.*'), child1.children + [b])
+        self.assertEqual(field.find('nope.b'), [])
+        self.assertEqual(field.find('*.nope'), [])
+
     def test_errormsg_error_None(self):
         schema = DummySchema()
         field = self._makeOne(schema)
@@ -362,6 +630,86 @@ class TestField(unittest.TestCase):
         self.assertEqual(e.field, field)
         self.assertEqual(e.error, schema_invalid)
 
+    def test_validate_fails_shared(self):
+        from colander import Invalid
+        fields = [
+            ('name', 'Name'),
+            ('title', 'Title'),
+            ]
+        invalid = Invalid(None, None)
+        schema = DummySchema(invalid)
+        field = self._makeOne(schema)
+        field.widget = DummyWidget()
+        field.share()
+        e = validation_failure_exc(field.validate, fields)
+        self.assertEqual(field.widget.error, invalid)
+        self.failUnless(e.state is field._state.current)
+        field.error = invalid
+        field.render('abc')
+        self.assertEqual(field.error, None)
+        field._resume(e.state)
+        self.assertEqual(field.error, invalid)
+
+    def test_scratch_attributes_defaults(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        self.assertEqual(field.error, None)
+        self.assertEqual(field.sequence_fields, ())
+        self.assertEqual(field.unparseable, None)
+        self.assertEqual(field.confirm, '')
+        self.assertEqual(field._state, None)
+
+    def test_scratch_attributes_private(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        field.error = 'error'
+        field.confirm = 'confirm'
+        self.assertEqual(field._state, {'error':'error', 'confirm':'confirm'})
+        del field.confirm
+        self.assertEqual(field.confirm, '')
+        cloned = field.clone()
+        cloned.error = 'other'
+        self.assertEqual(field.error, 'error')
+
+    def test_share(self):
+        schema = DummySchema()
+        node = DummySchema()
+        node.name = 'node'
+        schema.children = [node]
+        field = self._makeOne(schema, lazy=True)
+        self.assertEqual(field.shared, False)
+        self.assertEqual(field.share(), field)
+        self.assertEqual(field.shared, True)
+        child = field.children[0]
+        self.assertEqual(child.shared, True)
+        self.failIf(child._widget is None)
+        self.failUnless(child._state is field._state)
+        self.assertEqual(child.clone()._state, child._state)
+
+    def test_share_state_per_thread(self):
+        import threading
+        schema = DummySchema()
+        field = self._makeOne(schema).share()
+        field.error = 'main'
+        seen = []
+        def run():
+            seen.append(field.error)
+            field.error = 'thread'
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None])
+        self.assertEqual(field.error, 'main')
+
+    def test_render_shared_begins_new_state(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        field.widget = DummyWidget()
+        field.share()
+        field.error = 'error'
+        self.assertEqual(field.render('abc'), 'abc')
+        self.assertEqual(field.error, None)
+
     def test_render(self):
         schema = DummySchema()
         field = self._makeOne(schema)
@@ -376,6 +724,78 @@ class TestField(unittest.TestCase):
         self.assertEqual(field.render('abc', readonly=True), 'abc')
         self.assertEqual(widget.rendered, 'readonly')
 
+    def test_render_many(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        widget = field.widget = DummyWidget()
+        result = field.render_many(['a', 'b'], readonly=True)
+        self.assertEqual(widget.rendered, None)
+        self.assertEqual(list(result), ['a', 'b'])
+        self.assertEqual(widget.rendered, 'readonly')
+
+    def test_render_many_shared_begins_new_state(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        field.widget = DummyErrorWidget()
+        field.share()
+        field.error = 'error'
+        result = field.render_many(['a', 'b'])
+        self.assertEqual(list(result), [('a', None), ('b', None)])
+
+    def test_render_many_fragment_cache(self):
+        schema = DummySchema()
+        field = self._makeOne(schema)
+        field.widget = DummyWidget()
+        cache = field.fragment_cache = DummyFragmentCache()
+        result = field.render_many(['a', 'b'], readonly=True)
+        self.assertEqual(list(result), [('a', True), ('b', True)])
+        self.assertEqual(cache.fields, [field, field])
+
+    def _makeBatchField(self):
+        schema = DummySchema()
+        child = DummySchema()
+        child.name = 'a'
+        schema.children = [child]
+        field = self._makeOne(schema)
+        field.widget = DummyItemsWidget()
+        field.children[0].widget = DummyCountingWidget()
+        return field
+
+    def test_render_many_shares_fragments(self):
+        field = self._makeBatchField()
+        widget = field.children[0].widget
+        appstructs = [{'a':'x'}, {'a':'y'}, {'a':'x'}]
+        result = field.render_many(appstructs, readonly=True)
+        self.assertEqual(list(result), ['x', 'y', 'x'])
+        self.assertEqual(widget.count, 2)
+        self.assertEqual(field.render({'a':'x'}, readonly=True), 'x')
+        self.assertEqual(widget.count, 3)
+
+    def test_render_many_distinct_values(self):
+        field = self._makeBatchField()
+        widget = field.children[0].widget
+        appstructs = [ {'a':str(i)} for i in range(10) ] + [{'a':'0'}]
+        result = field.render_many(appstructs)
+        self.assertEqual(len(list(result)), 11)
+        self.assertEqual(widget.count, 11)
+
+    def test_render_many_repeated_values(self):
+        field = self._makeBatchField()
+        widget = field.children[0].widget
+        appstructs = ([{'a':'0'}] + [ {'a':str(i)} for i in range(10) ]
+                      + [{'a':str(i)} for i in range(10, 20)] + [{'a':'19'}])
+        result = field.render_many(appstructs)
+        self.assertEqual(len(list(result)), 22)
+        self.assertEqual(widget.count, 20)
+
+    def test_render_many_error(self):
+        field = self._makeBatchField()
+        widget = field.children[0].widget
+        field.children[0].error = DummyInvalid('msg')
+        result = field.render_many([{'a':'x'}, {'a':'x'}], readonly=True)
+        self.assertEqual(list(result), ['x', 'x'])
+        self.assertEqual(widget.count, 2)
+
     def test_serialize(self):
         schema = DummySchema()
         field = self._makeOne(schema)
@@ -406,6 +826,298 @@ class TestField(unittest.TestCase):
         self.failUnless(r.startswith('<deform.field.Field object at '))
         self.failUnless(r.endswith("(schemanode 'name')>"))
 
+class TestBlueprint(unittest.TestCase):
+    def _makeOne(self, schema, factory=None, **kw):
+        from deform.field import Blueprint
+        if factory is None:
+            from deform.field import Field as factory
+        return Blueprint(factory, schema, **kw)
+
+    def _makeSchema(self):
+        schema = DummySchema()
+        child1 = DummySchema()
+        child1.name = 'child1'
+        child2 = DummySchema()
+        child2.name = 'child2'
+        grandchild = DummySchema()
+        grandchild.name = 'grandchild'
+        child1.children = [grandchild]
+        schema.children = [child1, child2]
+        return schema
+
+    def test_ctor(self):
+        from deform.widget import TextInputWidget
+        schema = self._makeSchema()
+        blueprint = self._makeOne(schema, renderer='abc')
+        self.assertEqual(blueprint.size, 4)
+        prototype = blueprint.prototype
+        self.assertEqual(prototype.schema, schema)
+        self.assertEqual(prototype.renderer, 'abc')
+        self.assertEqual(prototype._widget.__class__,
+                         TextInputWidget)
+        grandchild = prototype.children[0].children[0]
+        self.assertEqual(grandchild._widget.__class__,
+                         TextInputWidget)
+
+    def test_call(self):
+        schema = self._makeSchema()
+        blueprint = self._makeOne(schema, renderer='abc')
+        prototype = blueprint.prototype
+        field = blueprint()
+        self.failIf(field is prototype)
+        self.assertEqual(field.__class__, prototype.__class__)
+        self.assertEqual(field.schema, schema)
+        self.assertEqual(field.renderer, 'abc')
+        self.assertEqual(field.widget, prototype.widget)
+        self.assertEqual([x.oid for x in field.children],
+                         ['deformField1', 'deformField3'])
+        self.assertEqual(field['child1']['grandchild'].oid, 'deformField2')
+        self.failIf(field.children is prototype.children)
+        self.failIf(field.children[0] is prototype.children[0])
+        self.assertEqual(field.counter.next(), 4)
+        self.failUnless(field.children[0].children[0].counter is
+                        field.counter)
+
+    def test_call_same_layout_as_constructor(self):
+        from deform.field import Field
+        schema = self._makeSchema()
+        blueprint = self._makeOne(schema)
+        def layout(field):
+            L = [(field.name, field.order, field.oid)]
+            for child in field.children:
+                L.extend(layout(child))
+            return L
+        self.assertEqual(layout(blueprint()), layout(Field(schema)))
+
+    def test_call_instances_independent(self):
+        schema = self._makeSchema()
+        blueprint = self._makeOne(schema)
+        field1 = blueprint()
+        field2 = blueprint()
+        field1['child2'].error = 'error'
+        field1.children.append('foo')
+        self.assertEqual(field2['child2'].error, None)
+        self.assertEqual(len(field2.children), 2)
+        self.assertEqual(len(blueprint.prototype.children), 2)
+
+    def test_call_with_counter(self):
+        import itertools
+        schema = self._makeSchema()
+        blueprint = self._makeOne(schema)
+        counter = itertools.count(10)
+        field = blueprint(counter=counter)
+        self.assertEqual(field.order, 10)
+        self.assertEqual(field.oid, 'deformField10')
+        self.assertEqual(field['child1'].oid, 'deformField11')
+        self.assertEqual(field['child1']['grandchild'].oid, 'deformField12')
+        self.assertEqual(field['child2'].oid, 'deformField13')
+        self.assertEqual(field.counter, counter)
+        self.assertEqual(counter.next(), 14)
+
+    def test_call_with_kw(self):
+        schema = self._makeSchema()
+        blueprint = self._makeOne(schema)
+        field = blueprint(foo='foo')
+        self.assertEqual(field.foo, 'foo')
+        self.failIf(hasattr(field['child1'], 'foo'))
+        self.failIf(hasattr(blueprint.prototype, 'foo'))
+
+    def test_compile(self):
+        from deform.field import Blueprint
+        from deform.field import Field
+        schema = self._makeSchema()
+        blueprint = Field.compile(schema, renderer='abc')
+        self.assertEqual(blueprint.__class__, Blueprint)
+        self.assertEqual(blueprint.prototype.__class__, Field)
+        self.assertEqual(blueprint.prototype.renderer, 'abc')
+
+class TestFragmentCache(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from deform.field import FragmentCache
+        return FragmentCache(**kw)
+
+    def _makeField(self, cache, widget=None, children=(), **kw):
+        from deform.field import Field
+        schema = DummySchema()
+        schema.children = list(children)
+        field = Field(schema, renderer=DummyRenderer(), fragment_cache=cache,
+                      **kw)
+        field.widget = widget or DummyCountingWidget()
+        return field
+
+    def test_serialize(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        self.assertEqual(field.serialize('abc'), 'abc')
+        self.assertEqual(field.serialize('abc'), 'abc')
+        self.assertEqual(field.widget.count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.length, 3)
+
+    def test_serialize_new_field(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.serialize('abc')
+        other = self._makeField(cache)
+        other.schema = field.schema
+        other.renderer = field.renderer
+        self.assertEqual(other.serialize('abc'), 'abc')
+        self.assertEqual(other.widget.count, 0)
+
+    def test_serialize_cstruct(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.serialize({'a':['b'], 'c':set(['d'])})
+        field.serialize({'a':['b'], 'c':set(['d'])})
+        field.serialize({'a':['b'], 'c':set(['e'])})
+        self.assertEqual(field.widget.count, 2)
+
+    def test_serialize_readonly(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.serialize('abc')
+        self.assertEqual(field.serialize('abc', readonly=True), 'abc')
+        self.assertEqual(field.widget.count, 2)
+
+    def test_serialize_unhashable(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.serialize(DummyUnhashable())
+        field.serialize(DummyUnhashable())
+        self.assertEqual(field.widget.count, 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_serialize_error(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.error = DummyInvalid('msg')
+        field.serialize('abc')
+        field.serialize('abc')
+        self.assertEqual(field.widget.count, 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_serialize_scratch_child(self):
+        # the confirm value of a child is not part of the key
+        cache = self._makeOne()
+        child = DummySchema()
+        child.name = 'child'
+        field = self._makeField(cache, children=[child])
+        field.serialize('abc')
+        field.children[0].confirm = 'abc'
+        field.serialize('abc')
+        self.assertEqual(field.widget.count, 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_serialize_uncacheable(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.widget.cacheable = False
+        field.serialize('abc')
+        field.serialize('abc')
+        self.assertEqual(field.widget.count, 2)
+
+    def test_serialize_uncacheable_child(self):
+        cache = self._makeOne()
+        child = DummySchema()
+        child.name = 'child'
+        field = self._makeField(cache, children=[child])
+        field.children[0].widget = DummyCountingWidget(cacheable=False)
+        field.serialize('abc')
+        field.serialize('abc')
+        self.assertEqual(field.widget.count, 2)
+
+    def test_serialize_widget_attributes(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.serialize('abc')
+        other = self._makeField(cache, DummyCountingWidget(size=10))
+        other.schema = field.schema
+        other.renderer = field.renderer
+        other.serialize('abc')
+        self.assertEqual(other.widget.count, 1)
+
+    def test_serialize_field_attributes(self):
+        cache = self._makeOne()
+        field = self._makeField(cache, foo='foo')
+        field.serialize('abc')
+        other = self._makeField(cache, foo='bar')
+        other.schema = field.schema
+        other.renderer = field.renderer
+        other.serialize('abc')
+        self.assertEqual(other.widget.count, 1)
+
+    def test_serialize_sequence(self):
+        from deform.widget import SequenceWidget
+        class Widget(DummyCountingWidget, SequenceWidget):
+            pass
+        cache = self._makeOne()
+        field = self._makeField(cache, Widget())
+        field.serialize('abc', readonly=True)
+        field.serialize('abc', readonly=True)
+        self.assertEqual(field.widget.count, 2)
+        field = self._makeField(cache, Widget(), oid_prefix='form')
+        field.serialize('abc')
+        field.serialize('abc')
+        field.serialize('abc', readonly=True)
+        field.serialize('abc', readonly=True)
+        self.assertEqual(field.widget.count, 3)
+
+    def test_locale(self):
+        locale = ['en']
+        cache = self._makeOne(locale=lambda: locale[0])
+        field = self._makeField(cache)
+        field.serialize('abc')
+        locale[0] = 'fr'
+        field.serialize('abc')
+        field.serialize('abc')
+        self.assertEqual(field.widget.count, 2)
+
+    def test_generation(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.renderer.generation = 1
+        field.serialize('abc')
+        field.renderer.generation = 2
+        field.serialize('abc')
+        self.assertEqual(field.widget.count, 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.length, 3)
+
+    def test_size(self):
+        cache = self._makeOne(size=5)
+        field = self._makeField(cache)
+        field.serialize('ab')
+        field.serialize('cd')
+        field.serialize('ab')
+        field.serialize('ef')
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.length, 4)
+        field.serialize('ab')
+        self.assertEqual(field.widget.count, 3)
+        field.serialize('toolong')
+        self.assertEqual(len(cache), 2)
+
+    def test_stats(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.stats()['hit_rate'], 0.0)
+        field = self._makeField(cache)
+        for cstruct in ('a', 'a', 'a', 'b'):
+            field.serialize(cstruct)
+        self.assertEqual(cache.stats(), {'fragments':2, 'length':2,
+                                         'hits':2, 'misses':2,
+                                         'evictions':0, 'hit_rate':0.5})
+
+    def test_clear(self):
+        cache = self._makeOne()
+        field = self._makeField(cache)
+        field.serialize('abc')
+        field.serialize('abc')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['hits'], 0)
+        self.assertEqual(cache.length, 0)
+
 class DummyField(object):
     oid = 'oid'
     requirements = ( ('abc', '123'), ('def', '456'))
@@ -461,6 +1173,45 @@ class DummyWidget(object):
     def handle_error(self, field, e):
         self.error = e
 
+class DummyCountingWidget(object):
+    cacheable = True
+    count = 0
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+    def serialize(self, field, cstruct=None, readonly=False):
+        self.count += 1
+        if isinstance(cstruct, DummyUnhashable):
+            return str(cstruct)
+        return cstruct
+
+class DummyUnhashable(object):
+    __hash__ = None
+    def __str__(self):
+        return 'abc'
+
+class DummyItemsWidget(object):
+    def serialize(self, field, cstruct=None, readonly=False):
+        return ''.join([ child.serialize(cstruct[child.name],
+                                         readonly=readonly)
+                         for child in field.children ])
+
+class DummyRenderer(object):
+    pass
+
+class DummyErrorWidget(object):
+    def serialize(self, field, cstruct=None, readonly=True):
+        result = cstruct, field.error
+        field.error = 'error'
+        return result
+
+class DummyFragmentCache(object):
+    def __init__(self):
+        self.fields = []
+    def serialize(self, field, cstruct, readonly):
+        self.fields.append(field)
+        return cstruct, readonly
+
 class DummyInvalid(object):
     def __init__(self, msg=None):
         self.msg = msg
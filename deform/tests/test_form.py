@@ -49,6 +49,27 @@ class TestForm(unittest.TestCase):
         self.assertEqual(child.a, 'a')
         self.assertEqual(child.b, 'b')
 
+    def test_ctor_path_oids(self):
+        schema = DummySchema()
+        schema.children = [DummySchema()]
+        form = self._makeOne(schema, formid='formid', path_oids=True)
+        self.assertEqual(form.oid_prefix, 'formid')
+        self.assertEqual(form.oid, 'deformField_formid')
+        self.assertEqual(form.children[0].oid, 'deformField_formid__name')
+
+    def test_compile(self):
+        from deform.form import Form
+        schema = DummySchema()
+        schema.children = [DummySchema()]
+        blueprint = Form.compile(schema, buttons=('button',), formid='formid')
+        form = blueprint(action='action')
+        self.assertEqual(form.__class__, Form)
+        self.assertEqual(form.formid, 'formid')
+        self.assertEqual(form.action, 'action')
+        self.assertEqual(form.buttons[0].name, 'button')
+        self.assertEqual(form.widget, blueprint.prototype.widget)
+        self.failIf(form.children[0] is blueprint.prototype.children[0])
+
 class TestButton(unittest.TestCase):
     def _makeOne(self, **kw):
         from deform.form import Button
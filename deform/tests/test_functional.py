@@ -1,5 +1,6 @@
 import unittest
 import datetime
+import re
 import colander
 import deform.widget
 
@@ -64,6 +65,301 @@ class TestFunctional(unittest.TestCase):
         self.assertEqual(inputs[9]['name'], '__end__')
         self.assertEqual(inputs[9]['value'], 'series:mapping')
 
+    def test_render_path_oids(self):
+        from deform.form import Form
+        schema = self._makeSchema()
+        appstruct = {'name':'name', 'title':'title', 'cool':False,
+                     'series':{'name':'series',
+                               'dates':[datetime.date(2010, 3, 21),
+                                        datetime.date(2010, 3, 22)]}}
+        form = Form(schema, formid='myform', path_oids=True)
+        html = form.render(appstruct)
+        self.assertEqual(html, form.render(appstruct))
+        other = Form(schema, formid='myform', path_oids=True)
+        other.render() # bumps the counter
+        self.assertEqual(html, other.render(appstruct))
+        soup = self._soupify(html)
+        ids = [ tag['id'] for tag in soup.findAll('input', id=True) ]
+        self.failUnless('deformField_myform__name' in ids)
+        self.failUnless('deformField_myform__series__dates__0' in ids)
+        self.failUnless('deformField_myform__series__dates__1' in ids)
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_mapping_templates_without_inline(self):
+        # widgets which call the stock templates with the arguments of
+        # deform 0.9 get the items rendered by the item templates
+        from colander import null
+        from deform.form import Form
+        schema = self._makeSchema()
+        form = Form(schema, formid='myform', path_oids=True)
+        cstruct = schema.serialize({'name':'name', 'title':'title',
+                                    'series':{'name':'series', 'dates':[]}})
+        series = form['series']
+        renderer = form.renderer
+        for template, field, value in (
+            ('form', form, cstruct),
+            ('mapping', series, cstruct['series']),
+            ('readonly/form', form, cstruct),
+            ('readonly/mapping', series, cstruct['series'])):
+            self.assertEqual(
+                renderer(template, field=field, cstruct=value, null=null),
+                renderer(template, field=field, cstruct=value, null=null,
+                         inline=True))
+
+    def test_sequence_template_without_prototype_id(self):
+        # a widget which calls the stock template without a prototype
+        # id gets the quoted prototype in an attribute
+        from deform.form import Form
+        schema = self._makeSchema()
+        form = Form(schema, formid='myform', path_oids=True)
+        dates = form['series']['dates']
+        html = form.renderer('sequence', field=dates, cstruct=[],
+                             subfields=[], item_field=dates.children[0],
+                             add_subitem_text=u'Add')
+        self.failUnless('prototype="%s"' % dates.widget.prototype(dates)
+                        in html)
+        self.failIf('text/template' in html)
+
+    def test_sequence_template_without_min_len(self):
+        # a widget which calls the stock template without min_len gets
+        # the min_len of the widget
+        from deform.form import Form
+        schema = self._makeSchema()
+        form = Form(schema, formid='myform', path_oids=True)
+        dates = form['series']['dates']
+        dates.widget.min_len = 2
+        html = form.renderer('sequence', field=dates, cstruct=[],
+                             subfields=[], item_field=dates.children[0],
+                             add_subitem_text=u'Add')
+        self.failUnless('min_len="2"' in html)
+
+    def test_render_iter(self):
+        from deform.form import Form
+        schema = self._makeSchema()
+        form = Form(schema, formid='myform', path_oids=True)
+        appstruct = {'name':'name', 'title':'title', 'cool':False,
+                     'series':{'name':'series',
+                               'dates':[datetime.date(2010, 3, 21),
+                                        datetime.date(2010, 3, 22)]}}
+        for readonly in (False, True):
+            expected = form.render(appstruct, readonly=readonly)
+            chunks = list(form.render_iter(appstruct, readonly=readonly))
+            self.failUnless(len(chunks) > 10)
+            for chunk in chunks:
+                self.assertEqual(type(chunk), str)
+            self.assertEqual(''.join(chunks).decode('utf-8'), expected)
+        chunks = list(form.render_iter(encoding=None))
+        self.assertEqual(type(chunks[0]), unicode)
+        self.assertEqual(u''.join(chunks), form.render())
+
+    def test_render_iter_without_sequence(self):
+        from deform.form import Form
+        schema = colander.SchemaNode(colander.Mapping())
+        schema.add(colander.SchemaNode(colander.String(), name='name'))
+        schema.add(colander.SchemaNode(colander.String(), name='title'))
+        form = Form(schema, formid='myform')
+        chunks = list(form.render_iter({'name':'name'}, encoding=None))
+        self.assertEqual(chunks, [form.render({'name':'name'})])
+
+    def test_render_iter_validation_failure(self):
+        from deform.exception import ValidationFailure
+        from deform.form import Form
+        schema = self._makeSchema()
+        form = Form(schema, formid='myform', path_oids=True).share()
+        controls = [('name', 'name'), ('title', ''),
+                    ('__start__', 'series:mapping'),
+                    ('name', 'series'),
+                    ('__start__', 'dates:sequence'),
+                    ('date', 'bad'),
+                    ('__end__', 'dates:sequence'),
+                    ('__end__', 'series:mapping')]
+        try:
+            form.validate(controls)
+        except ValidationFailure, e:
+            chunks = e.render_iter()
+            form.render() # another request state in the same thread
+            html = ''.join(chunks).decode('utf-8')
+            self.assertEqual(html, e.render())
+            self.failUnless('errorMsgLbl' in html)
+            self.failUnless('value="bad"' in html)
+
+    def test_render_nested_sequence_prototypes(self):
+        from deform.field import Field
+        from deform.form import Form
+        class Cs(colander.SequenceSchema):
+            c = colander.SchemaNode(colander.String())
+        class B(colander.MappingSchema):
+            cs = Cs()
+        class Bs(colander.SequenceSchema):
+            b = B()
+        class A(colander.MappingSchema):
+            bs = Bs()
+        class As(colander.SequenceSchema):
+            a = A()
+        class Schema(colander.MappingSchema):
+            items = As()
+        schema = Schema()
+        b = {'cs':['x', 'y']}
+        appstruct = {'items':[{'bs':[b, b]}, {'bs':[b, b]}]}
+        html = Form(schema).render(appstruct)
+        # one prototype per item schema, referenced by all its sequences
+        self.assertEqual(html.count('type="text/template"'), 3)
+        # 7 sequences, 2 more in the prototypes of enclosing sequences
+        self.assertEqual(html.count('prototype-id='), 9)
+        self.failIf('prototype="' in html)
+        # without a form, prototypes are quoted into every sequence
+        # (and into the prototypes of enclosing sequences)
+        legacy = Field(schema).render(appstruct)
+        self.assertEqual(legacy.count('prototype="'), 7)
+        templates = re.findall('<script type="text/template".*?</script>',
+                               html, re.S)
+        quoted = re.findall('prototype="[^"]*"', legacy)
+        size = sum(map(len, templates))
+        legacy_size = sum(map(len, quoted))
+        self.failUnless(size * 4 < legacy_size)
+        self.failUnless(len(html) < len(legacy))
+
+    def test_render_prototype_cache(self):
+        from deform.form import Form
+        from deform.widget import PrototypeCache
+        from deform.widget import SequenceWidget
+        schema = self._makeSchema()
+        expected = Form(schema, path_oids=True).render()
+        cache = PrototypeCache()
+        SequenceWidget.prototype_cache = cache
+        try:
+            first = Form(schema, path_oids=True).render()
+            second = Form(schema, path_oids=True).render()
+        finally:
+            SequenceWidget.prototype_cache = None
+        self.assertEqual(first, expected)
+        self.assertEqual(second, expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_render_custom_renderer(self):
+        from deform.form import Form
+        from deform.template import default_renderer
+        schema = self._makeSchema()
+        expected = self._makeForm(schema).render()
+        names = []
+        def renderer(template, **kw):
+            names.append(template)
+            return default_renderer(template, **kw)
+        form = Form(schema, formid='myform', renderer=renderer)
+        self.assertEqual(form.render(), expected)
+        self.failUnless('form' in names)
+        self.failUnless('textinput' in names)
+        self.failUnless('checkbox' in names)
+
+    def test_render_inline_items(self):
+        from deform.exception import ValidationFailure
+        from deform.form import Form
+        from deform.template import default_renderer
+        def renderer(template, **kw):
+            # no ``handle``: items are rendered with their own template
+            return default_renderer(template, **kw)
+        schema = self._makeSchema()
+        inline = Form(schema, formid='myform', path_oids=True)
+        separate = Form(schema, formid='myform', path_oids=True,
+                        renderer=renderer)
+        appstruct = {'name':'name', 'title':'title', 'cool':False,
+                     'series':{'name':'series',
+                               'dates':[datetime.date(2010, 3, 21),
+                                        datetime.date(2010, 3, 22)]}}
+        for readonly in (False, True):
+            self.assertEqual(inline.render(appstruct, readonly=readonly),
+                             separate.render(appstruct, readonly=readonly))
+        controls = [('name', 'name'), ('title', ''),
+                    ('__start__', 'series:mapping'),
+                    ('name', 'series'),
+                    ('__start__', 'dates:sequence'),
+                    ('date', 'bad'),
+                    ('__end__', 'dates:sequence'),
+                    ('__end__', 'series:mapping')]
+        renderings = []
+        for form in (inline, separate):
+            try:
+                form.validate(controls)
+            except ValidationFailure, e:
+                renderings.append(e.render())
+        self.assertEqual(renderings[0], renderings[1])
+        self.failUnless('errorMsgLbl' in renderings[0])
+
+    def test_render_fragment_cache(self):
+        from deform.exception import ValidationFailure
+        from deform.field import FragmentCache
+        from deform.form import Form
+        cache = FragmentCache()
+        schema = self._makeSchema()
+        appstruct = {'name':'name', 'title':'title', 'cool':False,
+                     'series':{'name':'series',
+                               'dates':[datetime.date(2010, 3, 21)]}}
+        def render(readonly, **kw):
+            form = Form(schema, formid='myform', path_oids=True, **kw)
+            return form.render(appstruct, readonly=readonly)
+        for readonly in (False, True):
+            expected = render(readonly)
+            for i in range(2):
+                self.assertEqual(render(readonly, fragment_cache=cache),
+                                 expected)
+        self.failUnless(cache.hits)
+        self.assertEqual(render(False, buttons=('save',),
+                                fragment_cache=cache),
+                         render(False, buttons=('save',)))
+        form = Form(schema, formid='myform', path_oids=True,
+                    fragment_cache=cache)
+        try:
+            form.validate([('name', 'name'), ('title', '')])
+        except ValidationFailure, e:
+            self.failUnless('errorMsgLbl' in e.render())
+
+    def test_render_fragment_cache_checked_input(self):
+        # the confirm value of a valid checked input is re-displayed
+        # after another field failed validation
+        from deform.exception import ValidationFailure
+        from deform.field import FragmentCache
+        from deform.form import Form
+        from deform.widget import CheckedInputWidget
+        class Schema(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            email = colander.SchemaNode(colander.String(),
+                                        widget=CheckedInputWidget())
+        cache = FragmentCache()
+        def form():
+            return Form(Schema(), formid='myform', path_oids=True,
+                        fragment_cache=cache)
+        form().render({'name':'name', 'email':'a@example.com'})
+        controls = [('name', ''), ('__start__', 'email:mapping'),
+                    ('value', 'a@example.com'),
+                    ('confirm', 'a@example.com'),
+                    ('__end__', 'email:mapping')]
+        try:
+            form().validate(controls)
+        except ValidationFailure, e:
+            html = e.render()
+        self.assertEqual(html.count('value="a@example.com"'), 2)
+
+    def test_render_autocomplete_share_values(self):
+        from deform.form import Form
+        from deform.widget import AutocompleteInputWidget
+        values = ['value%d' % i for i in range(100)]
+        class Names(colander.SequenceSchema):
+            name = colander.SchemaNode(
+                colander.String(),
+                widget=AutocompleteInputWidget(values=values,
+                                               share_values=True))
+        class Schema(colander.MappingSchema):
+            names = Names()
+        schema = Schema()
+        appstruct = {'names':['a', 'b', 'c']}
+        html = Form(schema).render(appstruct)
+        # once for the page, once in the prototype
+        self.assertEqual(html.count('"value99"'), 2)
+        self.assertEqual(html.count('source: deform.autocompleteValues['), 3)
+        names = schema['names']['name']
+        names.widget.share_values = False
+        self.assertEqual(Form(schema).render(appstruct).count('"value99"'), 4)
+
     def test_render_not_empty(self):
         schema = self._makeSchema()
         form = self._makeForm(schema)
@@ -144,7 +440,51 @@ class TestFunctional(unittest.TestCase):
                 'title': null,
              }
             )
-        
+
+    def test_shared_form_threads(self):
+        import threading
+        from deform.exception import ValidationFailure
+        schema = self._makeSchema()
+        form = self._makeForm(schema).share()
+        errors = []
+        def run(num):
+            try:
+                name = 'name%d' % num
+                controls = [('name', name), ('title', ''),
+                            ('__start__', 'series:mapping'),
+                            ('name', name),
+                            ('__start__', 'dates:sequence'),
+                            ('date', 'bad%d' % num),
+                            ('__end__', 'dates:sequence'),
+                            ('__end__', 'series:mapping')]
+                for i in range(20):
+                    form.render()
+                    try:
+                        form.validate(controls)
+                    except ValidationFailure, e:
+                        html = e.render()
+                    else: # pragma: no cover
+                        raise AssertionError('validation succeeded')
+                    assert form['title'].error is not None
+                    dates = form['series']['dates'].sequence_fields
+                    assert len(dates) == 1
+                    assert dates[0].error is not None
+                    assert form['name'].error is None
+                    assert 'bad%d"' % num in html
+                    assert 'value="%s"' % name in html
+                    for other in (num - 1, num + 1):
+                        assert 'bad%d"' % other not in html
+            except Exception, e: # pragma: no cover
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(num,))
+                   for num in range(32)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(form.error, None)
+
 @colander.deferred
 def deferred_date_validator(node, kw):
     max_date = kw.get('max_date')
@@ -0,0 +1,371 @@
+import unittest
+
+class Test_text(unittest.TestCase):
+    def _callFUT(self, value, translate=None):
+        from deform.readonly import _text
+        if translate is None:
+            translate = lambda value: value
+        return _text(translate, value)
+
+    def test_escapes(self):
+        self.assertEqual(self._callFUT(u'<a> & "b"'),
+                         u'&lt;a&gt; &amp; "b"')
+
+    def test_leaves_entities(self):
+        self.assertEqual(self._callFUT('&amp; &#39; &'), '&amp; &#39; &amp;')
+
+    def test_int(self):
+        self.assertEqual(self._callFUT(1), '1')
+
+    def test_html(self):
+        class Markup(object):
+            def __html__(self):
+                return '<b>'
+        self.assertEqual(self._callFUT(Markup()), '<b>')
+
+    def test_translates(self):
+        result = self._callFUT(DummyMessage('a<'), lambda msg: msg.msgid)
+        self.assertEqual(result, 'a&lt;')
+
+    def test_translates_to_None(self):
+        result = self._callFUT(DummyMessage('a'), lambda msg: None)
+        self.assertEqual(result, '')
+
+    def test_decodes(self):
+        from deform.readonly import _Translate
+        result = self._callFUT('Caf\xc3\xa9 <', _Translate(None, 'utf-8'))
+        self.assertEqual(result, u'Caf\xe9 &lt;')
+
+class Test_attr(unittest.TestCase):
+    def _callFUT(self, name, value, translate=None):
+        from deform.readonly import _attr
+        if translate is None:
+            translate = lambda value: value
+        return _attr(translate, name, value)
+
+    def test_escapes(self):
+        self.assertEqual(self._callFUT('title', u'<a> & "b"'),
+                         u' title="&lt;a&gt; &amp; &quot;b&quot;"')
+
+    def test_None(self):
+        self.assertEqual(self._callFUT('title', None), '')
+
+    def test_False(self):
+        self.assertEqual(self._callFUT('title', False), '')
+
+    def test_int(self):
+        self.assertEqual(self._callFUT('id', 1), ' id="1"')
+
+    def test_translates(self):
+        result = self._callFUT('title', DummyMessage('a'),
+                               lambda msg: msg.msgid + '!')
+        self.assertEqual(result, ' title="a!"')
+
+    def test_decodes(self):
+        from deform.readonly import _Translate
+        result = self._callFUT('title', 'Caf\xc3\xa9 "',
+                               _Translate(None, 'utf-8'))
+        self.assertEqual(result, u' title="Caf\xe9 &quot;"')
+
+class Test_python_template(unittest.TestCase):
+    def _callFUT(self, func, translate, filename, encoding=None):
+        from deform.readonly import python_template
+        return python_template(func, translate, filename, encoding)
+
+    def test_it(self):
+        def func(translate, **kw):
+            return translate, kw
+        translate = lambda msg: msg + '!'
+        template = self._callFUT(func, translate, '/a.pt', 'utf-8')
+        self.assertEqual(template.filename, '/a.pt')
+        wrapper, kw = template(a=1)
+        self.assertEqual(kw, {'a':1})
+        self.assertEqual(wrapper('a'), 'a!')
+        self.assertEqual(wrapper.encoding, 'utf-8')
+
+class TestTemplates(unittest.TestCase):
+    def test_names(self):
+        import os
+        from deform.readonly import templates
+        from deform.template import default_dir
+        for name in templates:
+            path = os.path.join(default_dir, name + '.pt')
+            self.failUnless(os.path.exists(path), path)
+
+class TestFunctional(unittest.TestCase):
+    """ The Python functions must produce the markup the Chameleon
+    templates produce."""
+    def _makeSchema(self, **kw):
+        import datetime
+        import colander
+        import deform
+        from deform import widget
+        from deform.i18n import _
+        tmpstore = DummyTmpStore()
+        choices = (('habanero', 'Habanero'), ('jalapeno', 'Jalapeno'),
+                   ('chipotle', u'Chipotle <& "smoked">'))
+        class Dates(colander.SequenceSchema):
+            date = colander.SchemaNode(colander.Date(),
+                                       widget=widget.DateInputWidget())
+        class Person(colander.Schema):
+            name = colander.SchemaNode(colander.String(),
+                                       description='Name')
+            age = colander.SchemaNode(colander.Integer(),
+                                      widget=widget.HiddenWidget())
+        class People(colander.SequenceSchema):
+            person = Person()
+        class Names(colander.SequenceSchema):
+            name = colander.SchemaNode(colander.String())
+        class NamesList(colander.SequenceSchema):
+            names = Names()
+        class Files(colander.SequenceSchema):
+            file = colander.SchemaNode(
+                deform.FileData(), widget=widget.FileUploadWidget(tmpstore))
+        class Row(colander.TupleSchema):
+            a = colander.SchemaNode(colander.Integer())
+            b = colander.SchemaNode(colander.String())
+        class Schema(colander.Schema):
+            text = colander.SchemaNode(
+                colander.String(), description='Enter <some> "text"',
+                widget=widget.TextInputWidget(size=60))
+            auto = colander.SchemaNode(
+                colander.String(),
+                widget=widget.AutocompleteInputWidget(values=['bar', 'baz']))
+            area = colander.SchemaNode(
+                colander.String(), title=_('Area'),
+                widget=widget.TextAreaWidget(rows=10, cols=60))
+            password = colander.SchemaNode(colander.String(),
+                                           widget=widget.PasswordWidget())
+            checkbox = colander.SchemaNode(colander.Boolean(),
+                                           widget=widget.CheckboxWidget())
+            unchecked = colander.SchemaNode(colander.Boolean())
+            radio = colander.SchemaNode(
+                colander.String(),
+                widget=widget.RadioChoiceWidget(values=choices))
+            select = colander.SchemaNode(
+                colander.String(),
+                widget=widget.SelectWidget(values=choices))
+            pepper = colander.SchemaNode(
+                deform.Set(),
+                widget=widget.CheckboxChoiceWidget(values=choices))
+            email = colander.SchemaNode(
+                colander.String(),
+                widget=widget.CheckedInputWidget(subject='Email',
+                                                 confirm_subject='Confirm'))
+            checked_password = colander.SchemaNode(
+                colander.String(), widget=widget.CheckedPasswordWidget())
+            dateparts = colander.SchemaNode(colander.Date(),
+                                            widget=widget.DatePartsWidget())
+            hidden = colander.SchemaNode(colander.String(),
+                                         widget=widget.HiddenWidget())
+            csv = Row(widget=widget.TextInputCSVWidget())
+            upload = colander.SchemaNode(
+                deform.FileData(), widget=widget.FileUploadWidget(tmpstore))
+            files = Files()
+            dates = Dates()
+            people = People(title='', description='Some people')
+            names = NamesList()
+            number = colander.SchemaNode(colander.Float(),
+                                         title=u'Nomb\xe9r')
+        appstruct = {
+            'text': u'<b>"caf\xe9"</b> &amp; & co',
+            'auto': 'baz',
+            'area': 'line\nline',
+            'password': 'secret',
+            'checkbox': True,
+            'unchecked': False,
+            'radio': 'jalapeno',
+            'select': 'chipotle',
+            'pepper': set(['habanero', 'chipotle']),
+            'email': 'a@example.com',
+            'checked_password': 'pw',
+            'dateparts': datetime.date(2010, 4, 9),
+            'hidden': 'h<',
+            'csv': (1, 'x,y'),
+            'upload': {'uid':'abc', 'filename':'f&1.txt',
+                       'mimetype':'text/plain', 'size':10,
+                       'preview_url':None},
+            'files': [{'uid':'def', 'filename':'g.txt',
+                       'mimetype':'text/plain', 'size':1,
+                       'preview_url':None}],
+            'dates': [datetime.date(2010, 1, 1), datetime.date(2011, 2, 2)],
+            'people': [{'name':'Joe', 'age':3}, {'name':'Ann', 'age':4}],
+            'names': [['a', 'b'], [], ['c']],
+            'number': 1.5,
+            }
+        return Schema(**kw), appstruct
+
+    def _makeRenderer(self, search_path=(), **kw):
+        from deform.template import ZPTRendererFactory
+        from deform.template import default_dir
+        return ZPTRendererFactory(tuple(search_path) + (default_dir,), **kw)
+
+    def _render(self, renderer, schema, appstruct):
+        from deform.form import Form
+        form = Form(schema, renderer=renderer, path_oids=True)
+        return form.render(appstruct, readonly=True)
+
+    def _assertSame(self, appstruct, translator=None, **kw):
+        slow = self._makeRenderer(translator=translator)
+        fast = self._makeRenderer(translator=translator, fast_readonly=True)
+        schema, default = self._makeSchema(**kw)
+        if appstruct is None:
+            appstruct = default
+        expected = self._render(slow, schema, appstruct)
+        result = self._render(fast, schema, appstruct)
+        self.assertEqual(result, expected)
+        return result
+
+    def test_full(self):
+        self._assertSame(None)
+
+    def test_full_with_title(self):
+        self._assertSame(None, title='My <form>', description='A "form"')
+
+    def test_empty(self):
+        import colander
+        self._assertSame(colander.null)
+
+    def test_empty_with_title(self):
+        import colander
+        self._assertSame(colander.null, title='My form', description='Desc')
+
+    def test_translator(self):
+        def translator(msg):
+            return u'[%s]' % msg.interpolate()
+        result = self._assertSame(None, translator=translator)
+        self.failUnless('[Area]' in result)
+
+    def test_byte_strings(self):
+        # Chameleon decodes byte strings with the encoding of the loader
+        import colander
+        from deform.form import Form
+        from deform import widget
+        choices = (('fr', 'Fran\xc3\xa7ais'), ('en', 'English'))
+        class Schema(colander.Schema):
+            name = colander.SchemaNode(colander.String(),
+                                       title='Nom du caf\xc3\xa9',
+                                       description='D\xc3\xa9crit')
+            lang = colander.SchemaNode(
+                colander.String(), widget=widget.SelectWidget(values=choices))
+            langs = colander.SchemaNode(
+                colander.String(),
+                widget=widget.RadioChoiceWidget(values=choices))
+        cstruct = {'name':'Caf\xc3\xa9 <&>', 'lang':'fr', 'langs':'en'}
+        results = []
+        for fast_readonly in (False, True):
+            renderer = self._makeRenderer(fast_readonly=fast_readonly)
+            form = Form(Schema(title='R\xc3\xa9sum\xc3\xa9'),
+                        renderer=renderer)
+            results.append(form.serialize(cstruct, readonly=True))
+        self.assertEqual(results[1], results[0])
+        self.failUnless(u'Caf\xe9 &lt;&amp;&gt;' in results[1])
+        self.failUnless(u'Fran\xe7ais' in results[1])
+
+    def _demoForms(self, renderer):
+        # the forms (and appstructs) of the demos of deformdemo, created
+        # with ``renderer`` as the default renderer
+        import inspect
+        import colander
+        from deform.form import Form
+        saved = Form.__dict__.get('default_renderer')
+        def restore():
+            # importing deformdemo sets the default renderer of Form
+            if saved is not None:
+                Form.default_renderer = saved
+            elif 'default_renderer' in Form.__dict__:
+                del Form.default_renderer
+        try:
+            try:
+                from pyramid import testing
+                from deformdemo import app
+            except ImportError: # PRAGMA: no cover
+                # pyramid or pygments, which deformdemo requires, is
+                # missing
+                return None
+        finally:
+            restore()
+        forms = []
+        class Demo(app.DeformDemo):
+            def __init__(self, request):
+                self.request = request
+            def render_form(self, form, appstruct=colander.null, **kw):
+                forms.append((form, appstruct))
+        def is_demo(value):
+            return getattr(value, 'demo', None) is not None
+        Form.set_default_renderer(renderer)
+        testing.setUp()
+        try:
+            demo = Demo(testing.DummyRequest())
+            for name, method in inspect.getmembers(demo, is_demo):
+                method()
+        finally:
+            testing.tearDown()
+            restore()
+        return forms
+
+    def test_deformdemo(self):
+        from deform.template import TemplateError
+        slow = self._demoForms(self._makeRenderer())
+        if slow is None: # PRAGMA: no cover
+            return
+        fast = self._demoForms(self._makeRenderer(fast_readonly=True))
+        self.failUnless(len(slow) > 40)
+        self.assertEqual(len(fast), len(slow))
+        for (expected, appstruct), (form, _) in zip(slow, fast):
+            try:
+                html = expected.render(appstruct, readonly=True)
+            except TemplateError:
+                # a widget of the demo has no read-only template
+                self.assertRaises(TemplateError, form.render, appstruct,
+                                  readonly=True)
+            else:
+                self.assertEqual(form.render(appstruct, readonly=True), html)
+
+    def test_overridden_item_template(self):
+        # the fast mapping and sequence templates render overridden item
+        # templates through the renderer instead of inline
+        import os
+        import shutil
+        import tempfile
+        from deform.template import default_dir
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, 'readonly'))
+            for name in ('mapping_item.pt', 'sequence_item.pt'):
+                shutil.copy(os.path.join(default_dir, 'readonly', name),
+                            os.path.join(tmpdir, 'readonly', name))
+            slow = self._makeRenderer((tmpdir,))
+            fast = self._makeRenderer((tmpdir,), fast_readonly=True)
+            self.failIf(hasattr(fast.handle('readonly/mapping_item'),
+                                'func'))
+            schema, appstruct = self._makeSchema()
+            self.assertEqual(self._render(fast, schema, appstruct),
+                             self._render(slow, schema, appstruct))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_overridden_template(self):
+        import os
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, 'readonly'))
+            f = open(os.path.join(tmpdir, 'readonly', 'textinput.pt'), 'w')
+            f.write('<p>overridden ${cstruct}</p>')
+            f.close()
+            renderer = self._makeRenderer((tmpdir,), fast_readonly=True)
+            schema, appstruct = self._makeSchema()
+            result = self._render(renderer, schema, appstruct)
+            self.failUnless('<p>overridden baz</p>' in result)
+        finally:
+            shutil.rmtree(tmpdir)
+
+class DummyMessage(object):
+    def __init__(self, msgid):
+        self.msgid = msgid
+
+class DummyTmpStore(dict):
+    def preview_url(self, uid):
+        return None
@@ -47,6 +47,20 @@ class TestSet(unittest.TestCase):
         result = typ.deserialize(node, ('a',))
         self.assertEqual(result, set(('a',)))
 
+    def test_deserialize_set(self):
+        node = DummySchemaNode()
+        typ = self._makeOne()
+        value = set(('a',))
+        result = typ.deserialize(node, value)
+        self.failUnless(result is value)
+
+    def test_deserialize_frozenset(self):
+        node = DummySchemaNode()
+        typ = self._makeOne()
+        result = typ.deserialize(node, frozenset(('a',)))
+        self.assertEqual(result, set(('a',)))
+        self.assertEqual(result.__class__, set)
+
     def test_deserialize_empty_allow_empty_false(self):
         node = DummySchemaNode()
         typ = self._makeOne()
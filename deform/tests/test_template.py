@@ -1,3 +1,4 @@
+import os
 import unittest
 
 class TestZPTTemplateLoader(unittest.TestCase):
@@ -45,28 +46,348 @@ class TestZPTTemplateLoader(unittest.TestCase):
         import os
         from deform.template import TemplateError
         fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
-        loader = self._makeOne(search_path=[fixtures])
-        self.assertRaises(TemplateError, loader.load, 'doesnt')
-        self.failUnless(
-            os.path.join(fixtures, 'doesnt') in loader.notexists)
+        loader = self._makeOne(search_path=[fixtures, 'other'])
+        try:
+            loader.load('doesnt')
+        except TemplateError, e:
+            self.assertEqual(str(e), 'Can not find template doesnt in %s, '
+                             'other' % fixtures)
+        else: # pragma: no cover
+            raise AssertionError('TemplateError not raised')
+
+    def test_load_notexists_empty_search_path(self):
+        from deform.template import TemplateError
+        loader = self._makeOne()
+        self.assertRaises(TemplateError, loader.load, 'test.pt')
 
-    def test_load_negative_cache(self):
+    def test_load_abspath(self):
         import os
         fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
-        path = os.path.join(fixtures, 'test.pt')
-        loader = self._makeOne(search_path=[fixtures], auto_reload=True)
-        loader.notexists[path] = True
-        result = loader.load('test.pt')
-        self.failUnless(result)
+        loader = self._makeOne()
+        result = loader.load(os.path.join(fixtures, 'test.pt'))
+        self.assertEqual(result.filename, os.path.join(fixtures, 'test.pt'))
+
+    def test_index(self):
+        import os
+        from deform.template import default_dir
+        fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+        loader = self._makeOne(search_path=[fixtures, default_dir])
+        index = loader.index()
+        self.assertEqual(index['test.pt'], os.path.join(fixtures, 'test.pt'))
+        self.assertEqual(index['readonly/form.pt'],
+                         os.path.join(default_dir, 'readonly', 'form.pt'))
+        self.failUnless(loader.index() is index)
+
+    def test_index_override(self):
+        import shutil
+        import tempfile
+        from deform.template import default_dir
+        tmpdir = tempfile.mkdtemp()
+        try:
+            open(os.path.join(tmpdir, 'form.pt'), 'w').close()
+            loader = self._makeOne(search_path=[tmpdir, default_dir])
+            self.assertEqual(loader.index()['form.pt'],
+                             os.path.join(tmpdir, 'form.pt'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _load_symlinked(self, auto_reload):
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, 'real'))
+            os.mkdir(os.path.join(tmpdir, 'search'))
+            os.symlink(os.path.join('..', 'real'),
+                       os.path.join(tmpdir, 'search', 'sub'))
+            f = open(os.path.join(tmpdir, 'real', 't.pt'), 'w')
+            f.write('<div/>')
+            f.close()
+            search_path = [os.path.join(tmpdir, 'search')]
+            loader = self._makeOne(search_path=search_path,
+                                   auto_reload=auto_reload)
+            return loader.load('sub/t.pt')()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_load_symlinked_directory(self):
+        self.assertEqual(self._load_symlinked(True), '<div />')
+        self.assertEqual(self._load_symlinked(False), '<div />')
+
+    def test_index_symlink_cycle(self):
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.symlink(os.curdir, os.path.join(tmpdir, 'loop'))
+            open(os.path.join(tmpdir, 't.pt'), 'w').close()
+            loader = self._makeOne(search_path=[tmpdir])
+            self.assertEqual(sorted(loader.index()), ['t.pt'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _add_template(self, auto_reload):
+        import shutil
+        import tempfile
+        from deform.template import TemplateError
+        tmpdir = tempfile.mkdtemp()
+        try:
+            loader = self._makeOne(search_path=[tmpdir],
+                                   auto_reload=auto_reload)
+            self.assertRaises(TemplateError, loader.load, 'new.pt')
+            f = open(os.path.join(tmpdir, 'new.pt'), 'w')
+            f.write('<div/>')
+            f.close()
+            os.utime(tmpdir, (1, 1))
+            return loader.load('new.pt')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_index_auto_reload(self):
+        result = self._add_template(True)
+        self.failUnless(result.filename.endswith('new.pt'))
+
+    def test_index_no_auto_reload(self):
+        from deform.template import TemplateError
+        self.assertRaises(TemplateError, self._add_template, False)
+
+    def test_load_removed(self):
+        import shutil
+        import tempfile
+        from deform.template import TemplateError
+        tmpdir = tempfile.mkdtemp()
+        try:
+            open(os.path.join(tmpdir, 'gone.pt'), 'w').close()
+            loader = self._makeOne(search_path=[tmpdir], auto_reload=False)
+            loader.index()
+            os.remove(os.path.join(tmpdir, 'gone.pt'))
+            self.assertRaises(TemplateError, loader.load, 'gone.pt')
+            self.failIf('gone.pt' in loader.index())
+        finally:
+            shutil.rmtree(tmpdir)
 
-    def test_load_negative_cache2(self):
+    def test_load_maxsize(self):
         import os
         from deform.template import TemplateError
+        from deform.template import default_dir
         fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
-        path = os.path.join(fixtures, 'test.pt')
-        loader = self._makeOne(search_path=[fixtures], auto_reload=False)
-        loader.notexists[path] = True
-        self.assertRaises(TemplateError, loader.load, 'test.pt')
+        loader = self._makeOne(search_path=[fixtures, default_dir],
+                               maxsize=1)
+        template = loader.load('test.pt')
+        self.failUnless(loader.load('test.pt') is template)
+        self.assertRaises(TemplateError, loader.load, 'doesnt')
+        self.assertRaises(TemplateError, loader.load, 'doesnt2')
+        loader.load('form.pt')
+        self.failIf(loader.load('test.pt') is template)
+        stats = loader.stats()
+        self.assertEqual(stats['templates'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 5)
+        self.assertEqual(stats['evictions'], 2)
+
+    def test_compile_time(self):
+        import os
+        fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+        loader = self._makeOne(search_path=[fixtures])
+        self.assertEqual(loader.stats()['compile_time'], 0)
+        loader.load('test.pt')()
+        self.failUnless(loader.stats()['compile_time'] > 0)
+
+class Test_OrderedDict(unittest.TestCase):
+    def _makeOne(self):
+        from deform.template import _OrderedDict
+        return _OrderedDict()
+
+    def test_order(self):
+        d = self._makeOne()
+        d['a'] = 1
+        d['b'] = 2
+        d['c'] = 3
+        d['a'] = 4
+        self.assertEqual(d.items(), [('a', 4), ('b', 2), ('c', 3)])
+        self.assertEqual(d.pop('b'), 2)
+        d['b'] = 5
+        self.assertEqual(d.items(), [('a', 4), ('c', 3), ('b', 5)])
+        self.assertEqual(len(d), 3)
+        self.failUnless('c' in d)
+        self.failIf('d' in d)
+
+    def test_pop_missing(self):
+        d = self._makeOne()
+        self.assertEqual(d.pop('a', None), None)
+        self.assertRaises(KeyError, d.pop, 'a')
+
+    def test_popitem(self):
+        d = self._makeOne()
+        d['a'] = 1
+        d['b'] = 2
+        d['c'] = 3
+        self.assertEqual(d.popitem(last=False), ('a', 1))
+        self.assertEqual(d.popitem(), ('c', 3))
+        self.assertEqual(d.items(), [('b', 2)])
+        d.popitem()
+        self.assertRaises(KeyError, d.popitem)
+
+    def test_clear(self):
+        d = self._makeOne()
+        d['a'] = 1
+        d.clear()
+        self.assertEqual(len(d), 0)
+        self.assertEqual(d.items(), [])
+        d['b'] = 2
+        self.assertEqual(d.items(), [('b', 2)])
+
+class TestLoaderRegistry(unittest.TestCase):
+    def _makeOne(self, maxsize=None):
+        from deform.template import LoaderRegistry
+        return LoaderRegistry(maxsize)
+
+    def test_load(self):
+        registry = self._makeOne()
+        self.assertEqual(registry.load('a', lambda x: x * 2, 1), 2)
+        self.assertEqual(registry.load('a', lambda x: x * 3, 1), 2)
+        self.assertEqual(registry.hits, 1)
+        self.assertEqual(registry.misses, 1)
+        self.failUnless('a' in registry)
+        self.assertEqual(registry.items(), [('a', 2)])
+
+    def test_load_raises(self):
+        registry = self._makeOne()
+        def func():
+            raise ValueError
+        self.assertRaises(ValueError, registry.load, 'a', func)
+        self.failIf('a' in registry)
+        self.assertEqual(registry.misses, 1)
+        self.assertEqual(registry._loading, {})
+
+    def test_maxsize(self):
+        registry = self._makeOne(2)
+        registry['a'] = 1
+        registry['b'] = 2
+        registry.get('a')
+        registry['c'] = 3
+        self.assertEqual(sorted(registry.items()), [('a', 1), ('c', 3)])
+        self.assertEqual(registry.evictions, 1)
+        registry.clear()
+        self.assertEqual(len(registry), 0)
+        self.assertEqual(registry.evictions, 0)
+
+    def test_load_concurrent(self):
+        import threading
+        import time
+        registry = self._makeOne()
+        calls = []
+        def func():
+            calls.append(1)
+            time.sleep(0.01)
+            return object()
+        results = []
+        def run():
+            results.append(registry.load('a', func))
+        threads = [ threading.Thread(target=run) for i in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+        self.assertEqual(registry.misses, 1)
+        self.assertEqual(registry.hits, 7)
+
+class TestCompiledTemplateCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _makeOne(self, template):
+        from deform.template import CompiledTemplateCache
+        return CompiledTemplateCache(self.tmpdir, template)
+
+    def test_add_and_reuse(self):
+        template = DummyTemplate('<div/>')
+        cache = self._makeOne(template)
+        self.failIf('key' in cache)
+        cache.add('key', 'def bind():\n    return __filename__\n', 'file')
+        self.failUnless('key' in cache)
+        self.assertEqual(cache['key'], 'file')
+        self.assertEqual(os.listdir(self.tmpdir),
+                         [os.path.basename(cache.filename('key'))])
+        other = self._makeOne(template)
+        self.failUnless('key' in other)
+        self.assertEqual(other['key'], 'template.pt')
+        self.failIf('other' in other)
+
+    def test_filename_depends_on_source(self):
+        cache = self._makeOne(DummyTemplate('<div/>'))
+        other = self._makeOne(DummyTemplate('<span/>'))
+        self.assertNotEqual(cache.filename('key'), other.filename('key'))
+        self.assertNotEqual(cache.filename('key'), cache.filename('other'))
+
+    def test_invalid_file(self):
+        cache = self._makeOne(DummyTemplate('<div/>'))
+        f = open(cache.filename('key'), 'wb')
+        f.write('garbage')
+        f.close()
+        self.failIf('key' in cache)
+
+    def test_unwritable(self):
+        cache = self._makeOne(DummyTemplate('<div/>'))
+        cache.path = os.path.join(self.tmpdir, 'doesnt', 'exist')
+        cache.add('key', 'def bind():\n    return 1\n', 'file')
+        self.assertEqual(cache['key'], 1)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_rename_fails(self):
+        cache = self._makeOne(DummyTemplate('<div/>'))
+        target = cache.filename('key')
+        os.mkdir(target)
+        cache.add('key', 'def bind():\n    return 1\n', 'file')
+        self.assertEqual(cache['key'], 1)
+        self.assertEqual(os.listdir(self.tmpdir), [os.path.basename(target)])
+
+class TestZPTTemplateFile(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _makeOne(self, body, **kw):
+        from deform.template import ZPTTemplateFile
+        from deform.template import ZPTTemplateLoader
+        filename = os.path.join(self.tmpdir, 'test.pt')
+        f = open(filename, 'w')
+        f.write(body)
+        f.close()
+        return ZPTTemplateFile(filename, ZPTTemplateLoader.parser, **kw)
+
+    def test_include(self):
+        from deform.template import default_dir
+        template = self._makeOne(
+            '<div><?deform-include readonly/password?></div>')
+        included = os.path.join(default_dir, 'readonly', 'password.pt')
+        self.assertEqual(template.includes, [included])
+        self.assertEqual(template(),
+                         '<div><div>\n  <em> Password not displayed. </em>\n'
+                         '</div></div>')
+
+    def test_include_mtime(self):
+        template = self._makeOne(
+            '<div><?deform-include readonly/password?></div>')
+        os.utime(template.filename, (1, 1))
+        self.assertEqual(template.mtime(), os.path.getmtime(
+            template.includes[0]))
+
+    def test_no_include(self):
+        template = self._makeOne('<div/>')
+        self.assertEqual(template.includes, ())
+        self.assertEqual(template(), '<div />')
 
 class TestZPTRendererFactory(unittest.TestCase):
     def _makeOne(self, dirs, **kw):
@@ -80,6 +401,208 @@ class TestZPTRendererFactory(unittest.TestCase):
         result = renderer('test')
         self.assertEqual(result, u'<div>Test</div>')
 
+    def test_production(self):
+        from pkg_resources import resource_filename
+        default_dir = resource_filename('deform', 'tests/fixtures/')
+        renderer = self._makeOne((default_dir,), auto_reload=True,
+                                 debug=True, production=True)
+        self.assertEqual(renderer.production, True)
+        self.assertEqual(renderer.loader.auto_reload, False)
+        self.assertEqual(renderer.loader.debug, False)
+        self.assertEqual(renderer.loaded_templates(),
+                         [('test', os.path.join(default_dir, 'test.pt'))])
+        template = renderer.loader.load('test.pt')
+        self.assertEqual(template.auto_reload, False)
+        self.assertEqual(renderer('test'), u'<div>Test</div>')
+
+    def test_production_subdirectories(self):
+        from pkg_resources import resource_filename
+        default_dir = resource_filename('deform', 'templates/')
+        renderer = self._makeOne((default_dir,), production=True)
+        names = [ name for name, filename in renderer.loaded_templates() ]
+        self.failUnless('form' in names)
+        self.failUnless('readonly/form' in names)
+
+    def test_preload(self):
+        from pkg_resources import resource_filename
+        fixtures = resource_filename('deform', 'tests/fixtures/')
+        default_dir = resource_filename('deform', 'templates/')
+        renderer = self._makeOne((fixtures, default_dir))
+        result = renderer.preload()
+        names = [ name for name, filename, seconds in result ]
+        self.assertEqual(names, sorted(names))
+        self.failUnless('test' in names)
+        self.failUnless('form' in names)
+        self.failUnless('readonly/form' in names)
+        for name, filename, seconds in result:
+            self.failUnless(seconds >= 0)
+            template = renderer.loader.load(name + '.pt')
+            self.assertEqual(template.filename, filename)
+            key = None, True, template.signature
+            self.failUnless(key in template.registry)
+        self.assertEqual(len(renderer.loaded_templates()), len(result))
+
+    def test_preload_override(self):
+        import shutil
+        import tempfile
+        from pkg_resources import resource_filename
+        fixtures = resource_filename('deform', 'tests/fixtures/')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'test.pt')
+            f = open(path, 'w')
+            f.write('<div>Override</div>')
+            f.close()
+            renderer = self._makeOne((tmpdir, fixtures))
+            result = renderer.preload()
+            self.assertEqual([ r[:2] for r in result ], [('test', path)])
+            self.assertEqual(renderer('test'), u'<div>Override</div>')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_handle(self):
+        from pkg_resources import resource_filename
+        fixtures = resource_filename('deform', 'tests/fixtures/')
+        renderer = self._makeOne((fixtures,))
+        handle = renderer.handle('test')
+        self.assertEqual(handle(), u'<div>Test</div>')
+        self.failUnless(renderer.handle('test') is handle)
+        self.assertEqual(renderer.stats()['misses'], 1)
+        self.assertEqual(renderer.stats()['hits'], 0)
+
+    def test_handle_maxsize(self):
+        from pkg_resources import resource_filename
+        fixtures = resource_filename('deform', 'tests/fixtures/')
+        renderer = self._makeOne((fixtures,), maxsize=1)
+        handle = renderer.handle('test')
+        self.failUnless(renderer.handle('test') is handle)
+        self.assertEqual(renderer.stats()['hits'], 1)
+        self.assertEqual(renderer._handles, {})
+
+    def test_handle_fast_readonly(self):
+        from deform.template import default_dir
+        from deform import readonly
+        renderer = self._makeOne((default_dir,), fast_readonly=True)
+        handle = renderer.handle('readonly/textinput')
+        self.failUnless(handle.func is readonly.textinput)
+        self.assertEqual(handle.filename,
+                         os.path.join(default_dir, 'readonly/textinput.pt'))
+        self.failIf(hasattr(renderer.handle('textinput'), 'func'))
+
+    def test_handle_fast_readonly_off(self):
+        from deform.template import default_dir
+        renderer = self._makeOne((default_dir,))
+        self.failIf(hasattr(renderer.handle('readonly/textinput'), 'func'))
+
+    def test_handle_fast_readonly_overridden(self):
+        import shutil
+        import tempfile
+        from deform.template import default_dir
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, 'readonly'))
+            path = os.path.join(tmpdir, 'readonly', 'textinput.pt')
+            f = open(path, 'w')
+            f.write('<p>Override</p>')
+            f.close()
+            renderer = self._makeOne((tmpdir, default_dir),
+                                     fast_readonly=True)
+            handle = renderer.handle('readonly/textinput')
+            self.assertEqual(handle.filename, path)
+            self.assertEqual(handle(), u'<p>Override</p>')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_stats(self):
+        from pkg_resources import resource_filename
+        fixtures = resource_filename('deform', 'tests/fixtures/')
+        renderer = self._makeOne((fixtures,), maxsize=10)
+        renderer('test')
+        renderer('test')
+        stats = renderer.stats()
+        self.assertEqual(stats['templates'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 0)
+        self.failUnless(stats['compile_time'] > 0)
+
+    def test_cache_dir(self):
+        import shutil
+        import tempfile
+        from pkg_resources import resource_filename
+        fixtures = resource_filename('deform', 'tests/fixtures/')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache_dir = os.path.join(tmpdir, 'cache')
+            renderer = self._makeOne((fixtures,), cache_dir=cache_dir)
+            self.assertEqual(renderer('test'), u'<div>Test</div>')
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            renderer = self._makeOne((fixtures,), cache_dir=cache_dir)
+            template = renderer.loader.load('test.pt')
+            def compiler(*arg): # pragma: no cover
+                raise AssertionError('compiled again')
+            template.compiler = compiler
+            self.assertEqual(renderer('test'), u'<div>Test</div>')
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_production_environ(self):
+        from deform.template import PRODUCTION_KEY
+        old = os.environ.get(PRODUCTION_KEY)
+        try:
+            os.environ[PRODUCTION_KEY] = 'true'
+            renderer = self._makeOne(())
+            self.assertEqual(renderer.production, True)
+            self.assertEqual(renderer.loader.auto_reload, False)
+            os.environ[PRODUCTION_KEY] = 'false'
+            renderer = self._makeOne(())
+            self.assertEqual(renderer.production, False)
+            self.assertEqual(renderer.loader.auto_reload, True)
+            renderer = self._makeOne((), production=True)
+            self.assertEqual(renderer.production, True)
+        finally:
+            if old is None:
+                del os.environ[PRODUCTION_KEY]
+            else: # pragma: no cover
+                os.environ[PRODUCTION_KEY] = old
+
+    def test_loaded_templates(self):
+        from pkg_resources import resource_filename
+        default_dir = resource_filename('deform', 'tests/fixtures/')
+        renderer = self._makeOne((default_dir,))
+        self.assertEqual(renderer.loaded_templates(), [])
+        renderer('test')
+        self.assertEqual(renderer.loaded_templates(),
+                         [('test', os.path.join(default_dir, 'test.pt'))])
+
+    def test_generation(self):
+        import os
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'test.pt')
+            f = open(path, 'w')
+            f.write('<div>One</div>')
+            f.close()
+            renderer = self._makeOne((tmpdir,), auto_reload=True)
+            self.assertEqual(renderer.generation, 0)
+            self.assertEqual(renderer('test'), u'<div>One</div>')
+            generation = renderer.generation
+            self.failUnless(generation > 0)
+            renderer('test')
+            self.assertEqual(renderer.generation, generation)
+            f = open(path, 'w')
+            f.write('<div>Two</div>')
+            f.close()
+            mtime = os.path.getmtime(path) + 10
+            os.utime(path, (mtime, mtime))
+            self.assertEqual(renderer('test'), u'<div>Two</div>')
+            self.failUnless(renderer.generation > generation)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_it(self):
         renderer = self._makeOne(
             ('dir',),
@@ -117,3 +640,8 @@ class DummyField(object):
     name = 'name'
     oid = 'oid'
     
+
+class DummyTemplate(object):
+    filename = 'template.pt'
+    def __init__(self, body):
+        self.body = body
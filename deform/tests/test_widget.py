@@ -27,6 +27,22 @@ class TestWidget(unittest.TestCase):
         widget = self._makeOne()
         self.assertRaises(NotImplementedError, widget.deserialize, None, None)
 
+    def test_render_template(self):
+        widget = self._makeOne()
+        renderer = DummyRenderer('abc')
+        result = widget.render_template(renderer, 'tmpl', a=1)
+        self.assertEqual(result, 'abc')
+        self.assertEqual(renderer.template, 'tmpl')
+        self.assertEqual(renderer.kw, {'a':1})
+
+    def test_render_template_handle(self):
+        widget = self._makeOne()
+        renderer = DummyHandleRenderer('abc')
+        result = widget.render_template(renderer, 'tmpl', a=1)
+        self.assertEqual(result, 'abc')
+        self.assertEqual(renderer.handled, 'tmpl')
+        self.assertEqual(renderer.kw, {'a':1})
+
     def test_handle_error(self):
         inner_widget = self._makeOne()
         outer_widget = self._makeOne()
@@ -49,6 +65,79 @@ class TestWidget(unittest.TestCase):
         widget.handle_error(field, error)
         self.assertEqual(widget.error, 'abc')
 
+    def test___setattr__shared(self):
+        from deform.exception import WidgetMutationError
+        widget = self._makeOne(a=1)
+        widget.b = 2
+        object.__setattr__(widget, '_shared', True)
+        self.assertRaises(WidgetMutationError, setattr, widget, 'a', 3)
+        self.assertEqual(widget.a, 1)
+
+class Test_inline(unittest.TestCase):
+    def _callFUT(self, renderer, item_template):
+        from deform.widget import _inline
+        return _inline(renderer, item_template)
+
+    def test_default_renderer(self):
+        from deform.template import default_renderer
+        for name in ('mapping_item', 'readonly/mapping_item',
+                     'sequence_item', 'readonly/sequence_item'):
+            self.assertEqual(self._callFUT(default_renderer, name), True)
+
+    def test_other_item_template(self):
+        from deform.template import default_renderer
+        self.assertEqual(self._callFUT(default_renderer, 'textinput'), False)
+
+    def test_renderer_without_handle(self):
+        self.assertEqual(self._callFUT(DummyRenderer(), 'mapping_item'),
+                         False)
+
+    def test_overridden_item_template(self):
+        import os
+        import shutil
+        import tempfile
+        from deform.template import ZPTRendererFactory
+        from deform.template import default_dir
+        tmpdir = tempfile.mkdtemp()
+        try:
+            f = open(os.path.join(tmpdir, 'mapping_item.pt'), 'w')
+            f.write('<li/>')
+            f.close()
+            renderer = ZPTRendererFactory((tmpdir, default_dir))
+            self.assertEqual(self._callFUT(renderer, 'mapping_item'), False)
+            self.assertEqual(self._callFUT(renderer, 'sequence_item'), True)
+        finally:
+            shutil.rmtree(tmpdir)
+
+class Test_config(unittest.TestCase):
+    def _callFUT(self, wdg):
+        from deform.widget import _config
+        return _config(wdg)
+
+    def test_it(self):
+        from deform.widget import Widget
+        widget = Widget(values=[('a', 'A')], size=1)
+        config = self._callFUT(widget)
+        self.assertEqual(config, (('size', 1), ('values', "[('a', 'A')]")))
+        self.failUnless(self._callFUT(widget) is config)
+
+    def test_attribute_set(self):
+        from deform.widget import Widget
+        widget = Widget(size=1)
+        self._callFUT(widget)
+        widget.size = 2
+        self.assertEqual(self._callFUT(widget), (('size', 2),))
+
+    def test_attribute_changed_in_place(self):
+        from deform.widget import Widget
+        widget = Widget(values=[('a', 'A')], options={'a':1})
+        self._callFUT(widget)
+        widget.values.append(('b', 'B'))
+        widget.options['a'] = 2
+        self.assertEqual(self._callFUT(widget),
+                         (('options', "{'a': 2}"),
+                          ('values', "[('a', 'A'), ('b', 'B')]")))
+
 class TestTextInputWidget(unittest.TestCase):
     def _makeOne(self, **kw):
         from deform.widget import TextInputWidget
@@ -230,6 +319,117 @@ class TestAutocompleteInputWidget(unittest.TestCase):
         result = widget.deserialize(field, pstruct)
         self.assertEqual(result, null)
 
+    def test_serialize_values_provider(self):
+        from deform.template import default_renderer
+        provider = DummyProvider('http://example.com')
+        widget = self._makeOne(values=provider)
+        field = DummyField(DummySchema(), default_renderer)
+        field.widget = widget
+        result = widget.serialize(field, 'abc')
+        self.assertEqual(provider.calls, 1)
+        self.failUnless('source: "http://example.com"' in result)
+        self.failUnless('"delay": 400' in result)
+        provider.values = None
+        result = widget.serialize(field, 'abc')
+        self.failIf('<script' in result)
+        self.assertEqual(provider.calls, 2)
+
+    def test_serialize_encoding_memoized(self):
+        import deform.widget
+        values = ['a', 'b']
+        widget = self._makeOne(values=values)
+        renderer = DummyRenderer()
+        field = DummyField(DummySchema(), renderer=renderer)
+        widget.serialize(field, 'abc')
+        encoded = deform.widget._encoded_values[widget]
+        options = renderer.kw['options']
+        widget.serialize(field, 'abc', readonly=True)
+        self.failUnless(deform.widget._encoded_values[widget] is encoded)
+        self.failUnless(renderer.kw['options'] is options)
+        self.assertEqual(renderer.kw['values'], '["a", "b"]')
+        values.append('c')
+        widget.serialize(field, 'abc')
+        self.assertEqual(renderer.kw['values'], '["a", "b", "c"]')
+        widget.values = 'http://example.com'
+        widget.serialize(field, 'abc')
+        self.assertEqual(renderer.kw['values'], '"http://example.com"')
+        self.assertEqual(renderer.kw['options'],
+                         '{"delay": 400, "minLength": 2}')
+
+    def test_serialize_escaped_once(self):
+        from deform.template import default_renderer
+        widget = self._makeOne(values=['a&b', '<c>'])
+        field = DummyField(DummySchema(), default_renderer)
+        field.widget = widget
+        for i in range(2):
+            result = widget.serialize(field, 'abc')
+            self.failUnless('["a&amp;b", "&lt;c&gt;"]' in result)
+        self.assertEqual(widget.values_json(), '["a&b", "<c>"]')
+
+    def test_values_json(self):
+        values = [{'label':'A'}]
+        widget = self._makeOne(values=values)
+        self.assertEqual(widget.values_json(), '[{"label": "A"}]')
+        values[0]['label'] = 'B'
+        self.assertEqual(widget.values_json(), '[{"label": "B"}]')
+        widget.values = None
+        self.assertEqual(widget.values_json(), 'null')
+
+    def test_serialize_values_url(self):
+        provider = DummyProvider(['a'])
+        widget = self._makeOne(values=provider, values_url='/values.json')
+        renderer = DummyRenderer()
+        field = DummyField(DummySchema(), renderer=renderer)
+        widget.serialize(field, 'abc')
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(renderer.kw['values'], None)
+        self.assertEqual(renderer.kw['values_url'], '"/values.json"')
+        self.assertEqual(renderer.kw['source'], ['a'])
+        self.assertEqual(renderer.kw['options'],
+                         '{"delay": 10, "minLength": 2}')
+        widget.serialize(field, 'abc', readonly=True)
+        self.assertEqual(renderer.kw['values'], '["a"]')
+        self.assertEqual(renderer.kw['values_url'], None)
+
+    def test_serialize_values_url_template(self):
+        from deform.template import default_renderer
+        widget = self._makeOne(values=['a'], values_url='/values.json')
+        field = DummyField(DummySchema(), default_renderer)
+        field.widget = widget
+        result = widget.serialize(field, 'abc')
+        self.failUnless('$.getJSON("/values.json"' in result)
+        self.failIf('["a"]' in result)
+
+    def test_serialize_share_values(self):
+        import re
+        import deform.widget
+        from deform.widget import _PrototypeRegistry
+        widget = self._makeOne(values=['a'], share_values=True)
+        self.failIf(widget.cacheable)
+        renderer = DummyRenderer()
+        field = DummyField(DummySchema(), renderer=renderer)
+        # no form being rendered
+        widget.serialize(field, 'abc')
+        self.assertEqual(renderer.kw['values'], '["a"]')
+        self.assertEqual(renderer.kw['shared'], None)
+        registry = _PrototypeRegistry()
+        deform.widget._page.prototypes = registry
+        try:
+            widget.serialize(field, 'abc')
+            values = renderer.kw['values']
+            valuesid = re.match(r'deform\.autocompleteValues\["(.*)"\]$',
+                                values).group(1)
+            self.assertEqual(renderer.kw['shared'], (valuesid, '["a"]'))
+            widget.serialize(field, 'abc')
+            self.assertEqual(renderer.kw['values'], values)
+            self.assertEqual(renderer.kw['shared'], None)
+            # rendering a prototype
+            registry.nested.append([])
+            widget.serialize(field, 'abc')
+            self.assertEqual(renderer.kw['values'], '["a"]')
+        finally:
+            deform.widget._page.prototypes = None
+
 
 class TestDateInputWidget(unittest.TestCase):
     def _makeOne(self, **kw):
@@ -471,6 +671,77 @@ class TestRadioChoiceWidget(unittest.TestCase):
         result = widget.deserialize(field, 'true')
         self.assertEqual(result, 'true')
 
+    def _renderLoop(self, widget, field, cstruct):
+        # the rendering of the options by the template itself
+        from deform.template import default_renderer
+        return default_renderer(widget.template, field=field,
+                                cstruct=cstruct)
+
+    def test_options_renderer_without_handle(self):
+        field = DummyField(DummySchema(), DummyRenderer())
+        widget = self._makeOne(values=(('a', 'A'),))
+        self.assertEqual(widget.options(field, 'a'), None)
+
+    def test_serialize_options(self):
+        from deform.template import default_renderer
+        values = (('a', 'A'), ('b<', u'B & "\xe9"'), ('c', 'C'), ('a', 'A2'))
+        field = DummyField(DummySchema(), default_renderer)
+        for css_class in (None, 'x'):
+            widget = self._makeOne(values=values, css_class=css_class)
+            field.widget = widget
+            for cstruct in ('a', 'b<', 'other', ['unhashable']):
+                self.failIfEqual(widget.options(field, 'a'), None)
+                self.assertEqual(widget.serialize(field, cstruct),
+                                 self._renderLoop(widget, field, cstruct))
+
+    def test_serialize_options_byte_strings(self):
+        # decoded with the encoding of the template, as Chameleon does
+        from deform.template import default_renderer
+        values = (('fr', 'Fran\xc3\xa7ais'), ('caf\xc3\xa9', 'Caf\xc3\xa9'))
+        field = DummyField(DummySchema(), default_renderer)
+        widget = self._makeOne(values=values)
+        field.widget = widget
+        self.failUnless(u'Fran\xe7ais' in widget.options(field, 'fr'))
+        for cstruct in ('fr', 'caf\xc3\xa9', 'other'):
+            self.assertEqual(widget.serialize(field, cstruct),
+                             self._renderLoop(widget, field, cstruct))
+
+    def test_options_translation_string(self):
+        from deform.i18n import _
+        from deform.template import default_renderer
+        field = DummyField(DummySchema(), default_renderer)
+        widget = self._makeOne(values=(('a', _('A')),))
+        self.assertEqual(widget.options(field, 'a'), None)
+
+    def test_options_values_changed(self):
+        from deform.template import default_renderer
+        field = DummyField(DummySchema(), default_renderer)
+        values = [('a', 'A')]
+        widget = self._makeOne(values=values)
+        self.failUnless('>A<' in widget.options(field, 'a'))
+        values.append(('b', 'B'))
+        self.failUnless('>B<' in widget.options(field, 'a'))
+        widget.css_class = 'x'
+        self.failUnless('class="x"' in widget.options(field, 'a'))
+
+    def test_options_overridden_template(self):
+        import os
+        import shutil
+        import tempfile
+        from deform.template import ZPTRendererFactory
+        from deform.template import default_dir
+        tmpdir = tempfile.mkdtemp()
+        try:
+            widget = self._makeOne(values=(('a', 'A'),))
+            f = open(os.path.join(tmpdir, widget.template + '.pt'), 'w')
+            f.write('<p/>')
+            f.close()
+            renderer = ZPTRendererFactory((tmpdir, default_dir))
+            field = DummyField(DummySchema(), renderer)
+            self.assertEqual(widget.options(field, 'a'), None)
+        finally:
+            shutil.rmtree(tmpdir)
+
 class TestSelectWidget(unittest.TestCase):
     def _makeOne(self, **kw):
         from deform.widget import SelectWidget
@@ -551,6 +822,206 @@ class TestSelectWidget(unittest.TestCase):
         result = widget.deserialize(field, 'true')
         self.assertEqual(result, 'true')
 
+    def _renderLoop(self, widget, field, cstruct):
+        # the rendering of the options by the template itself
+        from deform.template import default_renderer
+        return default_renderer(widget.template, field=field,
+                                cstruct=cstruct)
+
+    def test_options_renderer_without_handle(self):
+        field = DummyField(DummySchema(), DummyRenderer())
+        widget = self._makeOne(values=(('a', 'A'),))
+        self.assertEqual(widget.options(field, 'a'), None)
+
+    def test_serialize_options(self):
+        from deform.template import default_renderer
+        values = (('a', 'A'), ('b<', u'B & "\xe9"'), ('c', 'C'), ('a', 'A2'))
+        field = DummyField(DummySchema(), default_renderer)
+        for css_class in (None, 'x'):
+            widget = self._makeOne(values=values, css_class=css_class)
+            field.widget = widget
+            for cstruct in ('a', 'b<', 'other', ['unhashable']):
+                self.failIfEqual(widget.options(field, 'a'), None)
+                self.assertEqual(widget.serialize(field, cstruct),
+                                 self._renderLoop(widget, field, cstruct))
+
+    def test_serialize_options_byte_strings(self):
+        # decoded with the encoding of the template, as Chameleon does
+        from deform.template import default_renderer
+        values = (('fr', 'Fran\xc3\xa7ais'), ('caf\xc3\xa9', 'Caf\xc3\xa9'))
+        field = DummyField(DummySchema(), default_renderer)
+        widget = self._makeOne(values=values)
+        field.widget = widget
+        self.failUnless(u'Fran\xe7ais' in widget.options(field, 'fr'))
+        for cstruct in ('fr', 'caf\xc3\xa9', 'other'):
+            self.assertEqual(widget.serialize(field, cstruct),
+                             self._renderLoop(widget, field, cstruct))
+
+    def test_options_translation_string(self):
+        from deform.i18n import _
+        from deform.template import default_renderer
+        field = DummyField(DummySchema(), default_renderer)
+        widget = self._makeOne(values=(('a', _('A')),))
+        self.assertEqual(widget.options(field, 'a'), None)
+
+    def test_options_values_changed(self):
+        from deform.template import default_renderer
+        field = DummyField(DummySchema(), default_renderer)
+        values = [('a', 'A')]
+        widget = self._makeOne(values=values)
+        self.failUnless('>A<' in widget.options(field, 'a'))
+        values.append(('b', 'B'))
+        self.failUnless('>B<' in widget.options(field, 'a'))
+        widget.css_class = 'x'
+        self.failUnless('class="x"' in widget.options(field, 'a'))
+
+    def test_options_overridden_template(self):
+        import os
+        import shutil
+        import tempfile
+        from deform.template import ZPTRendererFactory
+        from deform.template import default_dir
+        tmpdir = tempfile.mkdtemp()
+        try:
+            widget = self._makeOne(values=(('a', 'A'),))
+            f = open(os.path.join(tmpdir, widget.template + '.pt'), 'w')
+            f.write('<p/>')
+            f.close()
+            renderer = ZPTRendererFactory((tmpdir, default_dir))
+            field = DummyField(DummySchema(), renderer)
+            self.assertEqual(widget.options(field, 'a'), None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_values_provider(self):
+        provider = DummyProvider((('a', 'A'),))
+        widget = self._makeOne(values=provider)
+        self.assertEqual(provider.calls, 0)
+        self.assertEqual(widget.values, (('a', 'A'),))
+        self.assertEqual(widget.values, (('a', 'A'),))
+        self.assertEqual(provider.calls, 2)
+        self.failIf(widget.cacheable)
+
+    def test_serialize_options_override(self):
+        from deform.template import default_renderer
+        from deform.widget import SelectWidget
+        class Widget(SelectWidget):
+            def options(self, field, cstruct):
+                return '<option>%s</option>' % cstruct
+        provider = DummyProvider((('a', 'A'),))
+        field = DummyField(DummySchema(), default_renderer)
+        widget = field.widget = Widget(values=provider)
+        self.failUnless('<option>a</option>' in widget.serialize(field, 'a'))
+        self.assertEqual(provider.calls, 1)
+
+    def test_values_provider_deserialize(self):
+        provider = DummyProvider((('a', 'A'),))
+        widget = self._makeOne(values=provider)
+        widget.deserialize(DummyField(), 'a')
+        self.assertEqual(provider.calls, 0)
+
+    def test_values_provider_serialize(self):
+        from deform.template import default_renderer
+        provider = DummyProvider((('a', 'A'), ('b', 'B')))
+        field = DummyField(DummySchema(), default_renderer)
+        widget = self._makeOne(values=provider)
+        field.widget = widget
+        static = self._makeOne(values=provider.values)
+        for readonly in (False, True):
+            provider.calls = 0
+            result = widget.serialize(field, 'b', readonly=readonly)
+            self.assertEqual(provider.calls, 1)
+            field.widget = static
+            self.assertEqual(result,
+                             static.serialize(field, 'b', readonly=readonly))
+            field.widget = widget
+
+    def test_values_ttl(self):
+        import deform.widget
+        clock = DummyClock()
+        old_clock = deform.widget._clock
+        deform.widget._clock = clock
+        try:
+            provider = DummyProvider((('a', 'A'),))
+            widget = self._makeOne(values=provider, values_ttl=60)
+            self.assertEqual(widget.values, (('a', 'A'),))
+            clock.now = 59
+            self.assertEqual(widget.values, (('a', 'A'),))
+            self.assertEqual(provider.calls, 1)
+            provider.values = (('b', 'B'),)
+            clock.now = 60
+            self.assertEqual(widget.values, (('b', 'B'),))
+            self.assertEqual(provider.calls, 2)
+        finally:
+            deform.widget._clock = old_clock
+
+    def test_values_ttl_provider_error(self):
+        provider = DummyProvider((('a', 'A'),))
+        widget = self._makeOne(values=provider, values_ttl=60)
+        provider.exc = ValueError
+        self.assertRaises(ValueError, getattr, widget, 'values')
+        provider.exc = None
+        self.assertEqual(widget.values, (('a', 'A'),))
+        self.assertEqual(provider.calls, 2)
+
+    def test_values_ttl_new_provider(self):
+        provider = DummyProvider((('a', 'A'),))
+        widget = self._makeOne(values=provider, values_ttl=60)
+        self.assertEqual(widget.values, (('a', 'A'),))
+        widget.values = DummyProvider((('b', 'B'),))
+        self.assertEqual(widget.values, (('b', 'B'),))
+        widget.values = (('c', 'C'),)
+        self.assertEqual(widget.values, (('c', 'C'),))
+        self.failUnless(widget.cacheable)
+
+    def test_invalidate_values(self):
+        provider = DummyProvider((('a', 'A'),))
+        widget = self._makeOne(values=provider, values_ttl=60)
+        self.assertEqual(widget.values, (('a', 'A'),))
+        provider.values = (('b', 'B'),)
+        self.assertEqual(widget.values, (('a', 'A'),))
+        widget.invalidate_values()
+        self.assertEqual(widget.values, (('b', 'B'),))
+        self.assertEqual(provider.calls, 2)
+
+    def test_values_ttl_threads(self):
+        import threading
+        import time
+        def load():
+            time.sleep(0.01)
+            return (('a', 'A'),)
+        provider = DummyProvider(None, load)
+        widget = self._makeOne(values=provider, values_ttl=60)
+        results = []
+        def render():
+            results.append(widget.values)
+        threads = [ threading.Thread(target=render) for i in range(5) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [(('a', 'A'),)] * 5)
+        self.assertEqual(provider.calls, 1)
+
+    def test_values_provider_shared(self):
+        from deform.exception import WidgetMutationError
+        provider = DummyProvider((('a', 'A'),))
+        widget = self._makeOne(values=provider, values_ttl=60)
+        widget._shared = True
+        self.assertEqual(widget.values, (('a', 'A'),))
+        widget.invalidate_values()
+        self.assertEqual(widget.values, (('a', 'A'),))
+        self.assertRaises(WidgetMutationError, setattr, widget, 'values', ())
+        self.assertRaises(WidgetMutationError, setattr, widget,
+                          'cacheable', True)
+
+    def test_cacheable(self):
+        widget = self._makeOne(values=DummyProvider(()))
+        widget.cacheable = True
+        self.failIf(widget.cacheable)
+        widget = self._makeOne(cacheable=False)
+        self.failIf(widget.cacheable)
+
 class TestCheckboxChoiceWidget(unittest.TestCase):
     def _makeOne(self, **kw):
         from deform.widget import CheckboxChoiceWidget
@@ -619,6 +1090,74 @@ class TestCheckboxChoiceWidget(unittest.TestCase):
         result = widget.deserialize(field, ['abc'])
         self.assertEqual(result, ('abc',))
 
+    def test_deserialize_tuple(self):
+        widget = self._makeOne()
+        field = DummyField()
+        pstruct = ('abc',)
+        result = widget.deserialize(field, pstruct)
+        self.failUnless(result is pstruct)
+
+    def test_serialize_selected(self):
+        renderer = DummyRenderer()
+        field = DummyField(DummySchema(), renderer)
+        widget = self._makeOne()
+        widget.serialize(field, ['a', 'b'])
+        self.assertEqual(renderer.kw['cstruct'], ['a', 'b'])
+        self.assertEqual(renderer.kw['selected'], frozenset(['a', 'b']))
+
+    def test_serialize_selected_set(self):
+        renderer = DummyRenderer()
+        field = DummyField(DummySchema(), renderer)
+        widget = self._makeOne()
+        cstruct = set(['a'])
+        widget.serialize(field, cstruct)
+        self.failUnless(renderer.kw['selected'] is cstruct)
+
+    def test_serialize_selected_unhashable(self):
+        renderer = DummyRenderer()
+        field = DummyField(DummySchema(), renderer)
+        widget = self._makeOne()
+        cstruct = [['a']]
+        widget.serialize(field, cstruct)
+        self.failUnless(renderer.kw['selected'] is cstruct)
+
+    def test_serialize_selected_string(self):
+        renderer = DummyRenderer()
+        field = DummyField(DummySchema(), renderer)
+        widget = self._makeOne()
+        widget.serialize(field, 'abc')
+        self.assertEqual(renderer.kw['selected'], 'abc')
+
+    def test_serialize_template(self):
+        from deform.template import default_renderer
+        field = DummyField(DummySchema(), default_renderer)
+        widget = field.widget = self._makeOne(values=(('a', 'A'),
+                                                      ('b', 'B')))
+        for readonly in (False, True):
+            template = readonly and widget.readonly_template or widget.template
+            # without ``selected`` the templates test the cstruct itself
+            expected = default_renderer(template, field=field,
+                                        cstruct=['b'])
+            self.assertEqual(widget.serialize(field, ['b'],
+                                              readonly=readonly),
+                             expected)
+
+    def test_serialize_values_provider(self):
+        from deform.template import default_renderer
+        provider = DummyProvider((('a', 'A'), ('b', 'B')))
+        field = DummyField(DummySchema(), default_renderer)
+        widget = self._makeOne(values=provider)
+        field.widget = widget
+        static = self._makeOne(values=provider.values)
+        for readonly in (False, True):
+            provider.calls = 0
+            result = widget.serialize(field, ('b',), readonly=readonly)
+            self.assertEqual(provider.calls, 1)
+            field.widget = static
+            self.assertEqual(result, static.serialize(field, ('b',),
+                                                      readonly=readonly))
+            field.widget = widget
+
 class TestCheckedInputWidget(unittest.TestCase):
     def _makeOne(self, **kw):
         from deform.widget import CheckedInputWidget
@@ -966,6 +1505,14 @@ class TestMappingWidget(unittest.TestCase):
         self.assertEqual(renderer.kw['field'], field)
         self.assertEqual(renderer.kw['cstruct'], {})
 
+    def test_serialize_inline(self):
+        renderer = DummyRenderer()
+        schema = DummySchema()
+        field = DummyField(schema, renderer)
+        widget = self._makeOne()
+        widget.serialize(field, None)
+        self.assertEqual(renderer.kw['inline'], False)
+
     def test_serialize_not_null(self):
         renderer = DummyRenderer()
         schema = DummySchema()
@@ -1034,7 +1581,7 @@ class TestSequenceWidget(unittest.TestCase):
         schema = DummySchema()
         field = DummyField(schema, renderer)
         widget = self._makeOne()
-        protofield = DummyField()
+        protofield = DummyField(None, renderer)
         field.children=[protofield]
         result = widget.prototype(field)
         self.assertEqual(type(result), str)
@@ -1047,7 +1594,7 @@ class TestSequenceWidget(unittest.TestCase):
         schema = DummySchema()
         field = DummyField(schema, renderer)
         widget = self._makeOne()
-        protofield = DummyField()
+        protofield = DummyField(None, renderer)
         field.children=[protofield]
         result = widget.prototype(field)
         self.assertEqual(type(result), str)
@@ -1069,6 +1616,93 @@ class TestSequenceWidget(unittest.TestCase):
         self.assertEqual(renderer.kw['cstruct'], [])
         self.assertEqual(renderer.template, widget.template)
 
+    def test_serialize_null_no_registry(self):
+        from colander import null
+        renderer = DummyRenderer('abc')
+        schema = DummySchema()
+        field = DummyField(schema, renderer)
+        field.children = [DummyField()]
+        widget = self._makeOne()
+        widget.serialize(field, null)
+        self.assertEqual(renderer.kw['prototype_id'], None)
+        self.assertEqual(renderer.kw['prototypes'], ())
+
+    def test_serialize_with_registry(self):
+        from colander import null
+        from deform import widget as module
+        renderer = DummyRenderer(u'<li><script></script></li>')
+        schema = DummySchema()
+        field = DummyField(schema, renderer)
+        inner = DummyField(None, renderer)
+        inner.widget = DummyWidget()
+        field.children = [inner]
+        widget = self._makeOne()
+        module._page.prototypes = registry = module._PrototypeRegistry()
+        protoid = 'deformPrototype-9bf7fcdc7177fb2c'
+        try:
+            widget.serialize(field, null)
+            self.assertEqual(renderer.kw['prototype_id'], protoid)
+            self.assertEqual(renderer.kw['prototypes'],
+                             [(protoid, u'<li><script><\\/script></li>')])
+            widget.serialize(field, null)
+            self.assertEqual(renderer.kw['prototype_id'], protoid)
+            self.assertEqual(renderer.kw['prototypes'], [])
+        finally:
+            module._page.prototypes = None
+        self.assertEqual(len(registry.ids), 1)
+
+    def test_serialize_with_prototype_cache(self):
+        from colander import null
+        from deform import widget as module
+        renderer = DummyRenderer(u'<li/>')
+        renderer.generation = 1
+        field = DummyField(DummySchema(), renderer)
+        inner = DummyField(None, renderer)
+        inner.widget = DummyWidget()
+        field.children = [inner]
+        cache = module.PrototypeCache()
+        widget = self._makeOne(prototype_cache=cache)
+        def serialize():
+            module._page.prototypes = module._PrototypeRegistry()
+            try:
+                widget.serialize(field, null)
+            finally:
+                module._page.prototypes = None
+            return renderer.kw['prototypes']
+        expected = serialize()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        renderer.result = u'changed'
+        self.assertEqual(serialize(), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        inner.widget = DummyWidget(exc='config')
+        self.assertNotEqual(serialize(), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        renderer.generation = 2
+        inner.widget = DummyWidget()
+        self.assertNotEqual(serialize(), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_serialize_with_registry_nested(self):
+        from colander import null
+        from deform import widget as module
+        renderer = DummyRenderer('abc')
+        field = DummyField(DummySchema(), renderer)
+        inner = DummyField(None, renderer)
+        inner.widget = DummyWidget()
+        field.children = [inner]
+        widget = self._makeOne()
+        module._page.prototypes = registry = module._PrototypeRegistry()
+        registry.nested = [[]] # rendering the prototype of another sequence
+        try:
+            widget.serialize(field, null)
+        finally:
+            module._page.prototypes = None
+        protoid = 'deformPrototype-900150983cd24fb0'
+        self.assertEqual(renderer.kw['prototype_id'], protoid)
+        self.assertEqual(renderer.kw['prototypes'], [])
+        self.assertEqual(registry.pending, [(protoid, 'abc')])
+        self.assertEqual(registry.nested, [[(protoid, 'abc')]])
+
     def test_serialize_None(self):
         renderer = DummyRenderer('abc')
         schema = DummySchema()
@@ -1097,7 +1731,29 @@ class TestSequenceWidget(unittest.TestCase):
         self.assertEqual(len(renderer.kw['subfields']), 1)
         self.assertEqual(renderer.kw['field'], field)
         self.assertEqual(renderer.kw['cstruct'], [null])
+        self.assertEqual(renderer.kw['min_len'], 1)
         self.assertEqual(renderer.template, widget.template)
+        self.assertEqual(widget.min_len, None)
+
+    def test_serialize_render_initial_item_widget_min_len(self):
+        # templates reading ``field.widget.min_len`` see the effective
+        # minimum length while the widget is serialized
+        from colander import null
+        seen = []
+        def renderer(template, **kw):
+            seen.append(kw['field'].widget.min_len)
+            return 'abc'
+        schema = DummySchema()
+        field = DummyField(schema, renderer)
+        inner = DummyField()
+        field.children=[inner]
+        widget = self._makeOne()
+        field.widget = widget
+        widget.render_initial_item = True
+        result = widget.serialize(field, null)
+        self.assertEqual(result, 'abc')
+        self.assertEqual(seen, [1])
+        self.assertEqual(widget.min_len, None)
 
     def test_serialize_null_min_len_larger_than_cstruct(self):
         from colander import null
@@ -1265,6 +1921,63 @@ class TestFormWidget(unittest.TestCase):
         form = self._makeOne()
         self.assertEqual(form.template, 'form')
 
+    def test_serialize_prototype_registry(self):
+        from colander import null
+        from deform import widget as module
+        registries = []
+        def renderer(template, **kw):
+            registries.append(module._page.prototypes)
+            return 'abc'
+        widget = self._makeOne()
+        field = DummyField(None, renderer)
+        self.assertEqual(widget.serialize(field, null), 'abc')
+        self.assertEqual(registries[0].__class__, module._PrototypeRegistry)
+        self.assertEqual(getattr(module._page, 'prototypes', None), None)
+
+class TestPrototypeCache(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from deform.widget import PrototypeCache
+        return PrototypeCache(**kw)
+
+    def test_get_set(self):
+        cache = self._makeOne()
+        renderer = DummyRenderer()
+        key = cache.key('key', renderer)
+        self.assertEqual(key, ('key', renderer, None))
+        self.assertEqual(cache.get(key), None)
+        cache.set(key, 'value', renderer)
+        self.assertEqual(cache.get(key), 'value')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_locale(self):
+        cache = self._makeOne(locale=lambda: 'fr')
+        self.assertEqual(cache.key('key', None), ('key', None, 'fr'))
+
+    def test_generation(self):
+        cache = self._makeOne()
+        renderer = DummyRenderer()
+        renderer.generation = 1
+        key = cache.key('key', renderer)
+        cache.set(key, 'value', renderer)
+        renderer.generation = 2
+        self.assertEqual(cache.get(key), None)
+
+    def test_maxsize(self):
+        cache = self._makeOne(maxsize=2)
+        a, b, c = [ cache.key(name, None) for name in 'abc' ]
+        cache.set(a, 1, None)
+        cache.set(b, 2, None)
+        cache.get(a)
+        cache.set(c, 3, None)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(b), None)
+        self.assertEqual(cache.get(a), 1)
+        self.assertEqual(cache.get(c), 3)
+
 class TestTextAreaCSVWidget(unittest.TestCase):
     def _makeOne(self, **kw):
         from deform.widget import TextAreaCSVWidget
@@ -1526,6 +2239,14 @@ class DummyRenderer(object):
         self.kw = kw
         return self.result
 
+class DummyHandleRenderer(DummyRenderer):
+    def handle(self, template):
+        self.handled = template
+        def render(**kw):
+            self.kw = kw
+            return self.result
+        return render
+
 class DummyWidget(object):
     name = 'name'
     def __init__(self, exc=None):
@@ -1558,6 +2279,7 @@ class DummyField(object):
     name = 'name'
     cloned = False
     oid = 'deformField1'
+    oid_prefix = None
     def __init__(self, schema=None, renderer=None):
         self.schema = schema
         self.renderer = renderer
@@ -1569,6 +2291,26 @@ class DummyField(object):
     def deserialize(self, pstruct):
         return self.widget.deserialize(self, pstruct)
 
+class DummyProvider(object):
+    exc = None
+    def __init__(self, values, load=None):
+        self.values = values
+        self.load = load
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.exc is not None:
+            raise self.exc
+        if self.load is not None:
+            return self.load()
+        return self.values
+
+class DummyClock(object):
+    now = 0
+    def __call__(self):
+        return self.now
+
 class DummyTmpStore(dict):
     def preview_url(self, uid):
         return 'preview_url'
@@ -1,13 +1,31 @@
+import copy
 import csv
+import os
 import random
+import re
 import string
 import StringIO
+import threading
+import time
 import urllib
+import weakref
+
+try:
+    from hashlib import md5
+except ImportError: # PRAGMA: no cover
+    from md5 import new as md5
 
 from colander import Invalid
 from colander import null
 
+from deform.exception import WidgetMutationError
 from deform.i18n import _
+from deform.readonly import _Translate
+from deform.readonly import _attr
+from deform.readonly import _escape
+from deform.readonly import _text
+from deform.template import _OrderedDict
+from deform.template import default_dir
 
 try:
     import json 
@@ -88,6 +106,15 @@ class Widget(object):
         Default: ``()`` (the empty tuple, meaning no special
         requirements).
 
+    cacheable
+        If this attribute is false, the rendering of the field
+        associated with this widget (and of the fields which contain
+        it) is never stored in a fragment cache (see
+        :class:`deform.field.FragmentCache`).  Set it to ``False`` for
+        widgets whose rendering depends on anything else than the
+        field, the widget attributes and the cstruct, or which have
+        side effects when they are rendered.  Default: ``True``.
+
     These attributes are also accepted as keyword arguments to all
     widget constructors; if they are passed, they will override the
     defaults.
@@ -103,10 +130,20 @@ class Widget(object):
     error_class = 'error'
     css_class = None
     requirements = ()
+    cacheable = True
+
+    _shared = False
 
     def __init__(self, **kw):
         self.__dict__.update(kw)
 
+    def __setattr__(self, name, value):
+        if self._shared:
+            raise WidgetMutationError(
+                'Cannot set %r on %r: it is shared between fields' % (
+                    name, self))
+        object.__setattr__(self, name, value)
+
     def serialize(self, field, cstruct, readonly=False):
         """
         The ``serialize`` method of a widget must serialize a
@@ -123,6 +160,22 @@ class Widget(object):
         """
         raise NotImplementedError
 
+    def render_template(self, renderer, template, **kw):
+        """
+        Render the template named ``template`` with ``renderer`` (a
+        :term:`renderer`, usually the ``renderer`` of the field being
+        serialized) and the keyword arguments ``kw``, and return the
+        result.  This is equivalent to ``renderer(template, **kw)``;
+        but if the renderer has a ``handle`` method (as
+        :class:`deform.ZPTRendererFactory` renderers do), the template
+        is rendered by the callable it returns, so that the name is not
+        resolved to a template again.
+        """
+        handle = getattr(renderer, 'handle', None)
+        if handle is None:
+            return renderer(template, **kw)
+        return handle(template)(**kw)
+
     def deserialize(self, field, pstruct):
         """
         The ``deserialize`` method of a widget must deserialize a
@@ -154,6 +207,103 @@ class Widget(object):
                     subfield.widget.handle_error(subfield, e)
 
 
+# the item templates which the templates of mapping and sequence widgets
+# can render inline, and their file
+_inline_templates = dict(
+    (name, os.path.abspath(os.path.join(default_dir, name + '.pt')))
+    for name in ('mapping_item', 'readonly/mapping_item',
+                 'sequence_item', 'readonly/sequence_item'))
+
+def _inline(renderer, item_template):
+    """ Return ``True`` if the template of a mapping or sequence widget
+    can render its items with the markup of ``item_template`` instead
+    of calling ``renderer`` for each item: this requires a renderer
+    with a ``handle`` method which resolves ``item_template`` to the
+    Deform template of that name (and not to a template overriding it
+    in another directory of the search path).  The templates of these
+    widgets include the markup of each item template when they are
+    read (see :class:`deform.template.ZPTTemplateFile`), so that it
+    renders exactly the same text."""
+    filename = _inline_templates.get(item_template)
+    handle = getattr(renderer, 'handle', None)
+    if filename is None or handle is None:
+        return False
+    return getattr(handle(item_template), 'filename', None) == filename
+
+class _ProvidedValues(object):
+    # the values loaded from the provider of a widget
+    def __init__(self, provider):
+        self.provider = provider
+        self.lock = threading.Lock()
+        self.expires = None
+        self.values = None
+
+# widget -> the _ProvidedValues of its provider
+_provided = weakref.WeakKeyDictionary()
+_provided_lock = threading.Lock()
+
+_clock = time.time
+
+class _ValuesWidget(Widget):
+    """ The base class of the widgets which render a ``values``
+    attribute, which may be a callable providing the values (see
+    :class:`deform.widget.SelectWidget`)."""
+    _values = ()
+    values_ttl = None
+
+    def _get_values(self):
+        values = self.__dict__.get('values', self._values)
+        if not callable(values):
+            return values
+        ttl = self.values_ttl
+        if not ttl:
+            return values()
+        entry = _provided.get(self)
+        if (entry is None or entry.provider is not values or
+            entry.expires is None or entry.expires <= _clock()):
+            _provided_lock.acquire()
+            try:
+                entry = _provided.get(self)
+                if entry is None or entry.provider is not values:
+                    entry = _provided[self] = _ProvidedValues(values)
+            finally:
+                _provided_lock.release()
+            entry.lock.acquire()
+            try:
+                # another thread may have loaded them meanwhile
+                if entry.expires is None or entry.expires <= _clock():
+                    entry.values = values()
+                    entry.expires = _clock() + ttl
+            finally:
+                entry.lock.release()
+        return entry.values
+
+    def _set_values(self, values):
+        self.__dict__['values'] = values
+
+    values = property(_get_values, _set_values)
+
+    def _get_cacheable(self):
+        # the values of a provider may change between renderings
+        return (self.__dict__.get('cacheable', True) and
+                not callable(self.__dict__.get('values')))
+
+    def _set_cacheable(self, cacheable):
+        self.__dict__['cacheable'] = cacheable
+
+    cacheable = property(_get_cacheable, _set_cacheable)
+
+    def invalidate_values(self):
+        """ Discard the values cached from the provider of the widget,
+        so that they are loaded again the next time the widget is
+        rendered."""
+        _provided_lock.acquire()
+        try:
+            _provided.pop(self, None)
+        finally:
+            _provided_lock.release()
+
+
 class TextInputWidget(Widget):
     """
     Renders an ``<input type="text"/>`` widget.
@@ -215,7 +365,8 @@ class TextInputWidget(Widget):
         if cstruct in (null, None):
             cstruct = ''
         template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct)
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=cstruct)
 
     def deserialize(self, field, pstruct):
         if pstruct is null:
@@ -226,7 +377,72 @@ class TextInputWidget(Widget):
             return null
         return pstruct
 
-class AutocompleteInputWidget(Widget):
+_json_atoms = (str, unicode, int, long, float, bool, type(None))
+
+class _JSONText(str):
+    # A JSON text which templates render escaped, as they render a
+    # string, but which is escaped once instead of at each rendering.
+    def __html__(self):
+        html = self.__dict__.get('html')
+        if html is None:
+            html = self.html = _escape(self)
+        return html
+
+def _atoms(values):
+    # whether the items of ``values`` are JSON atoms, which need not be
+    # copied
+    for item in values:
+        if item.__class__ not in _json_atoms:
+            return False
+    return True
+
+class _EncodedValues(object):
+    # The JSON encoding of the values of an AutocompleteInputWidget,
+    # with a copy of the values to find out whether they have changed
+    # since (they may be changed in place).
+    def __init__(self, values):
+        self.json = _JSONText(json.dumps(values))
+        if isinstance(values, basestring) or values is None:
+            self.values = values
+        elif values.__class__ in (list, tuple) and _atoms(values):
+            self.values = values[:]
+        else:
+            self.values = copy.deepcopy(values)
+        self._id = None
+
+    def matches(self, values):
+        if self.values is values:
+            return True
+        return (values.__class__ is self.values.__class__ and
+                values == self.values)
+
+    @property
+    def id(self):
+        # the name of the values in a page which shares them
+        if self._id is None:
+            digest = md5(self.json).hexdigest()[:16]
+            self._id = 'deformValues-%s' % digest
+        return self._id
+
+# widget -> the _EncodedValues of its values
+_encoded_values = weakref.WeakKeyDictionary()
+
+# (delay, min_length, remote) -> JSON encoding of the options
+_autocomplete_options = {}
+
+def _options_json(delay, min_length, remote):
+    key = (delay, min_length, remote)
+    options = _autocomplete_options.get(key)
+    if options is None:
+        options = {}
+        if not delay:
+            # set default delay if None
+            options['delay'] = (remote and 400) or 10
+        options['minLength'] = min_length
+        options = _autocomplete_options[key] = json.dumps(options)
+    return options
+
+class AutocompleteInputWidget(_ValuesWidget):
     """
     Renders an ``<input type="text"/>`` widget which provides
     autocompletion via a list of values.
@@ -274,8 +490,35 @@ class AutocompleteInputWidget(Widget):
 
           ['foo', 'bar', 'baz']
 
+        ``values`` may also be a callable which takes no argument and
+        returns the values (or the URL), called when the widget is
+        rendered (see ``values_ttl``).
+
         Defaults to ``None``.
 
+    values_ttl
+        The number of seconds for which the values returned by a
+        ``values`` callable are cached.  See
+        :class:`deform.widget.SelectWidget`.  Default: ``None``.
+
+    values_url
+        If it is not ``None``, the values are not included in the page:
+        the page loads them from this URL (once, and then provides
+        autocompletion from them like from values included in the
+        page), where the application serves the result of
+        :meth:`values_json` with the content type
+        ``application/json``, so that browsers may cache it.  Unlike a
+        URL passed as ``values``, it returns all the values, not the
+        values matching what the user typed.  Default: ``None``.
+
+    share_values
+        If true, the values are included once in a form rendering, in
+        a script which assigns them to a variable, and each field
+        rendered with the same values (such as the fields of a
+        sequence of autocomplete inputs) refers to this variable.  The
+        rendering of the widget then depends on the fields rendered
+        before it, and it is not ``cacheable``.  Default: ``False``.
+
     min_length
         ``min_length`` is an optional argument to
         :term:`jquery.ui.autocomplete`. The number of characters to
@@ -294,26 +537,64 @@ class AutocompleteInputWidget(Widget):
     size = None
     strip = True
     template = 'autocomplete_input'
-    values = None
+    _values = None
+    values_url = None
+    share_values = False
     requirements = ( ('jqueryui', None), )
 
     def serialize(self, field, cstruct, readonly=False):
         if cstruct in (null, None):
             cstruct = ''
-        options = {}
-        if not self.delay:
-            # set default delay if None
-            options['delay'] = (isinstance(self.values,
-                                          basestring) and 400) or 10
-        options['minLength'] = self.min_length
-        options = json.dumps(options)
-        values = json.dumps(self.values)
+        source = self.values
+        remote = isinstance(source, basestring)
+        options = _options_json(self.delay, self.min_length, remote)
         template = readonly and self.readonly_template or self.template
-        return field.renderer(template,
-                              cstruct=cstruct,
-                              field=field,
-                              options=options,
-                              values=values)
+        local = not (readonly or remote)
+        values = shared = values_url = None
+        if local and self.values_url is not None:
+            values_url = json.dumps(self.values_url)
+        else:
+            encoded = self._encoded(source)
+            values = encoded.json
+            registry = getattr(_page, 'prototypes', None)
+            # the values are inlined in the prototypes of sequences,
+            # which are not rendered as part of the page
+            if (local and self.share_values and registry is not None and
+                not registry.nested):
+                values = 'deform.autocompleteValues["%s"]' % encoded.id
+                if encoded.id not in registry.emitted:
+                    registry.emitted.add(encoded.id)
+                    shared = (encoded.id, encoded.json)
+        return self.render_template(field.renderer, template,
+                                    cstruct=cstruct,
+                                    field=field,
+                                    options=options,
+                                    values=values,
+                                    source=source,
+                                    shared=shared,
+                                    values_url=values_url)
+
+    def values_json(self):
+        """ Return the JSON encoding of the values of the widget (after
+        calling its values provider, if it has one).  This is the
+        document to be served at ``values_url``.  The encoding is
+        computed once and reused until the values change."""
+        return str(self._encoded(self.values).json)
+
+    def _encoded(self, values):
+        encoded = _encoded_values.get(self)
+        if encoded is None or not encoded.matches(values):
+            encoded = _EncodedValues(values)
+            _encoded_values[self] = encoded
+        return encoded
+
+    def _get_cacheable(self):
+        # with ``share_values``, the rendering depends on the fields
+        # rendered before in the page
+        return (_ValuesWidget._get_cacheable(self) and
+                not self.share_values)
+
+    cacheable = property(_get_cacheable, _ValuesWidget._set_cacheable)
 
     def deserialize(self, field, pstruct):
         if pstruct is null:
@@ -356,7 +637,8 @@ class DateInputWidget(Widget):
         if cstruct in (null, None):
             cstruct = ''
         template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct)
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=cstruct)
 
     def deserialize(self, field, pstruct):
         if pstruct in ('', null):
@@ -483,7 +765,8 @@ class HiddenWidget(Widget):
     def serialize(self, field, cstruct, readonly=False):
         if cstruct in (null, None):
             cstruct = ''
-        return field.renderer(self.template, field=field, cstruct=cstruct)
+        return self.render_template(field.renderer, self.template,
+                                    field=field, cstruct=cstruct)
 
     def deserialize(self, field, pstruct):
         if not pstruct:
@@ -521,14 +804,123 @@ class CheckboxWidget(Widget):
 
     def serialize(self, field, cstruct, readonly=False):
         template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct)
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=cstruct)
 
     def deserialize(self, field, pstruct):
         if pstruct is null:
             return self.false_val
         return (pstruct == self.true_val) and self.true_val or self.false_val
 
-class SelectWidget(Widget):
+class _OptionMarkup(object):
+    """ The markup of the options of the ``select`` or ``radio_choice``
+    template for a sequence of ``values`` (all strings) and a
+    ``css_class``, computed once and reused by each rendering.  It is
+    kept as ``parts`` to be joined with the escaped oid of the field
+    (the ``radio_choice`` template refers to the oid in each option),
+    and for each value, the places where the parts get the
+    ``selected`` (or ``checked``) attribute when it is the cstruct.
+    It is the same text as the loop over the values in the template
+    renders; like the template, it decodes byte strings with
+    ``encoding``."""
+    def __init__(self, template, values, css_class, encoding):
+        self.template = template
+        self.values = values
+        self.css_class = css_class
+        self.encoding = encoding
+        self.parts = None
+        for value, description in values:
+            # values to be translated (or which have an ``__html__``
+            # method) are left to the template
+            if (value.__class__ not in _strings or
+                description.__class__ not in _strings):
+                return
+        try:
+            self._build(_Translate(None, encoding))
+        except UnicodeDecodeError:
+            # left to the template, which fails the same way
+            self.parts = None
+
+    def _build(self, translate):
+        template = self.template
+        values = self.values
+        parts = []
+        current = []
+        length = 0
+        places = {}
+        oid = self._oid = object()
+        build = getattr(self, '_' + template)
+        for index, (value, description) in enumerate(values):
+            if index:
+                current.append(u' ')
+                length += 1
+            for segment in build(translate, index, value, description):
+                if segment is oid:
+                    parts.append(u''.join(current))
+                    current = []
+                    length = 0
+                elif segment is None:
+                    place = (len(parts), length)
+                    places.setdefault(value, []).append(place)
+                else:
+                    current.append(segment)
+                    length += len(segment)
+        parts.append(u''.join(current))
+        self.parts = parts
+        self.places = places
+
+    def _select(self, translate, index, value, description):
+        # None is the place of the ``selected`` attribute
+        return (u'<option', _attr(translate, 'value', value), None,
+                _attr(translate, 'class', self.css_class), u'>',
+                _text(translate, description), u'</option>')
+
+    def _radio_choice(self, translate, index, value, description):
+        oid = self._oid
+        return (u'\n      <li class="deformSet-item">\n'
+                u'          <input type="radio" name="', oid, u'"',
+                _attr(translate, 'value', value), u' id="', oid,
+                u'-%d"' % index, None,
+                _attr(translate, 'class', self.css_class),
+                u' />\n          <label for="', oid,
+                u'-%d">' % index, _text(translate, description),
+                u'</label>\n        </li>\n      ')
+
+    def render(self, oid, cstruct):
+        """ Return the markup of the options for a field with the oid
+        ``oid`` and the value ``cstruct``, or ``None`` if the values
+        are not all strings."""
+        parts = self.parts
+        if parts is None:
+            return None
+        places = self.places.get(cstruct)
+        if places:
+            attr = self.template == 'select' and 'selected' or 'checked'
+            attr = u' %s="True"' % attr
+            parts = list(parts)
+            for index, offset in reversed(places):
+                part = parts[index]
+                parts[index] = part[:offset] + attr + part[offset:]
+        oid = _escape(unicode(oid))
+        if '"' in oid:
+            oid = oid.replace('"', '&quot;')
+        return oid.join(parts)
+
+_strings = (str, unicode)
+
+# widget -> the _OptionMarkup of its values
+_option_markup = weakref.WeakKeyDictionary()
+
+# (widget, values) of the select widget and (widget, min_len) of the
+# sequence widget being serialized by this thread
+_serializing = threading.local()
+
+# the templates which can render an _OptionMarkup, and their file
+_option_templates = dict(
+    (name, os.path.abspath(os.path.join(default_dir, name + '.pt')))
+    for name in ('select', 'radio_choice'))
+
+class SelectWidget(_ValuesWidget):
     """
     Renders ``<select>`` field based on a predefined set of values.
 
@@ -541,6 +933,24 @@ class SelectWidget(Widget):
         element in the tuple is the value that should be returned when
         the form is posted.  The second is the display value.
 
+        ``values`` may also be a callable which takes no argument and
+        returns such a sequence: a *values provider*, for values which
+        change while the application runs (for example, rows of a
+        database table).  The provider is called when the widget is
+        rendered, never when it is deserialized or when its field is
+        not rendered.  The values it returns are cached according to
+        ``values_ttl``, and :meth:`invalidate_values` discards them.
+        A widget with a provider is not ``cacheable`` (see
+        :class:`deform.field.FragmentCache`).
+
+    values_ttl
+        If ``values`` is a callable, the number of seconds for which
+        the values it returns are cached by the widget, so that the
+        provider is called at most once during this time by all the
+        threads rendering the widget.  If it is ``None`` or ``0``, the
+        provider is called each time the widget is rendered.  Default:
+        ``None``.
+
     null_value
         The value which represents the null value.  When the null
         value is encountered during serialization, the
@@ -559,13 +969,70 @@ class SelectWidget(Widget):
     template = 'select'
     readonly_template = 'readonly/select'
     null_value = ''
-    values = ()
 
     def serialize(self, field, cstruct, readonly=False):
         if cstruct in (null, None):
             cstruct = self.null_value
-        template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct)
+        values = self.values
+        if readonly:
+            return self.render_template(field.renderer,
+                                        self.readonly_template,
+                                        field=field, cstruct=cstruct,
+                                        values=values)
+        # ``options`` uses the values obtained here from the provider
+        # instead of calling it again
+        previous = getattr(_serializing, 'values', None)
+        _serializing.values = (self, values)
+        try:
+            options = self.options(field, cstruct)
+        finally:
+            _serializing.values = previous
+        return self.render_template(field.renderer, self.template,
+                                    field=field, cstruct=cstruct,
+                                    values=values, options=options)
+
+    def options(self, field, cstruct):
+        """ Return the markup of the options (the ``<option>`` elements
+        of the ``select`` template, the list items of the
+        ``radio_choice`` template) for ``field`` and ``cstruct``, or
+        ``None`` if the template must render them itself.
+
+        The markup is computed once for the ``values`` and ``css_class``
+        of the widget, and only the selected option is changed for each
+        rendering, so that the cost of rendering a widget with many
+        values hardly depends on their number.  This requires a
+        renderer with a ``handle`` method which resolves ``template``
+        to one of these Deform templates (and not to a template
+        overriding it in another directory of the search path), and
+        values and descriptions which are plain strings (translation
+        strings are left to the template)."""
+        template = self.template
+        filename = _option_templates.get(template)
+        handle = getattr(field.renderer, 'handle', None)
+        if filename is None or handle is None:
+            return None
+        tmpl = handle(template)
+        if getattr(tmpl, 'filename', None) != filename:
+            return None
+        encoding = getattr(tmpl, 'encoding', None)
+        current = getattr(_serializing, 'values', None)
+        if current is not None and current[0] is self:
+            values = current[1]
+        else:
+            values = self.values
+        values = tuple(values)
+        markup = _option_markup.get(self)
+        if (markup is None or markup.template != template or
+            markup.css_class != self.css_class or
+            markup.encoding != encoding or
+            not (markup.values is values or markup.values == values)):
+            markup = _OptionMarkup(template, values, self.css_class,
+                                   encoding)
+            _option_markup[self] = markup
+        try:
+            return markup.render(field.oid, cstruct)
+        except TypeError: # unhashable cstruct
+            return None
 
     def deserialize(self, field, pstruct):
         if pstruct in (null, self.null_value):
@@ -584,7 +1051,13 @@ class RadioChoiceWidget(SelectWidget):
         **unicode** values) indicating allowable, displayed values,
         e.g. ``( ('true', 'True'), ('false', 'False') )``.  The first
         element in the tuple is the value that should be returned when
-        the form is posted.  The second is the display value.
+        the form is posted.  The second is the display value.  It
+        may also be a values provider (see
+        :class:`deform.widget.SelectWidget`).
+
+    values_ttl
+        The number of seconds for which the values returned by a
+        values provider are cached.  Default: ``None``.
 
     template
         The template name used to render the widget.  Default:
@@ -602,7 +1075,7 @@ class RadioChoiceWidget(SelectWidget):
     template = 'radio_choice'
     readonly_template = 'readonly/radio_choice'
 
-class CheckboxChoiceWidget(Widget):
+class CheckboxChoiceWidget(_ValuesWidget):
     """
     Renders a sequence of ``<input type="check"/>`` buttons based on a
     predefined set of values.
@@ -614,7 +1087,13 @@ class CheckboxChoiceWidget(Widget):
         **unicode** values) indicating allowable, displayed values,
         e.g. ``( ('true', 'True'), ('false', 'False') )``.  The first
         element in the tuple is the value that should be returned when
-        the form is posted.  The second is the display value.
+        the form is posted.  The second is the display value.  It
+        may also be a values provider (see
+        :class:`deform.widget.SelectWidget`).
+
+    values_ttl
+        The number of seconds for which the values returned by a
+        values provider are cached.  Default: ``None``.
 
     template
         The template name used to render the widget.  Default:
@@ -631,21 +1110,38 @@ class CheckboxChoiceWidget(Widget):
     """
     template = 'checkbox_choice'
     readonly_template = 'readonly/checkbox_choice'
-    values = ()
 
     def serialize(self, field, cstruct, readonly=False):
         if cstruct in (null, None):
             cstruct = ()
         template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct)
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=cstruct,
+                                    values=self.values,
+                                    selected=_selected(cstruct))
 
     def deserialize(self, field, pstruct):
         if pstruct is null:
             return null
         if isinstance(pstruct, basestring):
             return (pstruct,)
+        if pstruct.__class__ is tuple:
+            return pstruct
         return tuple(pstruct)
 
+def _selected(cstruct):
+    # the values of ``cstruct`` as a set, for the templates of
+    # CheckboxChoiceWidget to test each value in constant time; a
+    # string (a single value, but a sequence of characters to ``in``)
+    # and unhashable values are left alone
+    if isinstance(cstruct, (set, frozenset)) or isinstance(cstruct,
+                                                          basestring):
+        return cstruct
+    try:
+        return frozenset(cstruct)
+    except TypeError:
+        return cstruct
+
 class CheckedInputWidget(Widget):
     """
     Renders two text input fields: 'value' and 'confirm'.
@@ -711,10 +1207,11 @@ class CheckedInputWidget(Widget):
             cstruct = ''
         confirm = getattr(field, 'confirm', '')
         template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct,
-                              confirm=confirm, subject=self.subject,
-                              confirm_subject=self.confirm_subject,
-                              )
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=cstruct,
+                                    confirm=confirm, subject=self.subject,
+                                    confirm_subject=self.confirm_subject,
+                                    )
 
     def deserialize(self, field, pstruct):
         if pstruct is null:
@@ -786,9 +1283,17 @@ class MappingWidget(Widget):
     def serialize(self, field, cstruct, readonly=False):
         if cstruct in (null, None):
             cstruct = {}
-        template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct,
-                              null=null)
+        if readonly:
+            template = self.readonly_template
+            item_template = self.readonly_item_template
+        else:
+            template = self.template
+            item_template = self.item_template
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=cstruct,
+                                    null=null,
+                                    inline=_inline(field.renderer,
+                                                   item_template))
 
     def deserialize(self, field, pstruct):
         error = None
@@ -841,6 +1346,212 @@ class FormWidget(MappingWidget):
     template = 'form'
     readonly_template = 'readonly/form'
 
+    def serialize(self, field, cstruct, readonly=False):
+        # sequences rendered as part of this form emit each of their
+        # prototypes once, see ``SequenceWidget.serialize``
+        previous = getattr(_page, 'prototypes', None)
+        _page.prototypes = _PrototypeRegistry()
+        try:
+            return MappingWidget.serialize(self, field, cstruct,
+                                           readonly=readonly)
+        finally:
+            _page.prototypes = previous
+
+# per-thread state of the form being rendered
+_page = threading.local()
+
+_script_end = re.compile(r'</(script)', re.I)
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+# widget -> (a copy of its attributes, its configuration)
+_configs = weakref.WeakKeyDictionary()
+
+def _snapshot(value):
+    # a copy of a widget attribute which does not change when the
+    # attribute is changed in place (lists and dictionaries only)
+    if isinstance(value, list):
+        return tuple(value)
+    if isinstance(value, dict):
+        return tuple(value.items())
+    return value
+
+def _config(wdg):
+    # the attributes of the widget as a hashable tuple, computed again
+    # only when they change: repr-ing long lists of values is slow
+    snapshot = dict([ (k, _snapshot(v)) for k, v in wdg.__dict__.items() ])
+    memo = _configs.get(wdg)
+    if memo is not None and memo[0] == snapshot:
+        return memo[1]
+    config = tuple(sorted([ (k, _hashable(v))
+                            for k, v in wdg.__dict__.items() ]))
+    _configs[wdg] = (snapshot, config)
+    return config
+
+def _fingerprint(field):
+    # a hashable description of what the rendering of ``field`` depends
+    # on: the schema node, widget class and widget attributes of the
+    # field and of its subfields
+    result = []
+    stack = [field]
+    while stack:
+        field = stack.pop()
+        wdg = field.widget
+        result.append((field.schema, wdg.__class__, _config(wdg)))
+        stack.extend(field.children)
+    return tuple(result)
+
+class _PrototypeRegistry(object):
+    # The sequence prototypes of a form rendering.  Each prototype is
+    # rendered once and emitted once, as a ``<script
+    # type="text/template">`` block; sequences refer to it by an id
+    # derived from its text.  The ids of the values emitted by
+    # autocomplete widgets with ``share_values`` are added to
+    # ``emitted`` too.
+    def __init__(self):
+        self.ids = {}
+        self.emitted = set()
+        self.pending = []
+        # (id, text) of the prototypes registered while rendering
+        # each of the prototypes being rendered
+        self.nested = []
+
+    def register(self, widget, field):
+        # return the id of the prototype of the sequence ``field``,
+        # rendering it (or finding it in the widget's prototype cache)
+        # if this is the first sequence using it
+        item_field = field.children[0]
+        key = (_fingerprint(item_field), widget.item_template)
+        protos = self.ids.get(key)
+        if protos is None:
+            cache = widget.prototype_cache
+            if cache is not None:
+                cachekey = cache.key(key, field.renderer)
+                protos = cache.get(cachekey)
+            if protos is None:
+                # sequences nested in the prototype only register theirs
+                self.nested.append([])
+                try:
+                    proto = widget.render_prototype(field)
+                finally:
+                    nested = self.nested.pop()
+                # the prototype may contain script tags
+                proto = _script_end.sub(r'<\/\1', proto)
+                if isinstance(proto, unicode):
+                    digest = md5(proto.encode('utf-8'))
+                else:
+                    digest = md5(proto)
+                protoid = 'deformPrototype-%s' % digest.hexdigest()[:16]
+                protos = []
+                for item in nested + [(protoid, proto)]:
+                    if item not in protos:
+                        protos.append(item)
+                if cache is not None:
+                    cache.set(cachekey, protos, field.renderer)
+            self.ids[key] = protos
+        for protoid, proto in protos:
+            if protoid not in self.emitted:
+                self.emitted.add(protoid)
+                self.pending.append((protoid, proto))
+        if self.nested:
+            self.nested[-1].extend(protos)
+        return protos[-1][0]
+
+    def flush(self):
+        # return the (id, text) of the prototypes to be emitted by the
+        # sequence being rendered
+        if self.nested:
+            return []
+        pending = self.pending
+        self.pending = []
+        return pending
+
+class PrototypeCache(object):
+    """ A bounded cache of rendered sequence prototypes, shared by all
+    the forms (and requests, and threads) which use it.  See the
+    ``prototype_cache`` attribute of
+    :class:`deform.widget.SequenceWidget`.
+
+    A prototype is looked up by the schema nodes and the widget
+    classes and attributes of the item field of the sequence and its
+    subfields, the item template and renderer of the sequence, and the
+    current locale.  When more than ``maxsize`` prototypes are cached,
+    the least recently used one is discarded.
+
+    ``locale``, if passed, is a callable which returns the name of
+    the current locale; pass it if the renderer translates into the
+    language of each request.  If the renderer has a ``generation``
+    attribute (as :class:`deform.ZPTRendererFactory` renderers do), a
+    change of its value (e.g. because a template was reloaded)
+    invalidates the prototypes rendered with it.
+
+    *Attributes*
+
+        hits
+            The number of prototypes found in the cache.
+
+        misses
+            The number of prototypes not found in the cache (and
+            therefore rendered).
+    """
+    def __init__(self, maxsize=100, locale=None):
+        self.maxsize = maxsize
+        self.locale = locale
+        self.hits = 0
+        self.misses = 0
+        self._entries = _OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, key, renderer):
+        locale = self.locale
+        if locale is not None:
+            locale = locale()
+        return key, renderer, locale
+
+    def get(self, key):
+        generation = getattr(key[1], 'generation', None)
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, renderer):
+        # the generation after rendering: loading the templates for the
+        # first time also changes it
+        generation = getattr(renderer, 'generation', None)
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+            self._entries[key] = (generation, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Discard all the cached prototypes and reset the counters."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self.hits = self.misses = 0
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
 class SequenceWidget(Widget):
     """Renders a sequence (0 .. N widgets, each the same as the other)
     into a set of fields.
@@ -894,6 +1605,25 @@ class SequenceWidget(Widget):
         ``None`` (meaning no maximum).  The JavaScript sequence management
         will not allow more than this many subwidgets to be added to the
         sequence.
+
+    The JavaScript sequence management adds items by copying a
+    *prototype* (see
+    :meth:`deform.widget.SequenceWidget.render_prototype`).  When the
+    sequence is rendered as part of a :class:`deform.Form`, each
+    distinct prototype is emitted once in the form as a ``<script
+    type="text/template">`` block, which sequences refer to by id (the
+    ``prototype_id`` template value); nested sequences refer to their
+    own prototype instead of embedding it in the prototype of the
+    enclosing sequence.  Otherwise the prototype is URL-quoted into an
+    attribute of the sequence (see
+    :meth:`deform.widget.SequenceWidget.prototype`).
+
+    prototype_cache
+        ``None`` or a :class:`deform.widget.PrototypeCache` in which
+        the prototypes emitted in forms are kept across renderings, so
+        that the item template is not rendered again for each request.
+        Set it on the :class:`deform.widget.SequenceWidget` class to
+        cache the prototypes of all sequences.  Default: ``None``.
     """
     template = 'sequence'
     readonly_template = 'readonly/sequence'
@@ -902,37 +1632,69 @@ class SequenceWidget(Widget):
     error_class = None
     add_subitem_text_template = _('Add ${subitem_title}')
     render_initial_item = False
-    min_len = None
     max_len = None
+    prototype_cache = None
     requirements = ( ('deform', None), )
 
-    def prototype(self, field):
+    def _get_min_len(self):
+        # while the widget is serialized, templates reading
+        # ``field.widget.min_len`` see the effective minimum length
+        current = getattr(_serializing, 'min_len', None)
+        if current is not None and current[0] is self:
+            return current[1]
+        return self.__dict__.get('min_len')
+
+    def _set_min_len(self, min_len):
+        self.__dict__['min_len'] = min_len
+
+    min_len = property(_get_min_len, _set_min_len)
+
+    def _clone_item(self, field, item_field, num):
+        # clone the item field for the ``num``th item of the sequence
+        subfield = item_field.clone()
+        if field.oid_prefix is not None:
+            subfield._rebase_oid('%s__%s' % (field.oid, num))
+        return subfield
+
+    def render_prototype(self, field):
+        """ Return the rendering of an empty item of the sequence
+        ``field``, which is used by ``deform.js`` to add items to the
+        sequence. """
         # we clone the item field to bump the oid (for easier
         # automated testing; finding last node)
         item_field = field.children[0].clone()
-        proto = field.renderer(self.item_template, field=item_field,
-                               cstruct=null, parent=field)
+        return self.render_template(item_field.renderer, self.item_template,
+                                    field=item_field,
+                                    cstruct=null, parent=field)
+
+    def prototype(self, field):
+        """ Return the prototype of the sequence ``field`` (see
+        :meth:`deform.widget.SequenceWidget.render_prototype`), UTF-8
+        encoded and URL-quoted so that it can be used as the value of
+        an attribute."""
+        proto = self.render_prototype(field)
         if isinstance(proto, unicode):
             proto = proto.encode('utf-8')
         proto = urllib.quote(proto)
         return proto
 
     def serialize(self, field, cstruct, readonly=False):
-        if (self.render_initial_item and self.min_len is None):
+        min_len = self.min_len
+        if (self.render_initial_item and min_len is None):
             # This is for compat only: ``render_initial_item=True`` should
             # now be spelled as ``min_len = 1``
-            self.min_len = 1
+            min_len = 1
 
         if cstruct in (null, None):
-            if self.min_len is not None:
-                cstruct = [null] * self.min_len
+            if min_len is not None:
+                cstruct = [null] * min_len
             else:
                 cstruct = []
 
         cstructlen = len(cstruct)
 
-        if self.min_len is not None and (cstructlen < self.min_len):
-            cstruct = list(cstruct) + ([null] * (self.min_len-cstructlen))
+        if min_len is not None and (cstructlen < min_len):
+            cstruct = list(cstruct) + ([null] * (min_len-cstructlen))
 
         item_field = field.children[0]
 
@@ -944,21 +1706,45 @@ class SequenceWidget(Widget):
         else:
             # this serialization is being performed as a result of a
             # first-time rendering
-            subfields = [ (val, item_field.clone()) for val in cstruct ]
+            subfields = [ (val, self._clone_item(field, item_field, num))
+                          for num, val in enumerate(cstruct) ]
 
-        template = readonly and self.readonly_template or self.template
+        prototype_id = None
+        prototypes = ()
+        registry = getattr(_page, 'prototypes', None)
+        if registry is not None and not readonly:
+            prototype_id = registry.register(self, field)
+            prototypes = registry.flush()
+        # else: the template inlines the (quoted) prototype
+
+        if readonly:
+            template = self.readonly_template
+            item_template = self.readonly_item_template
+        else:
+            template = self.template
+            item_template = self.item_template
         add_template_mapping = dict(
             subitem_title=item_field.title,
             subitem_description=item_field.description,
             subitem_name=item_field.name)
         add_subitem_text = _(self.add_subitem_text_template,
                              mapping=add_template_mapping)
-        return field.renderer(template,
-                              field=field,
-                              cstruct=cstruct,
-                              subfields=subfields,
-                              item_field=item_field,
-                              add_subitem_text=add_subitem_text)
+        previous = getattr(_serializing, 'min_len', None)
+        _serializing.min_len = (self, min_len)
+        try:
+            return self.render_template(field.renderer, template,
+                                        field=field,
+                                        cstruct=cstruct,
+                                        subfields=subfields,
+                                        item_field=item_field,
+                                        add_subitem_text=add_subitem_text,
+                                        min_len=min_len,
+                                        prototype_id=prototype_id,
+                                        prototypes=prototypes,
+                                        inline=_inline(field.renderer,
+                                                       item_template))
+        finally:
+            _serializing.min_len = previous
 
     def deserialize(self, field, pstruct):
         result = []
@@ -971,7 +1757,7 @@ class SequenceWidget(Widget):
         item_field = field.children[0]
 
         for num, substruct in enumerate(pstruct):
-            subfield = item_field.clone()
+            subfield = self._clone_item(field, item_field, num)
             try:
                 subval = subfield.deserialize(substruct)
             except Invalid, e:
@@ -1033,6 +1819,8 @@ class FileUploadWidget(Widget):
     template = 'file_upload'
     readonly_template = 'readonly/file_upload'
     size = None
+    # serialize stores the file data in the tmpstore
+    cacheable = False
 
     def __init__(self, tmpstore, **kw):
         Widget.__init__(self, **kw)
@@ -1051,7 +1839,8 @@ class FileUploadWidget(Widget):
                 self.tmpstore[uid] = cstruct
 
         template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct)
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=cstruct)
 
     def deserialize(self, field, pstruct):
         if pstruct is null:
@@ -1139,8 +1928,9 @@ class DatePartsWidget(Widget):
         else:
             year, month, day = cstruct.split('-', 2)
         template = readonly and self.readonly_template or self.template
-        return field.renderer(template, field=field, cstruct=cstruct,
-                              year=year, month=month, day=day)
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=cstruct,
+                                    year=year, month=month, day=day)
 
     def deserialize(self, field, pstruct):
         if pstruct is null:
@@ -1206,7 +1996,8 @@ class TextAreaCSVWidget(Widget):
             template = self.readonly_template
         else:
             template = self.template
-        return field.renderer(template, field=field, cstruct=textrows)
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=textrows)
         
     def deserialize(self, field, pstruct):
         if pstruct is null:
@@ -1271,7 +2062,8 @@ class TextInputCSVWidget(Widget):
             template = self.readonly_template
         else:
             template = self.template
-        return field.renderer(template, field=field, cstruct=textrow)
+        return self.render_template(field.renderer, template,
+                                    field=field, cstruct=textrow)
         
     def deserialize(self, field, pstruct):
         if pstruct is null: